@@ -0,0 +1,268 @@
+"""Synthetic-data benchmarks for the I3D pipeline.
+
+Generates random mp4 videos, frame directories and a matching nslt split file, then measures
+    - NSLT loading throughput (samples/sec) for several DataLoader worker counts,
+    - frame directory loading (load_rgb_frames) throughput,
+    - videotransforms throughput,
+    - InceptionI3d forward and forward/backward latency for several batch sizes and clip lengths,
+    - full training step throughput (loss, backward, Adam step, as in train_i3d.py).
+Results are written as json; pass --compare to print the change against an earlier result file.
+
+    python benchmark_i3d.py --out bench_i3d.json
+    python benchmark_i3d.py --out bench_i3d_new.json --compare bench_i3d.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+from torchvision import transforms
+
+import videotransforms
+from datasets.nslt_dataset import NSLT, load_rgb_frames
+from pytorch_i3d import InceptionI3d
+
+
+def make_synthetic_data(root, num_videos=16, num_frames=72, height=256, width=320, num_classes=10, seed=0):
+    """Write random mp4 videos, per-frame jpg directories and an nslt-style split file under `root`."""
+    rng = np.random.RandomState(seed)
+    video_root = os.path.join(root, 'videos')
+    frame_root = os.path.join(root, 'frames')
+    os.makedirs(video_root, exist_ok=True)
+    os.makedirs(frame_root, exist_ok=True)
+
+    split = {}
+    for i in range(num_videos):
+        # make_dataset expects 5-character ids for whole-video samples
+        vid = str(i).zfill(5)
+        writer = cv2.VideoWriter(os.path.join(video_root, vid + '.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), 25,
+                                 (width, height))
+        os.makedirs(os.path.join(frame_root, vid), exist_ok=True)
+
+        # smooth random motion compresses like real footage better than white noise
+        base = rng.randint(0, 256, (height // 8, width // 8, 3)).astype(np.uint8)
+        for f in range(num_frames):
+            frame = cv2.resize(np.roll(base, f, axis=1), (width, height))
+            writer.write(frame)
+            cv2.imwrite(os.path.join(frame_root, vid, 'image_{}.jpg'.format(str(f + 1).zfill(5))), frame)
+        writer.release()
+
+        split[vid] = {'subset': 'train' if i % 4 else 'test', 'action': [i % num_classes, 1, num_frames]}
+
+    split_file = os.path.join(root, 'nslt_synthetic.json')
+    with open(split_file, 'w') as f:
+        json.dump(split, f)
+
+    return {'word': video_root}, frame_root, split_file
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device, warmup=1, iters=3):
+    """Mean and min seconds per call of `fn` after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    sync(device)
+
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        sync(device)
+        times.append(time.perf_counter() - start)
+    return float(np.mean(times)), float(np.min(times))
+
+
+def bench_nslt(video_root, split_file, worker_counts, batch_size, epochs=1):
+    train_transforms = transforms.Compose([videotransforms.RandomCrop(224), videotransforms.RandomHorizontalFlip()])
+    dataset = NSLT(split_file, 'train', video_root, 'rgb', train_transforms)
+
+    results = []
+    for num_workers in worker_counts:
+        loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+        start = time.perf_counter()
+        num_samples = 0
+        for _ in range(epochs):
+            for inputs, labels, vid in loader:
+                num_samples += inputs.size(0)
+        elapsed = time.perf_counter() - start
+        results.append({'name': 'nslt_loader', 'params': {'num_workers': num_workers, 'batch_size': batch_size},
+                        'samples_per_sec': num_samples / elapsed})
+    return results
+
+
+def bench_frame_dirs(frame_root, num_frames=64, iters=3):
+    vids = sorted(os.listdir(frame_root))
+    start = time.perf_counter()
+    for _ in range(iters):
+        for vid in vids:
+            load_rgb_frames(frame_root, vid, 1, num_frames)
+    elapsed = time.perf_counter() - start
+    return [{'name': 'load_rgb_frames', 'params': {'num_frames': num_frames},
+             'samples_per_sec': iters * len(vids) / elapsed}]
+
+
+def bench_transforms(num_frames=64, iters=20):
+    imgs = np.random.uniform(-1, 1, (num_frames, 256, 256, 3)).astype(np.float32)
+    cases = [('RandomCrop', videotransforms.RandomCrop(224)),
+             ('CenterCrop', videotransforms.CenterCrop(224)),
+             ('RandomHorizontalFlip', videotransforms.RandomHorizontalFlip(p=1.))]
+
+    results = []
+    for name, t in cases:
+        start = time.perf_counter()
+        for _ in range(iters):
+            t(imgs)
+        elapsed = time.perf_counter() - start
+        results.append({'name': 'videotransforms.' + name, 'params': {'num_frames': num_frames},
+                        'samples_per_sec': iters / elapsed})
+    return results
+
+
+def bench_model(device, num_classes, batch_sizes, clip_lengths, size, warmup, iters):
+    i3d = InceptionI3d(400, in_channels=3)
+    i3d.replace_logits(num_classes)
+    i3d.to(device)
+
+    results = []
+    for batch_size in batch_sizes:
+        for num_frames in clip_lengths:
+            params = {'batch_size': batch_size, 'num_frames': num_frames, 'size': size}
+            inputs = torch.randn(batch_size, 3, num_frames, size, size, device=device)
+
+            i3d.eval()
+
+            def forward():
+                with torch.no_grad():
+                    i3d(inputs)
+
+            mean_s, min_s = time_fn(forward, device, warmup, iters)
+            results.append({'name': 'i3d_forward', 'params': params, 'mean_ms': 1000 * mean_s,
+                            'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s})
+
+            i3d.train()
+
+            def forward_backward():
+                i3d.zero_grad()
+                i3d(inputs).sum().backward()
+
+            mean_s, min_s = time_fn(forward_backward, device, warmup, iters)
+            results.append({'name': 'i3d_forward_backward', 'params': params, 'mean_ms': 1000 * mean_s,
+                            'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s})
+    return results
+
+
+def bench_train_step(device, num_classes, batch_size, num_frames, size, warmup, iters):
+    i3d = InceptionI3d(400, in_channels=3)
+    i3d.replace_logits(num_classes)
+    i3d.to(device)
+    i3d.train()
+    optimizer = optim.Adam(i3d.parameters(), lr=1e-3, weight_decay=1e-7)
+
+    inputs = torch.randn(batch_size, 3, num_frames, size, size, device=device)
+    labels = torch.zeros(batch_size, num_classes, num_frames, device=device)
+    labels[:, 0] = 1
+
+    def step():
+        optimizer.zero_grad()
+        per_frame_logits = F.interpolate(i3d(inputs), num_frames, mode='linear')
+        loc_loss = F.binary_cross_entropy_with_logits(per_frame_logits, labels)
+        cls_loss = F.binary_cross_entropy_with_logits(torch.max(per_frame_logits, dim=2)[0],
+                                                      torch.max(labels, dim=2)[0])
+        (0.5 * loc_loss + 0.5 * cls_loss).backward()
+        optimizer.step()
+
+    mean_s, min_s = time_fn(step, device, warmup, iters)
+    return [{'name': 'i3d_train_step', 'params': {'batch_size': batch_size, 'num_frames': num_frames, 'size': size},
+             'mean_ms': 1000 * mean_s, 'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s}]
+
+
+def environment(device):
+    env = {'torch': torch.__version__, 'cv2': cv2.__version__, 'python': platform.python_version(),
+           'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'torch_threads': torch.get_num_threads(),
+           'device': str(device)}
+    if device.type == 'cuda':
+        env['gpu'] = torch.cuda.get_device_name(device)
+    return env
+
+
+def result_key(r):
+    return r['name'] + json.dumps(r['params'], sort_keys=True)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+
+    print('{:<28} {:<55} {:>12} {:>12} {:>8}'.format('benchmark', 'params', 'baseline', 'current', 'ratio'))
+    for r in results:
+        b = baseline.get(result_key(r))
+        if b is None:
+            continue
+        print('{:<28} {:<55} {:>12.2f} {:>12.2f} {:>7.2f}x'.format(
+            r['name'], json.dumps(r['params'], sort_keys=True), b['samples_per_sec'], r['samples_per_sec'],
+            r['samples_per_sec'] / b['samples_per_sec']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', type=str, default='bench_i3d.json')
+    parser.add_argument('--compare', type=str, default=None, help='earlier result file to compare against')
+    parser.add_argument('--num_videos', type=int, default=16)
+    parser.add_argument('--num_classes', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--clip_lengths', type=int, nargs='+', default=[16, 32, 64])
+    parser.add_argument('--size', type=int, default=224)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--skip', type=str, nargs='*', default=[], choices=['data', 'model', 'train'])
+    parser.add_argument('--workdir', type=str, default=None, help='where to generate data (default: a temp dir)')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(0)
+    np.random.seed(0)
+
+    results = []
+    if 'data' not in args.skip:
+        workdir = args.workdir or tempfile.mkdtemp(prefix='wlasl_bench_')
+        try:
+            video_root, frame_root, split_file = make_synthetic_data(workdir, num_videos=args.num_videos,
+                                                                     num_classes=args.num_classes)
+            results += bench_nslt(video_root, split_file, args.workers, batch_size=min(args.batch_sizes))
+            results += bench_frame_dirs(frame_root)
+            results += bench_transforms()
+        finally:
+            if args.workdir is None:
+                shutil.rmtree(workdir)
+
+    if 'model' not in args.skip:
+        results += bench_model(device, args.num_classes, args.batch_sizes, args.clip_lengths, args.size,
+                               args.warmup, args.iters)
+
+    if 'train' not in args.skip:
+        results += bench_train_step(device, args.num_classes, max(args.batch_sizes), max(args.clip_lengths),
+                                    args.size, args.warmup, args.iters)
+
+    for r in results:
+        print(r)
+
+    with open(args.out, 'w') as f:
+        json.dump({'benchmark': 'i3d', 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'env': environment(device), 'results': results}, f, indent=2)
+    print('results written to {}'.format(args.out))
+
+    if args.compare:
+        compare(results, args.compare)
@@ -1,6 +1,15 @@
 import configparser
 
 
+def parse_phases(phases, phase_steps):
+    """'16x112, 64x224' and '0.5, 0.5' -> [(16, 112, 0.5), (64, 224, 0.5)]"""
+    shapes = [tuple(int(v) for v in p.strip().lower().split('x')) for p in phases.split(',')]
+    shares = [float(s) for s in phase_steps.split(',')]
+    if len(shapes) != len(shares):
+        raise ValueError('MULTIGRID: {} phases but {} PHASE_STEPS'.format(len(shapes), len(shares)))
+    return [(t, s, share) for (t, s), share in zip(shapes, shares)]
+
+
 class Config:
     def __init__(self, config_path):
         config = configparser.ConfigParser()
@@ -11,6 +20,24 @@ class Config:
         self.batch_size = int(train_config['BATCH_SIZE'])
         self.max_steps = int(train_config['MAX_STEPS'])
         self.update_per_step = int(train_config['UPDATE_PER_STEP'])
+        # keep every TEMPORAL_STRIDE-th frame when loading clips, optional
+        self.temporal_stride = int(train_config.get('TEMPORAL_STRIDE', 1))
+
+        # checkpointing, optional
+        self.keep_last = int(train_config.get('KEEP_LAST_CHECKPOINTS', 3))
+        self.keep_best = int(train_config.get('KEEP_BEST_CHECKPOINTS', 2))
+
+        # data pipeline profiling, optional (0 disables it)
+        self.profile_interval = int(train_config.get('PROFILE_INTERVAL', 0))
+
+        # multigrid training schedule, optional (see multigrid.py)
+        self.multigrid_phases = None
+        self.multigrid_max_batch_size = None
+        if config.has_section('MULTIGRID'):
+            mg_config = config['MULTIGRID']
+            self.multigrid_phases = parse_phases(mg_config['PHASES'], mg_config['PHASE_STEPS'])
+            if 'MAX_BATCH_SIZE' in mg_config:
+                self.multigrid_max_batch_size = int(mg_config['MAX_BATCH_SIZE'])
 
         # optimizer
         opt_config = config['OPTIMIZER']
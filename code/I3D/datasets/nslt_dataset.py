@@ -1,3 +1,5 @@
+import io
+import itertools
 import json
 import math
 import os
@@ -9,6 +11,8 @@ import numpy as np
 import torch
 import torch.utils.data as data_utl
 
+from pipeline_profiler import stage
+
 
 def video_to_tensor(pic):
     """Convert a ``numpy.ndarray`` to tensor.
@@ -40,7 +44,8 @@ def load_rgb_frames(image_dir, vid, start, num):
     return np.asarray(frames, dtype=np.float32)
 
 
-def load_rgb_frames_from_video(vid_root, vid, start, num, resize=(256, 256)):
+def load_rgb_frames_from_video(vid_root, vid, start, num, resize=(256, 256), profiler=None, stride=1):
+    """Load `num` frames starting at `start`, keeping every `stride`-th frame."""
     video_path = os.path.join(vid_root, vid + '.mp4')
 
     vidcap = cv2.VideoCapture(video_path)
@@ -50,25 +55,89 @@ def load_rgb_frames_from_video(vid_root, vid, start, num, resize=(256, 256)):
     total_frames = vidcap.get(cv2.CAP_PROP_FRAME_COUNT)
 
     vidcap.set(cv2.CAP_PROP_POS_FRAMES, start)
-    for offset in range(min(num, int(total_frames - start))):
-        success, img = vidcap.read()
+    for offset in range(min(num, int(math.ceil((total_frames - start) / stride)))):
+        with stage(profiler, 'decode'):
+            if offset > 0:
+                # skipped frames are grabbed but never converted to BGR images
+                for _ in range(stride - 1):
+                    vidcap.grab()
+            success, img = vidcap.read()
 
-        w, h, c = img.shape
-        if w < 226 or h < 226:
-            d = 226. - min(w, h)
-            sc = 1 + d / min(w, h)
-            img = cv2.resize(img, dsize=(0, 0), fx=sc, fy=sc)
+        with stage(profiler, 'resize_normalize'):
+            frames.append(preprocess_frame(img))
 
-        if w > 256 or h > 256:
-            img = cv2.resize(img, (math.ceil(w * (256 / w)), math.ceil(h * (256 / h))))
+    return np.asarray(frames, dtype=np.float32)
 
-        img = (img / 255.) * 2 - 1
 
-        frames.append(img)
+def _has_stream_capture():
+    """Whether cv2.VideoCapture can read from a python file object (OpenCV >= 4.9 built with FFMPEG)."""
+    registry = getattr(cv2, 'videoio_registry', None)
+    return (registry is not None and hasattr(registry, 'getStreamBufferedBackends')
+            and cv2.CAP_FFMPEG in registry.getStreamBufferedBackends())
+
+
+def iter_buffer_frames(source):
+    """Yield BGR frames of an encoded video held in memory (bytes) or a readable, seekable file object.
+
+    Decodes with OpenCV's stream reader when available and falls back to PyAV, so no temporary file is written.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    if _has_stream_capture():
+        vidcap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, [])
+        if not vidcap.isOpened():
+            raise IOError('could not open video stream')
+        try:
+            while True:
+                success, img = vidcap.read()
+                if not success:
+                    break
+                yield img
+        finally:
+            vidcap.release()
+        return
+
+    try:
+        import av
+    except ImportError:
+        raise ImportError('decoding videos from memory needs OpenCV >= 4.9 or PyAV (pip install av)')
+    with av.open(source) as container:
+        for frame in container.decode(video=0):
+            yield frame.to_ndarray(format='bgr24')
+
+
+def load_rgb_frames_from_buffer(source, start=0, num=None, profiler=None, stride=1):
+    """As load_rgb_frames_from_video, but for an in-memory video (bytes or a file object); all frames if num is None."""
+    stop = None if num is None else start + num * stride
+    frames = []
+    decoded = itertools.islice(iter_buffer_frames(source), start, stop, stride)
+    while True:
+        with stage(profiler, 'decode'):
+            img = next(decoded, None)
+        if img is None:
+            break
+
+        with stage(profiler, 'resize_normalize'):
+            frames.append(preprocess_frame(img))
 
     return np.asarray(frames, dtype=np.float32)
 
 
+def preprocess_frame(img):
+    """Resize a decoded (H x W x C) uint8 frame and scale it to [-1, 1], as done by the video loader."""
+    w, h, c = img.shape
+    if w < 226 or h < 226:
+        d = 226. - min(w, h)
+        sc = 1 + d / min(w, h)
+        img = cv2.resize(img, dsize=(0, 0), fx=sc, fy=sc)
+
+    if w > 256 or h > 256:
+        img = cv2.resize(img, (math.ceil(w * (256 / w)), math.ceil(h * (256 / h))))
+
+    return (img / 255.) * 2 - 1
+
+
 def load_flow_frames(image_dir, vid, start, num):
     frames = []
     for i in range(start, start + num):
@@ -151,8 +220,10 @@ def get_num_class(split_file):
 
 
 class NSLT(data_utl.Dataset):
+    # stages recorded when a pipeline_profiler.StageProfiler is set as `profiler`
+    PROFILE_STAGES = ('decode', 'resize_normalize', 'load', 'pad', 'transforms', 'to_tensor')
 
-    def __init__(self, split_file, split, root, mode, transforms=None):
+    def __init__(self, split_file, split, root, mode, transforms=None, num_frames=64, temporal_stride=1):
         self.num_classes = get_num_class(split_file)
 
         self.data = make_dataset(split_file, split, root, mode, num_classes=self.num_classes)
@@ -160,6 +231,9 @@ class NSLT(data_utl.Dataset):
         self.transforms = transforms
         self.mode = mode
         self.root = root
+        self.num_frames = num_frames
+        self.temporal_stride = temporal_stride
+        self.profiler = None
 
     def __getitem__(self, index):
         """
@@ -171,21 +245,32 @@ class NSLT(data_utl.Dataset):
         """
         vid, label, src, start_frame, nf = self.data[index]
 
-        total_frames = 64
-
         try:
-            start_f = random.randint(0, nf - total_frames - 1) + start_frame
+            start_f = random.randint(0, nf - self.num_frames * self.temporal_stride - 1) + start_frame
         except ValueError:
             start_f = start_frame
 
-        imgs = load_rgb_frames_from_video(self.root['word'], vid, start_f, total_frames)
+        return self.load_clip(index, start_f)
+
+    def load_clip(self, index, start_f):
+        """Load the clip of sample `index` that starts at frame `start_f`, transformed and padded."""
+        vid, label, src, start_frame, nf = self.data[index]
+
+        total_frames = self.num_frames
+
+        with stage(self.profiler, 'load'):
+            imgs = load_rgb_frames_from_video(self.root['word'], vid, start_f, total_frames, profiler=self.profiler,
+                                              stride=self.temporal_stride)
 
-        imgs, label = self.pad(imgs, label, total_frames)
+        with stage(self.profiler, 'pad'):
+            imgs, label = self.pad(imgs, label, total_frames)
 
-        imgs = self.transforms(imgs)
+        with stage(self.profiler, 'transforms'):
+            imgs = self.transforms(imgs)
 
-        ret_lab = torch.from_numpy(label)
-        ret_img = video_to_tensor(imgs)
+        with stage(self.profiler, 'to_tensor'):
+            ret_lab = torch.from_numpy(label)
+            ret_img = video_to_tensor(imgs)
 
         return ret_img, ret_lab, vid
 
@@ -1,4 +1,5 @@
 import json
+import math
 import os
 import os.path
 
@@ -21,7 +22,8 @@ def video_to_tensor(pic):
     return torch.from_numpy(pic.transpose([3, 0, 1, 2]))
 
 
-def load_rgb_frames_from_video(vid_root, vid, start, num):
+def load_rgb_frames_from_video(vid_root, vid, start, num, stride=1):
+    """Load every `stride`-th frame of the `num` frames starting at `start`."""
     video_path = os.path.join(vid_root, vid + '.mp4')
 
     vidcap = cv2.VideoCapture(video_path)
@@ -30,7 +32,11 @@ def load_rgb_frames_from_video(vid_root, vid, start, num):
     frames = []
 
     vidcap.set(cv2.CAP_PROP_POS_FRAMES, start)
-    for offset in range(num):
+    for offset in range(int(math.ceil(num / stride))):
+        if offset > 0:
+            # skipped frames are grabbed but never converted to BGR images
+            for _ in range(stride - 1):
+                vidcap.grab()
         success, img = vidcap.read()
 
         w, h, c = img.shape
@@ -123,8 +129,9 @@ def get_num_class(split_file):
 
 class NSLT(data_utl.Dataset):
 
-    def __init__(self, split_file, split, root, mode, transforms=None):
+    def __init__(self, split_file, split, root, mode, transforms=None, temporal_stride=1):
         self.num_classes = get_num_class(split_file)
+        self.temporal_stride = temporal_stride
 
         self.data = make_dataset(split_file, split, root, mode, self.num_classes)
         self.split_file = split_file
@@ -145,7 +152,7 @@ class NSLT(data_utl.Dataset):
         if self.mode == 'rgb':
             # imgs = load_rgb_frames(self.root, vid, start_f, start_e)
             # imgs = load_rgb_frames(self.root, vid, start_f, start_e)
-            imgs = load_rgb_frames_from_video(self.root, vid, start_f, start_e)
+            imgs = load_rgb_frames_from_video(self.root, vid, start_f, start_e, stride=self.temporal_stride)
         else:
             imgs = load_flow_frames(self.root, vid, start_f, start_e)
         # label = label[:, start_f:start_e]
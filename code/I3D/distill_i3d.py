@@ -0,0 +1,201 @@
+"""Distill a fine-tuned InceptionI3d into a small R(2+1)D student for cheap CPU inference.
+
+Every training video gets a fixed set of clip start frames. The teacher runs once over the center crop of each
+clip and its clip logits are cached on disk; the student is then trained on random crops and flips of the same
+clips against the cached logits plus the usual I3D loss, so the teacher is never run again after the first pass.
+
+    python distill_i3d.py -weights archived/asl100/ckpt.pt -num_classes 100 -split preprocess/nslt_100.json \
+        -root ../../data/WLASL2000 --widths 32 64 128 256 --blocks 1 1 1 1 --epochs 30 -save student_100.pt
+
+The cache is keyed by the teacher weights, split and clip settings, and is rebuilt when any of them change.
+At the end the teacher and the student are compared on the test split: top-1/5 accuracy, parameters and
+latency per clip on --latency_device.
+"""
+import argparse
+import os
+import random
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+from torchvision import transforms
+
+import videotransforms
+from datasets.nslt_dataset import NSLT as Dataset
+from early_exit_i3d import i3d_loss, measure_latency
+from prune_i3d import accuracy
+from pytorch_i3d import InceptionI3d
+from pytorch_r2plus1d import R2Plus1d
+
+
+def clip_starts(dataset, clips_per_video, seed=0):
+    """Fixed clip start frames for every sample of `dataset`, drawn like NSLT draws its random starts."""
+    rng = random.Random(seed)
+    clips = []
+    for index, (vid, label, src, start_frame, nf) in enumerate(dataset.data):
+        for _ in range(clips_per_video):
+            try:
+                start_f = rng.randint(0, nf - dataset.num_frames * dataset.temporal_stride - 1) + start_frame
+            except ValueError:
+                start_f = start_frame
+            clips.append((index, start_f))
+    return clips
+
+
+class CachedClips(torch.utils.data.Dataset):
+    """The fixed clips of an NSLT dataset, each returned with the cached teacher logits for it."""
+
+    def __init__(self, dataset, clips, teacher_logits=None):
+        self.dataset = dataset
+        self.clips = clips
+        self.teacher_logits = teacher_logits
+
+    def __getitem__(self, index):
+        sample_index, start_f = self.clips[index]
+        imgs, label, vid = self.dataset.load_clip(sample_index, start_f)
+        if self.teacher_logits is None:
+            return imgs, label, index
+        return imgs, label, self.teacher_logits[index].float()
+
+    def __len__(self):
+        return len(self.clips)
+
+
+def cache_teacher_logits(teacher, dataset, clips, cache_path, key, device, batch_size=6, num_workers=2):
+    """Clip logits (max over time) of the teacher for every clip, computed once and kept in `cache_path`."""
+    if os.path.exists(cache_path):
+        cache = torch.load(cache_path)
+        if cache['key'] == key:
+            print('using cached teacher logits from {}'.format(cache_path))
+            return cache['logits']
+        print('teacher logits in {} are stale, recomputing'.format(cache_path))
+
+    loader = torch.utils.data.DataLoader(CachedClips(dataset, clips), batch_size=batch_size, shuffle=False,
+                                         num_workers=num_workers)
+    teacher.eval()
+    logits = torch.zeros(len(clips), teacher._num_classes, dtype=torch.float16)
+    with torch.no_grad():
+        for batch_idx, (inputs, labels, index) in enumerate(loader):
+            logits[index] = torch.max(teacher(inputs.to(device)), dim=2)[0].cpu().half()
+            if (batch_idx + 1) % 50 == 0:
+                print('teacher logits {}/{}'.format((batch_idx + 1) * batch_size, len(clips)))
+
+    torch.save({'key': key, 'logits': logits}, cache_path)
+    print('teacher logits for {} clips cached in {}'.format(len(clips), cache_path))
+    return logits
+
+
+def distillation_loss(per_frame_logits, labels, teacher_logits, temperature=4., alpha=0.7):
+    """alpha * soft-target KL divergence on clip logits + (1 - alpha) * the I3D loss on the labels."""
+    student_logits = torch.max(per_frame_logits, dim=2)[0]
+    kd_loss = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                       F.softmax(teacher_logits / temperature, dim=1), reduction='batchmean')
+    return alpha * temperature ** 2 * kd_loss + (1 - alpha) * i3d_loss(per_frame_logits, labels)
+
+
+def train_student(student, dataloader, val_dataloader, epochs, lr, device, temperature, alpha, save_path):
+    optimizer = optim.Adam(student.parameters(), lr=lr, weight_decay=1e-7)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+    best_val_score = 0
+    for epoch in range(epochs):
+        student.train()
+        tot_loss = 0.
+        for batch_idx, (inputs, labels, teacher_logits) in enumerate(dataloader):
+            inputs, labels, teacher_logits = inputs.to(device), labels.to(device), teacher_logits.to(device)
+            loss = distillation_loss(student(inputs), labels, teacher_logits, temperature, alpha)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            tot_loss += loss.item()
+            if (batch_idx + 1) % 10 == 0:
+                print('Epoch {} [{}/{}] distillation loss: {:.4f}'.format(epoch, batch_idx + 1, len(dataloader),
+                                                                          tot_loss / 10))
+                tot_loss = 0.
+        scheduler.step()
+
+        val_score = accuracy(student, val_dataloader, device)[0]
+        print('Epoch {} VALIDATION top1: {:.4f}'.format(epoch, val_score))
+        if val_score >= best_val_score:
+            best_val_score = val_score
+            save_student(student, save_path)
+            print('student saved to {}'.format(save_path))
+
+
+def save_student(student, path):
+    torch.save({'num_classes': student.logits.out_channels, 'widths': student.widths, 'blocks': student.blocks,
+                'state_dict': student.state_dict()}, path)
+
+
+def load_student(path, map_location='cpu'):
+    checkpoint = torch.load(path, map_location=map_location)
+    student = R2Plus1d(checkpoint['num_classes'], widths=checkpoint['widths'], blocks=checkpoint['blocks'])
+    student.load_state_dict(checkpoint['state_dict'])
+    return student
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-weights', type=str, required=True, help='fine-tuned InceptionI3d state dict (teacher)')
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('-split', type=str, required=True)
+    parser.add_argument('-root', type=str, required=True)
+    parser.add_argument('-save', type=str, default='student_r2plus1d.pt')
+    parser.add_argument('--cache', type=str, default=None, help='teacher logits cache (default: next to -save)')
+    parser.add_argument('--widths', type=int, nargs=4, default=[32, 64, 128, 256])
+    parser.add_argument('--blocks', type=int, nargs=4, default=[1, 1, 1, 1])
+    parser.add_argument('--clips_per_video', type=int, default=4)
+    parser.add_argument('--num_frames', type=int, default=64)
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--batch_size', type=int, default=12)
+    parser.add_argument('--temperature', type=float, default=4.)
+    parser.add_argument('--alpha', type=float, default=0.7, help='weight of the distillation term')
+    parser.add_argument('--latency_device', type=str, default='cpu', help='device the latency is measured on')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    root = {'word': args.root}
+    torch.manual_seed(0)
+    np.random.seed(0)
+
+    teacher = InceptionI3d(400, in_channels=3)
+    teacher.replace_logits(args.num_classes)
+    teacher.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    teacher.to(device)
+
+    # the same clips are loaded with a center crop for the teacher and with augmentation for the student
+    train_transforms = transforms.Compose([videotransforms.RandomCrop(224), videotransforms.RandomHorizontalFlip()])
+    test_transforms = transforms.Compose([videotransforms.CenterCrop(224)])
+    teacher_dataset = Dataset(args.split, 'train', root, 'rgb', test_transforms, num_frames=args.num_frames)
+    train_dataset = Dataset(args.split, 'train', root, 'rgb', train_transforms, num_frames=args.num_frames)
+    test_dataset = Dataset(args.split, 'test', root, 'rgb', test_transforms, num_frames=args.num_frames)
+
+    clips = clip_starts(train_dataset, args.clips_per_video)
+    cache_path = args.cache or os.path.splitext(args.save)[0] + '_teacher_logits.pt'
+    key = {'weights': os.path.abspath(args.weights), 'mtime': os.path.getmtime(args.weights),
+           'split': os.path.abspath(args.split), 'num_frames': args.num_frames, 'clips': clips}
+    teacher_logits = cache_teacher_logits(teacher, teacher_dataset, clips, cache_path, key, device)
+
+    dataloader = torch.utils.data.DataLoader(CachedClips(train_dataset, clips, teacher_logits),
+                                             batch_size=args.batch_size, shuffle=True, num_workers=2,
+                                             pin_memory=True)
+    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=args.batch_size, shuffle=False,
+                                              num_workers=2)
+
+    student = R2Plus1d(args.num_classes, widths=args.widths, blocks=args.blocks).to(device)
+    train_student(student, dataloader, test_loader, args.epochs, args.lr, device, args.temperature, args.alpha,
+                  args.save)
+
+    # compare the best student against the teacher
+    student = load_student(args.save)
+    latency_loader = torch.utils.data.DataLoader(test_dataset, batch_size=1, shuffle=False, num_workers=2)
+    print('{:<10} {:>7} {:>7} {:>9} {:>10}'.format('model', 'top1', 'top5', 'params M', 'ms/clip'))
+    for name, model in [('teacher', teacher), ('student', student)]:
+        top1, top5 = accuracy(model.to(device), test_loader, device)
+        ms = 1000 * measure_latency(model.to(args.latency_device), latency_loader, args.latency_device, max_clips=20)
+        print('{:<10} {:>7.4f} {:>7.4f} {:>9.2f} {:>10.1f}'.format(
+            name, top1, top5, sum(p.numel() for p in model.parameters()) / 1e6, ms))
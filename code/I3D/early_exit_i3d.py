@@ -0,0 +1,314 @@
+"""Early-exit inference for I3D with lightweight classifiers on intermediate endpoints.
+
+The heads are trained on top of a frozen, already fine-tuned InceptionI3d. At inference a clip leaves the
+network at the first head whose softmax confidence reaches the threshold, and only clips that stay uncertain
+pay for the remaining endpoints.
+
+Train heads on Mixed_4f and Mixed_5b:
+    python early_exit_i3d.py train -weights archived/asl100/ckpt.pt -num_classes 100 \
+        -split preprocess/nslt_100.json -root ../../data/WLASL2000 --exits Mixed_4f Mixed_5b -save heads_100.pt
+
+Report accuracy against average compute for a range of thresholds:
+    python early_exit_i3d.py evaluate -weights archived/asl100/ckpt.pt -num_classes 100 \
+        -split preprocess/nslt_100.json -root ../../data/WLASL2000 -heads heads_100.pt
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torchvision import transforms
+
+import videotransforms
+from datasets.nslt_dataset import NSLT as Dataset
+from i3d_profiler import EndpointProfiler
+from pytorch_i3d import InceptionI3d, InceptionModule, Unit3D
+
+
+def endpoint_channels(i3d, end_point):
+    """Number of output channels of `end_point` in a built InceptionI3d."""
+    channels = None
+    for name in i3d.VALID_ENDPOINTS:
+        if name not in i3d.end_points:
+            break
+        module = i3d.end_points[name]
+        if isinstance(module, InceptionModule):
+            channels = sum(b._output_channels for b in (module.b0, module.b1b, module.b2b, module.b3b))
+        elif isinstance(module, Unit3D):
+            channels = module._output_channels
+        if name == end_point:
+            return channels
+    raise ValueError('Unknown endpoint %s' % end_point)
+
+
+class ExitHead(nn.Module):
+    """Spatial average pooling, dropout and a 1x1x1 classifier; returns per-frame logits like InceptionI3d."""
+
+    def __init__(self, in_channels, num_classes, dropout_keep_prob=0.5):
+        super(ExitHead, self).__init__()
+        self.dropout = nn.Dropout(dropout_keep_prob)
+        self.logits = Unit3D(in_channels=in_channels, output_channels=num_classes,
+                             kernel_shape=[1, 1, 1],
+                             padding=0,
+                             activation_fn=None,
+                             use_batch_norm=False,
+                             use_bias=True,
+                             name='exit_logits')
+
+    def forward(self, x):
+        x = F.adaptive_avg_pool3d(x, (x.size(2), 1, 1))
+        return self.logits(self.dropout(x)).squeeze(3).squeeze(3)
+
+
+def clip_probs(per_frame_logits):
+    return F.softmax(torch.mean(per_frame_logits, dim=2), dim=1)
+
+
+class EarlyExitI3d(nn.Module):
+    def __init__(self, backbone, exits, num_classes):
+        super(EarlyExitI3d, self).__init__()
+        for end_point in exits:
+            assert end_point in backbone.end_points, 'Endpoint %s is not built in the backbone' % end_point
+
+        self.backbone = backbone
+        self.exits = [e for e in backbone.VALID_ENDPOINTS if e in exits]
+        self.heads = nn.ModuleDict([(e, ExitHead(endpoint_channels(backbone, e), num_classes)) for e in self.exits])
+
+    def freeze_backbone(self):
+        for p in self.backbone.parameters():
+            p.requires_grad = False
+        self.backbone.eval()
+
+    def forward_all(self, x):
+        """Run the whole network and return the per-frame logits of every head plus the final ones."""
+        outputs = {}
+        with torch.no_grad():
+            for end_point in self.backbone.VALID_ENDPOINTS:
+                if end_point in self.backbone.end_points:
+                    x = self.backbone._run_endpoint(end_point, x)
+                    if end_point in self.heads:
+                        # heads are the only trainable part, so only they see gradients
+                        with torch.enable_grad():
+                            outputs[end_point] = self.heads[end_point](x.detach())
+            outputs['Logits'] = self.backbone._run_head(x).squeeze(3).squeeze(3)
+        return outputs
+
+    def forward(self, x, threshold=0.9):
+        """Early-exit inference.
+
+        Returns per-clip class probabilities (B x C) and, for each clip, the name of the exit it left at
+        ('Logits' when no head was confident enough).
+        """
+        batch = x.size(0)
+        probs = None
+        exited_at = ['Logits'] * batch
+        remaining = torch.arange(batch, device=x.device)
+
+        for end_point in self.backbone.VALID_ENDPOINTS:
+            if end_point not in self.backbone.end_points:
+                continue
+            x = self.backbone._run_endpoint(end_point, x)
+
+            if end_point in self.heads:
+                head_probs = clip_probs(self.heads[end_point](x))
+                if probs is None:
+                    probs = torch.zeros(batch, head_probs.size(1), device=head_probs.device)
+
+                confident = torch.max(head_probs, dim=1)[0] >= threshold
+                if confident.any():
+                    done = remaining[confident]
+                    probs[done] = head_probs[confident]
+                    for i in done.tolist():
+                        exited_at[i] = end_point
+
+                    remaining = remaining[~confident]
+                    x = x[~confident]
+                    if remaining.numel() == 0:
+                        return probs, exited_at
+
+        final_probs = clip_probs(self.backbone._run_head(x).squeeze(3).squeeze(3))
+        if probs is None:
+            return final_probs, exited_at
+        probs[remaining] = final_probs
+        return probs, exited_at
+
+
+def build_model(weights, num_classes, exits, heads=None, device='cpu'):
+    i3d = InceptionI3d(400, in_channels=3)
+    i3d.replace_logits(num_classes)
+    i3d.load_state_dict(torch.load(weights, map_location='cpu'))
+
+    model = EarlyExitI3d(i3d, exits, num_classes)
+    if heads is not None:
+        model.heads.load_state_dict(heads)
+    model.freeze_backbone()
+    return model.to(device)
+
+
+def i3d_loss(per_frame_logits, labels):
+    """Localization plus classification loss, as in train_i3d.py."""
+    per_frame_logits = F.interpolate(per_frame_logits, labels.size(2), mode='linear')
+    loc_loss = F.binary_cross_entropy_with_logits(per_frame_logits, labels)
+    cls_loss = F.binary_cross_entropy_with_logits(torch.max(per_frame_logits, dim=2)[0],
+                                                  torch.max(labels, dim=2)[0])
+    return 0.5 * loc_loss + 0.5 * cls_loss
+
+
+def train_heads(model, dataloader, epochs, lr, device):
+    optimizer = optim.Adam(model.heads.parameters(), lr=lr, weight_decay=1e-7)
+
+    for epoch in range(epochs):
+        model.heads.train()
+        tot_loss = 0.
+        for batch_idx, (inputs, labels, vid) in enumerate(dataloader):
+            inputs, labels = inputs.to(device), labels.to(device)
+
+            outputs = model.forward_all(inputs)
+            loss = sum(i3d_loss(outputs[e], labels) for e in model.exits)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            tot_loss += loss.item()
+            if (batch_idx + 1) % 10 == 0:
+                print('Epoch {} [{}/{}] heads loss: {:.4f}'.format(epoch, batch_idx + 1, len(dataloader),
+                                                                   tot_loss / 10))
+                tot_loss = 0.
+
+
+def cumulative_gflops(model, input_shape, device):
+    """GFLOPs per clip spent when leaving at each exit, heads evaluated on the way included."""
+    profiler = EndpointProfiler()
+    model.backbone.enable_profiling(profiler)
+    with torch.no_grad():
+        model.forward_all(torch.zeros((1,) + tuple(input_shape[1:]), device=device))
+    model.backbone.disable_profiling()
+
+    head_gflops = {}
+    for e in model.exits:
+        conv = model.heads[e].logits.conv3d
+        head_gflops[e] = 2. * conv.in_channels * conv.out_channels * profiler.stats[e]['output_shape'][2] / 1e9
+
+    costs = {}
+    total = 0.
+    for name, s in profiler.stats.items():
+        total += s['flops'] / 1e9
+        if name in head_gflops:
+            total += head_gflops[name]
+        costs[name] = total
+    return costs
+
+
+def evaluate(model, dataloader, thresholds, device):
+    """Accuracy against average compute for each threshold, from one full pass over the test set."""
+    model.eval()
+
+    all_probs = {e: [] for e in model.exits + ['Logits']}
+    gts = []
+    input_shape = None
+    with torch.no_grad():
+        for inputs, labels, vid in dataloader:
+            input_shape = inputs.shape
+            outputs = model.forward_all(inputs.to(device))
+            for e, logits in outputs.items():
+                all_probs[e].append(clip_probs(logits).cpu())
+            gts.append(torch.argmax(labels[:, :, 0], dim=1))
+
+    gts = torch.cat(gts).numpy()
+    all_probs = {e: torch.cat(p).numpy() for e, p in all_probs.items()}
+    costs = cumulative_gflops(model, input_shape, device)
+
+    report = []
+    for threshold in thresholds:
+        exit_idx = np.full(len(gts), len(model.exits))
+        for i, e in reversed(list(enumerate(model.exits))):
+            exit_idx[all_probs[e].max(axis=1) >= threshold] = i
+
+        names = model.exits + ['Logits']
+        preds = np.stack([all_probs[n] for n in names])[exit_idx, np.arange(len(gts))]
+        top1 = float(np.mean(np.argmax(preds, axis=1) == gts))
+        top5 = float(np.mean([gt in np.argsort(p)[-5:] for p, gt in zip(preds, gts)]))
+        avg_gflops = float(np.mean([costs[names[i]] for i in exit_idx]))
+        exit_share = {n: float(np.mean(exit_idx == i)) for i, n in enumerate(names)}
+        report.append({'threshold': threshold, 'top1': top1, 'top5': top5, 'avg_gflops': avg_gflops,
+                       'exit_share': exit_share})
+
+    print('{:>9} {:>7} {:>7} {:>10} {:>9}  {}'.format('threshold', 'top1', 'top5', 'GFLOPs', 'vs full',
+                                                      'share of clips per exit'))
+    for r in report:
+        print('{:>9.2f} {:>7.4f} {:>7.4f} {:>10.2f} {:>8.1f}%  {}'.format(
+            r['threshold'], r['top1'], r['top5'], r['avg_gflops'], 100 * r['avg_gflops'] / costs['Logits'],
+            ', '.join('{}={:.2f}'.format(n, s) for n, s in r['exit_share'].items())))
+    return report
+
+
+def measure_latency(fn, dataloader, device, max_clips=50):
+    """Mean wall time per clip of `fn(inputs)`."""
+    times = []
+    with torch.no_grad():
+        for i, (inputs, labels, vid) in enumerate(dataloader):
+            if i == max_clips:
+                break
+            inputs = inputs.to(device)
+            start = time.perf_counter()
+            fn(inputs)
+            if inputs.is_cuda:
+                torch.cuda.synchronize()
+            times.append((time.perf_counter() - start) / inputs.size(0))
+    return float(np.mean(times))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['train', 'evaluate'])
+    parser.add_argument('-weights', type=str, required=True, help='fine-tuned InceptionI3d state dict')
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('-split', type=str, required=True)
+    parser.add_argument('-root', type=str, required=True)
+    parser.add_argument('-heads', type=str, default=None, help='trained heads to load (required for evaluate)')
+    parser.add_argument('-save', type=str, default='early_exit_heads.pt')
+    parser.add_argument('--exits', type=str, nargs='+', default=['Mixed_4f'])
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--batch_size', type=int, default=6)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.01])
+    parser.add_argument('--latency_threshold', type=float, default=None,
+                        help='also measure real early-exit latency at this threshold')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    root = {'word': args.root}
+
+    heads = None
+    if args.heads:
+        checkpoint = torch.load(args.heads, map_location='cpu')
+        args.exits, heads = checkpoint['exits'], checkpoint['heads']
+    model = build_model(args.weights, args.num_classes, args.exits, heads=heads, device=device)
+
+    if args.command == 'train':
+        train_transforms = transforms.Compose([videotransforms.RandomCrop(224),
+                                               videotransforms.RandomHorizontalFlip(), ])
+        dataset = Dataset(args.split, 'train', root, 'rgb', train_transforms)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, shuffle=True,
+                                                 num_workers=2, pin_memory=True)
+        train_heads(model, dataloader, args.epochs, args.lr, device)
+        torch.save({'exits': model.exits, 'heads': model.heads.state_dict()}, args.save)
+        print('heads saved to {}'.format(args.save))
+    else:
+        assert args.heads, '-heads is required for evaluate'
+        test_transforms = transforms.Compose([videotransforms.CenterCrop(224)])
+        dataset = Dataset(args.split, 'test', root, 'rgb', test_transforms)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                                                 num_workers=2, pin_memory=False)
+        evaluate(model, dataloader, args.thresholds, device)
+
+        if args.latency_threshold is not None:
+            single = torch.utils.data.DataLoader(dataset, batch_size=1, shuffle=False, num_workers=2)
+            early_exit_s = measure_latency(lambda x: model(x, threshold=args.latency_threshold), single, device)
+            full_s = measure_latency(model.backbone, single, device)
+            print('early exit at {}: {:.1f} ms/clip, full network: {:.1f} ms/clip'.format(
+                args.latency_threshold, 1000 * early_exit_s, 1000 * full_s))
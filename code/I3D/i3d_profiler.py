@@ -0,0 +1,168 @@
+"""Per-endpoint timing and memory profiling for InceptionI3d.
+
+Usage:
+    profiler = EndpointProfiler()
+    i3d.enable_profiling(profiler)
+    ... run forward passes ...
+    i3d.disable_profiling()
+    print(profiler.summary())
+    profiler.export_chrome_trace('i3d_trace.json')  # open in chrome://tracing or ui.perfetto.dev
+
+Or from the command line, with random inputs:
+    python i3d_profiler.py --batch_size 2 --num_frames 64 --size 224 --iters 5
+"""
+import argparse
+import json
+import os
+import time
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+
+def conv3d_flops(module, output):
+    """Multiply-adds of a Conv3d call, counted as 2 FLOPs each (bias ignored)."""
+    kt, kh, kw = module.kernel_size
+    in_per_group = module.in_channels // module.groups
+    return 2 * output.numel() * in_per_group * kt * kh * kw
+
+
+class EndpointProfiler(object):
+    """Records wall time, FLOPs estimate, activation bytes and peak allocator memory per I3D endpoint.
+
+    Statistics are accumulated over every forward pass made while profiling is enabled. On CUDA the device is
+    synchronized around each endpoint, which makes the timings exact but slows the model down, so only enable
+    profiling for dedicated runs. Peak memory is the growth of the CUDA allocator's peak over the memory in use
+    when the endpoint starts; it is not available on CPU.
+    """
+
+    def __init__(self):
+        self.stats = OrderedDict()
+        self.events = []
+        self._hooks = []
+        self._flops = 0
+        self._t0 = None
+
+    def attach(self, model):
+        self.detach()
+        for m in model.modules():
+            if isinstance(m, nn.Conv3d):
+                self._hooks.append(m.register_forward_hook(self._conv_hook))
+
+    def detach(self):
+        for h in self._hooks:
+            h.remove()
+        self._hooks = []
+
+    def reset(self):
+        self.stats = OrderedDict()
+        self.events = []
+        self._t0 = None
+
+    def _conv_hook(self, module, inputs, output):
+        self._flops += conv3d_flops(module, output)
+
+    def run(self, name, fn, x):
+        """Run `fn(x)` as endpoint `name` and record its cost."""
+        cuda = x.is_cuda
+        if cuda:
+            torch.cuda.synchronize(x.device)
+            mem_before = torch.cuda.memory_allocated(x.device)
+            torch.cuda.reset_peak_memory_stats(x.device)
+
+        self._flops = 0
+        start = time.perf_counter()
+        if self._t0 is None:
+            self._t0 = start
+
+        out = fn(x)
+
+        if cuda:
+            torch.cuda.synchronize(x.device)
+        end = time.perf_counter()
+
+        peak_bytes = torch.cuda.max_memory_allocated(x.device) - mem_before if cuda else None
+        act_bytes = out.numel() * out.element_size()
+        self._record(name, start, end, self._flops, act_bytes, peak_bytes, tuple(out.shape))
+        return out
+
+    def _record(self, name, start, end, flops, act_bytes, peak_bytes, shape):
+        s = self.stats.setdefault(name, {'calls': 0, 'time_s': 0., 'flops': 0, 'activation_bytes': 0,
+                                         'peak_bytes': None, 'output_shape': shape})
+        s['calls'] += 1
+        s['time_s'] += end - start
+        s['flops'] += flops
+        s['activation_bytes'] = max(s['activation_bytes'], act_bytes)
+        if peak_bytes is not None:
+            s['peak_bytes'] = max(s['peak_bytes'] or 0, peak_bytes)
+        s['output_shape'] = shape
+
+        self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                            'ts': (start - self._t0) * 1e6, 'dur': (end - start) * 1e6,
+                            'args': {'gflops': flops / 1e9, 'activation_mb': act_bytes / 2 ** 20,
+                                     'peak_mb': None if peak_bytes is None else peak_bytes / 2 ** 20,
+                                     'output_shape': list(shape)}})
+
+    def summary(self):
+        """Return a text table of per-endpoint averages, in execution order."""
+        total_time = sum(s['time_s'] for s in self.stats.values()) or 1.
+        lines = ['{:<18} {:>6} {:>10} {:>7} {:>9} {:>10} {:>9}  {}'.format(
+            'endpoint', 'calls', 'mean ms', 'time %', 'GFLOPs', 'act. MB', 'peak MB', 'output shape')]
+        for name, s in self.stats.items():
+            lines.append('{:<18} {:>6d} {:>10.2f} {:>7.1f} {:>9.2f} {:>10.1f} {:>9}  {}'.format(
+                name, s['calls'], 1000 * s['time_s'] / s['calls'], 100 * s['time_s'] / total_time,
+                s['flops'] / s['calls'] / 1e9, s['activation_bytes'] / 2 ** 20,
+                '-' if s['peak_bytes'] is None else '{:.1f}'.format(s['peak_bytes'] / 2 ** 20),
+                'x'.join(str(d) for d in s['output_shape'])))
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        return {name: dict(s, output_shape=list(s['output_shape'])) for name, s in self.stats.items()}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+if __name__ == '__main__':
+    from pytorch_i3d import InceptionI3d
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--num_frames', type=int, default=64)
+    parser.add_argument('--size', type=int, default=224)
+    parser.add_argument('--num_classes', type=int, default=2000)
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--trace', type=str, default='i3d_trace.json')
+    parser.add_argument('--json', type=str, default=None, help='also dump the per-endpoint stats as json')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    i3d = InceptionI3d(400, in_channels=3)
+    i3d.replace_logits(args.num_classes)
+    i3d.to(device)
+    i3d.eval()
+
+    inputs = torch.randn(args.batch_size, 3, args.num_frames, args.size, args.size, device=device)
+
+    with torch.no_grad():
+        for _ in range(args.warmup):
+            i3d(inputs)
+
+        profiler = EndpointProfiler()
+        i3d.enable_profiling(profiler)
+        for _ in range(args.iters):
+            i3d(inputs)
+        i3d.disable_profiling()
+
+    print('input {} on {}'.format('x'.join(str(d) for d in inputs.shape), device))
+    print(profiler.summary())
+
+    profiler.export_chrome_trace(args.trace)
+    print('chrome trace written to {}'.format(args.trace))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(profiler.to_dict(), f, indent=2)
@@ -0,0 +1,188 @@
+"""Local HTTP inference service with dynamic micro-batching, shared by serve_i3d.py and serve_tgcn.py.
+
+Endpoints:
+    POST /predict[?top_k=5]  body handled by the model's `predict` method, returns top-k glosses as json
+    GET  /stats              queue depth, batch sizes and latency percentiles of recent requests
+    GET  /health
+"""
+import collections
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+class MicroBatcher(object):
+    """Collects concurrent requests into batches for one model worker thread.
+
+    `submit` queues an item and returns a Future. The worker takes the oldest item, then keeps collecting until
+    it has `max_batch_size` items or `max_latency_ms` have passed since that oldest item was submitted, and calls
+    `process_fn(items)`, which must return one result per item. Under light load a request waits at most
+    `max_latency_ms` for company; under heavy load batches fill up and the wait disappears.
+    """
+
+    def __init__(self, process_fn, max_batch_size=8, max_latency_ms=10., history=1000):
+        self.process_fn = process_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.
+
+        self.queue = queue.Queue()
+        # (queue wait, end to end latency) in seconds, and batch sizes, of recent requests
+        self.latencies = collections.deque(maxlen=history)
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.num_requests = 0
+        self.num_batches = 0
+        self._lock = threading.Lock()
+
+        self._stopped = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Submit `item` and wait for its result."""
+        return self.submit(item).result(timeout)
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first[2] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                entry = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._stopped = True
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._collect()
+            if batch is None:
+                break
+
+            started = time.perf_counter()
+            items = [item for item, future, submitted in batch]
+            try:
+                results = self.process_fn(items)
+            except Exception as e:
+                for item, future, submitted in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            with self._lock:
+                self.num_requests += len(batch)
+                self.num_batches += 1
+                self.batch_sizes.append(len(batch))
+                for item, future, submitted in batch:
+                    self.latencies.append((started - submitted, finished - submitted))
+            for (item, future, submitted), result in zip(batch, results):
+                future.set_result(result)
+
+    def close(self):
+        self.queue.put(None)
+        self._worker.join()
+
+    def stats(self):
+        with self._lock:
+            latencies = np.asarray(self.latencies) * 1000
+            batch_sizes = list(self.batch_sizes)
+            stats = {'queue_depth': self.queue.qsize(), 'requests': self.num_requests, 'batches': self.num_batches,
+                     'max_batch_size': self.max_batch_size, 'max_latency_ms': self.max_latency * 1000}
+        if len(latencies):
+            stats['mean_batch_size'] = float(np.mean(batch_sizes))
+            for p in (50, 90, 99):
+                stats['latency_p{}_ms'.format(p)] = float(np.percentile(latencies[:, 1], p))
+                stats['queue_wait_p{}_ms'.format(p)] = float(np.percentile(latencies[:, 0], p))
+        return stats
+
+
+def top_k_glosses(probs, class_names, k):
+    """[{'class_id', 'gloss', 'score'}] of the `k` most likely classes in a 1-d probability array."""
+    best = np.argsort(probs)[::-1][:k]
+    return [{'class_id': int(c), 'gloss': class_names.get(int(c), str(c)) if class_names else str(c),
+             'score': float(probs[c])} for c in best]
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """Routes requests to `server.service`, which provides predict(body, content_type, top_k) and stats()."""
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            self._reply(200, self.server.service.stats())
+        elif path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'unknown path {}'.format(path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/predict':
+            self._reply(404, {'error': 'unknown path {}'.format(url.path)})
+            return
+
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            top_k = parse_qs(url.query).get('top_k', ['5'])[0]
+            if not top_k.isdigit() or int(top_k) < 1:
+                raise ValueError('top_k must be an integer >= 1, got {!r}'.format(top_k))
+            top_k = int(top_k)
+            predictions = self.server.service.predict(body, self.headers.get('Content-Type', ''), top_k)
+        except (ValueError, KeyError, IOError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except Exception as e:
+            # e.g. a RuntimeError of the forward pass, passed on by the MicroBatcher
+            self._reply(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+            return
+        self._reply(200, {'predictions': predictions, 'latency_ms': 1000 * (time.perf_counter() - start)})
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(InferenceHandler, self).log_message(format, *args)
+
+
+class InferenceServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 resets connections under bursts of concurrent clients
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve(service, host='127.0.0.1', port=8000, verbose=False):
+    """Serve `service` until interrupted; every request is handled on its own thread."""
+    server = InferenceServer((host, port), InferenceHandler)
+    server.service = service
+    server.verbose = verbose
+    print('serving on http://{}:{}'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,104 @@
+"""Load generator for the local inference services (serve_i3d.py, serve_tgcn.py).
+
+Sends the given files to /predict from `--concurrency` threads, either as fast as possible (closed loop) or at
+a fixed `--rate` of requests per second (open loop), and prints throughput, client-side latency percentiles
+and the server's /stats afterwards.
+
+    python load_generator.py --url http://127.0.0.1:8000 --files ../../data/WLASL2000/0*.mp4 \
+        --requests 200 --concurrency 16
+"""
+import argparse
+import glob
+import json
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+CONTENT_TYPES = {'.mp4': 'video/mp4', '.json': 'application/json'}
+
+
+def post(url, body, content_type, timeout=60.):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def get(url, timeout=10.):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def run_load(url, payloads, num_requests, concurrency, rate=None, top_k=5):
+    """Send `num_requests` requests cycling over `payloads` [(body, content_type)]; returns (latencies, errors)."""
+    predict_url = url.rstrip('/') + '/predict?top_k={}'.format(top_k)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(num_requests))
+    start = time.perf_counter()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            if rate:
+                # open loop: request i is due at start + i / rate, whether or not earlier ones have returned
+                delay = start + i / float(rate) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            body, content_type = payloads[i % len(payloads)]
+            sent = time.perf_counter()
+            try:
+                post(predict_url, body, content_type)
+                with lock:
+                    latencies.append(time.perf_counter() - sent)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def load_payloads(patterns):
+    payloads = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            ext = path[path.rfind('.'):].lower()
+            with open(path, 'rb') as f:
+                payloads.append((f.read(), CONTENT_TYPES.get(ext, 'application/octet-stream')))
+    return payloads
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000')
+    parser.add_argument('--files', type=str, nargs='+', required=True, help='videos or pose json files to send')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=None, help='requests per second (default: closed loop)')
+    parser.add_argument('--top_k', type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.files)
+    assert payloads, 'no files matched {}'.format(args.files)
+
+    latencies, errors, elapsed = run_load(args.url, payloads, args.requests, args.concurrency, args.rate, args.top_k)
+
+    print('{} requests in {:.1f}s: {:.1f} req/s, {} errors'.format(len(latencies), elapsed,
+                                                                   len(latencies) / elapsed, len(errors)))
+    if latencies:
+        lat = np.asarray(latencies) * 1000
+        print('client latency ms: mean {:.1f} p50 {:.1f} p90 {:.1f} p99 {:.1f} max {:.1f}'.format(
+            lat.mean(), np.percentile(lat, 50), np.percentile(lat, 90), np.percentile(lat, 99), lat.max()))
+    if errors:
+        print('first error: {}'.format(errors[0]))
+    print('server stats: {}'.format(json.dumps(get(args.url.rstrip('/') + '/stats'))))
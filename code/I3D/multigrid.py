@@ -0,0 +1,70 @@
+"""Multigrid-style training schedule: train on smaller clips with larger batches first.
+
+A schedule is a list of phases, each a clip shape (frames x crop size) and a share of MAX_STEPS. Early phases
+use short, low-resolution clips, which are cheap per sample, and the batch size is scaled up so that every
+phase uses roughly the memory of the base shape. Short clips are sampled with a larger temporal stride so they
+still span the same part of the video as a base clip. The last phase should be the base shape, which is also
+what validation and testing use.
+
+Configured from the ini file:
+
+    [MULTIGRID]
+    ; clip shapes as frames x crop size, trained in this order
+    PHASES = 16x112, 32x160, 64x224
+    ; share of MAX_STEPS spent in each phase
+    PHASE_STEPS = 0.25, 0.25, 0.5
+    ; optional cap on the scaled batch size
+    MAX_BATCH_SIZE = 64
+"""
+from collections import namedtuple
+
+from torchvision import transforms
+
+import videotransforms
+
+Phase = namedtuple('Phase', ['num_frames', 'crop_size', 'temporal_stride', 'batch_size', 'end_step'])
+
+
+class MultigridSchedule(object):
+
+    def __init__(self, phases, max_steps, base_batch_size, base_frames=64, base_size=224, base_stride=1,
+                 max_batch_size=None):
+        """`phases` is a list of (num_frames, crop_size, share of max_steps), see configs.parse_phases."""
+        total_share = sum(share for _, _, share in phases)
+
+        self.phases = []
+        end = 0.
+        for num_frames, crop_size, share in phases:
+            end += share / total_share
+            scale = float(base_frames * base_size * base_size) / (num_frames * crop_size * crop_size)
+            batch_size = max(1, int(base_batch_size * scale))
+            if max_batch_size:
+                batch_size = min(batch_size, max_batch_size)
+            temporal_stride = max(1, base_frames * base_stride // num_frames)
+            self.phases.append(Phase(num_frames, crop_size, temporal_stride, batch_size,
+                                     int(round(end * max_steps))))
+
+    @classmethod
+    def from_config(cls, configs):
+        """The configured schedule, or a single base phase if the config has no [MULTIGRID] section."""
+        phases = configs.multigrid_phases or [(64, 224, 1.)]
+        return cls(phases, configs.max_steps, configs.batch_size, base_stride=configs.temporal_stride,
+                   max_batch_size=configs.multigrid_max_batch_size)
+
+    def phase_at(self, step):
+        for phase in self.phases:
+            if step < phase.end_step:
+                return phase
+        return self.phases[-1]
+
+    def __str__(self):
+        return '\n'.join('steps < {}: {} frames (stride {}) x {}px, batch size {}'.format(
+            p.end_step, p.num_frames, p.temporal_stride, p.crop_size, p.batch_size) for p in self.phases)
+
+
+def train_transforms(crop_size):
+    """Random crops covering the field of view of a 224 px crop of the 256 px videos, at `crop_size` px."""
+    ts = [videotransforms.RandomCrop(crop_size), videotransforms.RandomHorizontalFlip()]
+    if crop_size != 224:
+        ts.insert(0, videotransforms.Resize(int(round(256 * crop_size / 224.))))
+    return transforms.Compose(ts)
@@ -0,0 +1,274 @@
+"""Structured channel pruning of the InceptionModule branches of a fine-tuned InceptionI3d.
+
+Output channels of every Unit3D inside the inception modules are ranked by importance and the least important
+ones are physically removed: the convolution filters and batch norm statistics of the pruned channels are
+dropped, and so are the matching input slices of every layer that consumes them (the second convolution of a
+branch, all four branches of the next module, or the logits). The result is a smaller InceptionI3d whose widths
+are saved alongside the weights, so it really does fewer FLOPs.
+
+Importance criteria:
+    bn      |gamma| of the batch norm that follows the convolution (no data needed)
+    taylor  |gamma * dL/dgamma| + |beta * dL/dbeta| accumulated over a few training batches, a first-order
+            estimate of the loss change when the channel is removed
+
+Prune 30% of every branch, fine-tune for 2000 steps and compare against the unpruned model:
+    python prune_i3d.py -weights archived/asl100/ckpt.pt -num_classes 100 -split preprocess/nslt_100.json \
+        -root ../../data/WLASL2000 --criterion taylor --ratio 0.3 --finetune_steps 2000 -save pruned_100.pt
+
+Load a pruned checkpoint:
+    i3d = load_pruned('pruned_100.pt')
+"""
+import argparse
+import json
+import time
+from collections import OrderedDict
+
+import torch
+import torch.optim as optim
+from torchvision import transforms
+
+import videotransforms
+from datasets.nslt_dataset import NSLT as Dataset
+from early_exit_i3d import i3d_loss, measure_latency
+from i3d_profiler import EndpointProfiler
+from pytorch_i3d import InceptionI3d, InceptionModule
+
+# Unit3D layers of an InceptionModule, in the order of InceptionI3d.DEFAULT_CHANNELS widths
+BRANCH_UNITS = ('b0', 'b1a', 'b1b', 'b2a', 'b2b', 'b3b')
+# units whose outputs are concatenated into the module output, in concatenation order
+OUTPUT_UNITS = ('b0', 'b1b', 'b2b', 'b3b')
+
+
+def inception_modules(i3d):
+    return [(name, i3d.end_points[name]) for name in i3d.VALID_ENDPOINTS
+            if isinstance(i3d.end_points.get(name), InceptionModule)]
+
+
+def bn_importance(i3d):
+    """{'Mixed_3b.b0': per-channel |gamma|, ...}"""
+    scores = OrderedDict()
+    for name, module in inception_modules(i3d):
+        for unit in BRANCH_UNITS:
+            scores[name + '.' + unit] = getattr(module, unit).bn.weight.detach().abs().cpu()
+    return scores
+
+
+def taylor_importance(i3d, dataloader, device, num_batches=20):
+    """{'Mixed_3b.b0': per-channel first-order Taylor importance of the batch norm parameters, ...}"""
+    # keep the batch norm statistics fixed; only gradients are needed
+    i3d.eval()
+    scores = OrderedDict()
+    for name, module in inception_modules(i3d):
+        for unit in BRANCH_UNITS:
+            scores[name + '.' + unit] = torch.zeros_like(getattr(module, unit).bn.weight.detach()).cpu()
+
+    for batch_idx, (inputs, labels, vid) in enumerate(dataloader):
+        if batch_idx == num_batches:
+            break
+        i3d.zero_grad()
+        i3d_loss(i3d(inputs.to(device)), labels.to(device)).backward()
+
+        for name, module in inception_modules(i3d):
+            for unit in BRANCH_UNITS:
+                bn = getattr(module, unit).bn
+                scores[name + '.' + unit] += ((bn.weight * bn.weight.grad).abs() +
+                                              (bn.bias * bn.bias.grad).abs()).detach().cpu()
+    i3d.zero_grad()
+    return scores
+
+
+def select_channels(scores, ratio, min_channels=4):
+    """Indices of the channels each unit keeps: the top (1 - ratio) by score, in their original order."""
+    keep = OrderedDict()
+    for name, s in scores.items():
+        num_keep = min(len(s), max(min_channels, int(round(len(s) * (1 - ratio)))))
+        keep[name] = torch.sort(torch.topk(s, num_keep).indices).values
+    return keep
+
+
+def _slice_unit(state_dict, prefix, out_idx, in_idx=None):
+    weight = state_dict[prefix + '.conv3d.weight']
+    if in_idx is not None:
+        weight = weight[:, in_idx]
+    state_dict[prefix + '.conv3d.weight'] = weight[out_idx].clone()
+    for param in ('weight', 'bias', 'running_mean', 'running_var'):
+        key = '{}.bn.{}'.format(prefix, param)
+        state_dict[key] = state_dict[key][out_idx].clone()
+
+
+def prune_state_dict(state_dict, channels, keep):
+    """Slice a full state dict down to the channels in `keep`.
+
+    Returns the pruned state dict and the widths to build the matching InceptionI3d with.
+    """
+    state_dict = OrderedDict(state_dict)
+    channels = OrderedDict((k, list(v) if isinstance(v, list) else v) for k, v in channels.items())
+
+    in_idx = None  # channels of the previous module output that survive, None if all do
+    for name in InceptionI3d.VALID_ENDPOINTS:
+        if not isinstance(channels.get(name), list):
+            continue
+        widths = channels[name]
+        unit_keep = {unit: keep.get(name + '.' + unit, torch.arange(widths[i]))
+                     for i, unit in enumerate(BRANCH_UNITS)}
+        unit_inputs = {'b0': in_idx, 'b1a': in_idx, 'b1b': unit_keep['b1a'], 'b2a': in_idx,
+                       'b2b': unit_keep['b2a'], 'b3b': in_idx}
+
+        for unit in BRANCH_UNITS:
+            _slice_unit(state_dict, name + '.' + unit, unit_keep[unit], unit_inputs[unit])
+
+        # surviving channels of the concatenated output, offset by the unpruned width of earlier branches
+        offset = 0
+        out_idx = []
+        for unit in OUTPUT_UNITS:
+            out_idx.append(unit_keep[unit] + offset)
+            offset += widths[BRANCH_UNITS.index(unit)]
+        in_idx = torch.cat(out_idx)
+
+        channels[name] = [len(unit_keep[unit]) for unit in BRANCH_UNITS]
+
+    if in_idx is not None and 'logits.conv3d.weight' in state_dict:
+        state_dict['logits.conv3d.weight'] = state_dict['logits.conv3d.weight'][:, in_idx].clone()
+    return state_dict, channels
+
+
+def prune(i3d, keep):
+    """A new, physically smaller InceptionI3d with only the channels in `keep`."""
+    state_dict, channels = prune_state_dict(i3d.state_dict(), i3d.channels, keep)
+    pruned = InceptionI3d(i3d._num_classes, in_channels=i3d.end_points['Conv3d_1a_7x7'].conv3d.in_channels,
+                          channels=channels)
+    pruned.load_state_dict(state_dict)
+    return pruned
+
+
+def save_pruned(i3d, path):
+    torch.save({'num_classes': i3d._num_classes, 'channels': i3d.channels, 'state_dict': i3d.state_dict()}, path)
+
+
+def load_pruned(path, map_location='cpu'):
+    checkpoint = torch.load(path, map_location=map_location)
+    i3d = InceptionI3d(checkpoint['num_classes'], in_channels=3, channels=checkpoint['channels'])
+    i3d.load_state_dict(checkpoint['state_dict'])
+    return i3d
+
+
+def finetune(i3d, dataloader, steps, lr, device):
+    optimizer = optim.Adam(i3d.parameters(), lr=lr, weight_decay=1e-7)
+    i3d.train()
+
+    step = 0
+    tot_loss = 0.
+    while step < steps:
+        for inputs, labels, vid in dataloader:
+            loss = i3d_loss(i3d(inputs.to(device)), labels.to(device))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            step += 1
+            tot_loss += loss.item()
+            if step % 10 == 0:
+                print('fine-tune step {}/{} loss: {:.4f}'.format(step, steps, tot_loss / 10))
+                tot_loss = 0.
+            if step == steps:
+                break
+
+
+def accuracy(i3d, dataloader, device):
+    """Top-1 and top-5 accuracy, with clip predictions max-pooled over time as in train_i3d.py."""
+    i3d.eval()
+    correct_1 = correct_5 = total = 0
+    with torch.no_grad():
+        for inputs, labels, vid in dataloader:
+            predictions = torch.max(i3d(inputs.to(device)), dim=2)[0].cpu()
+            gts = torch.argmax(labels[:, :, 0], dim=1)
+            top5 = torch.topk(predictions, min(5, predictions.size(1)), dim=1).indices
+            correct_1 += (top5[:, 0] == gts).sum().item()
+            correct_5 += (top5 == gts[:, None]).any(dim=1).sum().item()
+            total += len(gts)
+    return correct_1 / float(total), correct_5 / float(total)
+
+
+def gflops(i3d, input_shape, device):
+    profiler = EndpointProfiler()
+    i3d.enable_profiling(profiler)
+    with torch.no_grad():
+        i3d(torch.zeros((1,) + tuple(input_shape[1:]), device=device))
+    i3d.disable_profiling()
+    return sum(s['flops'] for s in profiler.stats.values()) / 1e9
+
+
+def report(i3d, dataloader, latency_loader, device):
+    i3d.eval()
+    top1, top5 = accuracy(i3d, dataloader, device)
+    inputs = next(iter(latency_loader))[0]
+    return {'top1': top1, 'top5': top5,
+            'params_m': sum(p.numel() for p in i3d.parameters()) / 1e6,
+            'gflops': gflops(i3d, inputs.shape, device),
+            'ms_per_clip': 1000 * measure_latency(i3d, latency_loader, device, max_clips=20)}
+
+
+def print_report(rows):
+    print('{:<10} {:>7} {:>7} {:>9} {:>8} {:>10}'.format('model', 'top1', 'top5', 'params M', 'GFLOPs', 'ms/clip'))
+    for name, r in rows:
+        print('{:<10} {:>7.4f} {:>7.4f} {:>9.2f} {:>8.1f} {:>10.1f}'.format(
+            name, r['top1'], r['top5'], r['params_m'], r['gflops'], r['ms_per_clip']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-weights', type=str, required=True, help='fine-tuned InceptionI3d state dict')
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('-split', type=str, required=True)
+    parser.add_argument('-root', type=str, required=True)
+    parser.add_argument('-save', type=str, default='pruned_i3d.pt')
+    parser.add_argument('--criterion', type=str, default='bn', choices=['bn', 'taylor'])
+    parser.add_argument('--ratio', type=float, default=0.3, help='fraction of channels removed from every unit')
+    parser.add_argument('--min_channels', type=int, default=4)
+    parser.add_argument('--taylor_batches', type=int, default=20)
+    parser.add_argument('--finetune_steps', type=int, default=0)
+    parser.add_argument('--lr', type=float, default=1e-4)
+    parser.add_argument('--batch_size', type=int, default=6)
+    parser.add_argument('--latency_device', type=str, default='cpu', help='device the latency is measured on')
+    parser.add_argument('--report', type=str, default=None, help='also write the report as json')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    root = {'word': args.root}
+
+    train_transforms = transforms.Compose([videotransforms.RandomCrop(224), videotransforms.RandomHorizontalFlip()])
+    test_transforms = transforms.Compose([videotransforms.CenterCrop(224)])
+    train_dataset = Dataset(args.split, 'train', root, 'rgb', train_transforms)
+    test_dataset = Dataset(args.split, 'test', root, 'rgb', test_transforms)
+    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True,
+                                               num_workers=2, pin_memory=True)
+    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=args.batch_size, shuffle=False,
+                                              num_workers=2)
+    latency_loader = torch.utils.data.DataLoader(test_dataset, batch_size=1, shuffle=False, num_workers=2)
+
+    i3d = InceptionI3d(400, in_channels=3)
+    i3d.replace_logits(args.num_classes)
+    i3d.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    i3d.to(device)
+
+    if args.criterion == 'taylor':
+        scores = taylor_importance(i3d, train_loader, device, num_batches=args.taylor_batches)
+    else:
+        scores = bn_importance(i3d)
+    pruned = prune(i3d.cpu(), select_channels(scores, args.ratio, args.min_channels)).to(device)
+
+    if args.finetune_steps > 0:
+        finetune(pruned, train_loader, args.finetune_steps, args.lr, device)
+
+    save_pruned(pruned.cpu(), args.save)
+    print('pruned model saved to {}'.format(args.save))
+
+    rows = [('original', report(i3d.to(args.latency_device), test_loader, latency_loader, args.latency_device)),
+            ('pruned', report(pruned.to(args.latency_device), test_loader, latency_loader, args.latency_device))]
+    print_report(rows)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'weights': args.weights, 'criterion': args.criterion, 'ratio': args.ratio,
+                       'finetune_steps': args.finetune_steps, 'channels': pruned.channels,
+                       'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': dict(rows)}, f, indent=2)
@@ -5,6 +5,7 @@ from torch.autograd import Variable
 
 import numpy as np
 
+import copy
 import os
 import sys
 from collections import OrderedDict
@@ -45,6 +46,22 @@ class MaxPool3dSamePadding(nn.MaxPool3d):
         return super(MaxPool3dSamePadding, self).forward(x)
     
 
+class AdaptiveSpatialAvgPool3d(nn.Module):
+    """Average pooling over the whole spatial extent and `temporal_kernel` frames, with stride 1.
+
+    Same as AvgPool3d(kernel_size=[2, 7, 7], stride=(1, 1, 1)) on the 7x7 maps of 224x224 inputs, but it accepts
+    any input resolution.
+    """
+
+    def __init__(self, temporal_kernel=2):
+        super(AdaptiveSpatialAvgPool3d, self).__init__()
+        self.temporal_kernel = temporal_kernel
+
+    def forward(self, x):
+        x = F.adaptive_avg_pool3d(x, (x.size(2), 1, 1))
+        return F.avg_pool3d(x, kernel_size=(min(self.temporal_kernel, x.size(2)), 1, 1), stride=1)
+
+
 class Unit3D(nn.Module):
 
     def __init__(self, in_channels,
@@ -186,8 +203,26 @@ class InceptionI3d(nn.Module):
         'Predictions',
     )
 
+    # Output channels of every convolutional endpoint, as in the Kinetics-400 model. Inception modules list
+    # their six Unit3D widths: [b0, b1a, b1b, b2a, b2b, b3b]; the module outputs b0 + b1b + b2b + b3b channels.
+    DEFAULT_CHANNELS = OrderedDict([
+        ('Conv3d_1a_7x7', 64),
+        ('Conv3d_2b_1x1', 64),
+        ('Conv3d_2c_3x3', 192),
+        ('Mixed_3b', [64, 96, 128, 16, 32, 32]),
+        ('Mixed_3c', [128, 128, 192, 32, 96, 64]),
+        ('Mixed_4b', [192, 96, 208, 16, 48, 64]),
+        ('Mixed_4c', [160, 112, 224, 24, 64, 64]),
+        ('Mixed_4d', [128, 128, 256, 24, 64, 64]),
+        ('Mixed_4e', [112, 144, 288, 32, 64, 64]),
+        ('Mixed_4f', [256, 160, 320, 32, 128, 128]),
+        ('Mixed_5b', [256, 160, 320, 32, 128, 128]),
+        ('Mixed_5c', [384, 192, 384, 48, 128, 128]),
+    ])
+
     def __init__(self, num_classes=400, spatial_squeeze=True,
-                 final_endpoint='Logits', name='inception_i3d', in_channels=3, dropout_keep_prob=0.5):
+                 final_endpoint='Logits', name='inception_i3d', in_channels=3, dropout_keep_prob=0.5,
+                 channels=None):
         """Initializes I3D model instance.
         Args:
           num_classes: The number of outputs in the logit layer (default 400, which
@@ -201,6 +236,8 @@ class InceptionI3d(nn.Module):
               dictionary. `final_endpoint` must be one of
               InceptionI3d.VALID_ENDPOINTS (default 'Logits').
           name: A string (optional). The name of this module.
+          channels: Output channels per endpoint, as in DEFAULT_CHANNELS (default None, the Kinetics-400
+              widths). Pruned models (see prune_i3d.py) pass their own widths here.
         Raises:
           ValueError: if `final_endpoint` is not recognized.
         """
@@ -213,13 +250,18 @@ class InceptionI3d(nn.Module):
         self._spatial_squeeze = spatial_squeeze
         self._final_endpoint = final_endpoint
         self.logits = None
+        self.profiler = None
+        self.channels = copy.deepcopy(self.DEFAULT_CHANNELS)
+        if channels is not None:
+            self.channels.update(channels)
+        ch = self.channels
 
         if self._final_endpoint not in self.VALID_ENDPOINTS:
             raise ValueError('Unknown final endpoint %s' % self._final_endpoint)
 
         self.end_points = {}
         end_point = 'Conv3d_1a_7x7'
-        self.end_points[end_point] = Unit3D(in_channels=in_channels, output_channels=64, kernel_shape=[7, 7, 7],
+        self.end_points[end_point] = Unit3D(in_channels=in_channels, output_channels=ch[end_point], kernel_shape=[7, 7, 7],
                                             stride=(2, 2, 2), padding=(3,3,3),  name=name+end_point)
         if self._final_endpoint == end_point: return
         
@@ -229,12 +271,14 @@ class InceptionI3d(nn.Module):
         if self._final_endpoint == end_point: return
         
         end_point = 'Conv3d_2b_1x1'
-        self.end_points[end_point] = Unit3D(in_channels=64, output_channels=64, kernel_shape=[1, 1, 1], padding=0,
+        self.end_points[end_point] = Unit3D(in_channels=ch['Conv3d_1a_7x7'], output_channels=ch[end_point],
+                                            kernel_shape=[1, 1, 1], padding=0,
                                        name=name+end_point)
         if self._final_endpoint == end_point: return
         
         end_point = 'Conv3d_2c_3x3'
-        self.end_points[end_point] = Unit3D(in_channels=64, output_channels=192, kernel_shape=[3, 3, 3], padding=1,
+        self.end_points[end_point] = Unit3D(in_channels=ch['Conv3d_2b_1x1'], output_channels=ch[end_point],
+                                            kernel_shape=[3, 3, 3], padding=1,
                                        name=name+end_point)
         if self._final_endpoint == end_point: return
 
@@ -244,11 +288,12 @@ class InceptionI3d(nn.Module):
         if self._final_endpoint == end_point: return
         
         end_point = 'Mixed_3b'
-        self.end_points[end_point] = InceptionModule(192, [64,96,128,16,32,32], name+end_point)
+        self.end_points[end_point] = InceptionModule(ch['Conv3d_2c_3x3'], ch[end_point], name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_3c'
-        self.end_points[end_point] = InceptionModule(256, [128,128,192,32,96,64], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_3b']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'MaxPool3d_4a_3x3'
@@ -257,23 +302,28 @@ class InceptionI3d(nn.Module):
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_4b'
-        self.end_points[end_point] = InceptionModule(128+192+96+64, [192,96,208,16,48,64], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_3c']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_4c'
-        self.end_points[end_point] = InceptionModule(192+208+48+64, [160,112,224,24,64,64], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_4b']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_4d'
-        self.end_points[end_point] = InceptionModule(160+224+64+64, [128,128,256,24,64,64], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_4c']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_4e'
-        self.end_points[end_point] = InceptionModule(128+256+64+64, [112,144,288,32,64,64], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_4d']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_4f'
-        self.end_points[end_point] = InceptionModule(112+288+64+64, [256,160,320,32,128,128], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_4e']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'MaxPool3d_5a_2x2'
@@ -282,18 +332,20 @@ class InceptionI3d(nn.Module):
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_5b'
-        self.end_points[end_point] = InceptionModule(256+320+128+128, [256,160,320,32,128,128], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_4f']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'Mixed_5c'
-        self.end_points[end_point] = InceptionModule(256+320+128+128, [384,192,384,48,128,128], name+end_point)
+        self.end_points[end_point] = InceptionModule(self.module_out_channels(ch['Mixed_5b']), ch[end_point],
+                                                     name+end_point)
         if self._final_endpoint == end_point: return
 
         end_point = 'Logits'
-        self.avg_pool = nn.AvgPool3d(kernel_size=[2, 7, 7],
-                                     stride=(1, 1, 1))
+        self.avg_pool = AdaptiveSpatialAvgPool3d(temporal_kernel=2)
         self.dropout = nn.Dropout(dropout_keep_prob)
-        self.logits  = Unit3D(in_channels=384+384+128+128, output_channels=self._num_classes,
+        self.logits  = Unit3D(in_channels=self.module_out_channels(ch['Mixed_5c']),
+                             output_channels=self._num_classes,
                              kernel_shape=[1, 1, 1],
                              padding=0,
                              activation_fn=None,
@@ -306,7 +358,8 @@ class InceptionI3d(nn.Module):
 
     def replace_logits(self, num_classes):
         self._num_classes = num_classes
-        self.logits = Unit3D(in_channels=384+384+128+128, output_channels=self._num_classes,
+        self.logits = Unit3D(in_channels=self.module_out_channels(self.channels['Mixed_5c']),
+                             output_channels=self._num_classes,
                              kernel_shape=[1, 1, 1],
                              padding=0,
                              activation_fn=None,
@@ -314,9 +367,40 @@ class InceptionI3d(nn.Module):
                              use_bias=True,
                              name='logits')
 
+    @staticmethod
+    def module_out_channels(widths):
+        """Output channels of an InceptionModule with Unit3D widths [b0, b1a, b1b, b2a, b2b, b3b]."""
+        return widths[0] + widths[2] + widths[4] + widths[5]
+
     def build(self):
         for k in self.end_points.keys():
             self.add_module(k, self.end_points[k])
+
+    def enable_profiling(self, profiler):
+        """Record per-endpoint cost of every forward pass in `profiler` (see i3d_profiler.EndpointProfiler).
+
+        Enable it on the bare model, not on a DataParallel wrapper, as replicas would share the profiler.
+        """
+        self.profiler = profiler
+        profiler.attach(self)
+
+    def disable_profiling(self):
+        if self.profiler is not None:
+            self.profiler.detach()
+        self.profiler = None
+
+    def _run_endpoint(self, end_point, x):
+        if self.profiler is None:
+            return self._modules[end_point](x) # use _modules to work with dataparallel
+        return self.profiler.run(end_point, self._modules[end_point], x)
+
+    def _head(self, x):
+        return self.logits(self.dropout(self.avg_pool(x)))
+
+    def _run_head(self, x):
+        if self.profiler is None:
+            return self._head(x)
+        return self.profiler.run('Logits', self._head, x)
         
     def forward(self, x, pretrained=False, n_tune_layers=-1):
         if pretrained:
@@ -332,15 +416,15 @@ class InceptionI3d(nn.Module):
         with torch.no_grad():
             for end_point in freeze_endpoints:
                 if end_point in self.end_points:
-                    x = self._modules[end_point](x) # use _modules to work with dataparallel
+                    x = self._run_endpoint(end_point, x)
 
         # backbone, gradient part
         for end_point in tune_endpoints:
             if end_point in self.end_points:
-                x = self._modules[end_point](x) # use _modules to work with dataparallel
+                x = self._run_endpoint(end_point, x)
 
         # head
-        x = self.logits(self.dropout(self.avg_pool(x)))
+        x = self._run_head(x)
         if self._spatial_squeeze:
             logits = x.squeeze(3).squeeze(3)
         # logits is batch X time X classes, which is what we want to work with
@@ -350,5 +434,5 @@ class InceptionI3d(nn.Module):
     def extract_features(self, x):
         for end_point in self.VALID_ENDPOINTS:
             if end_point in self.end_points:
-                x = self._modules[end_point](x)
+                x = self._run_endpoint(end_point, x)
         return self.avg_pool(x)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class SpatioTemporalConv(nn.Module):
+    """A k x k x k convolution factorized into a 1 x k x k spatial and a k x 1 x 1 temporal convolution.
+
+    The number of intermediate channels follows the (2+1)D paper, so the factorized block has about as many
+    parameters as the full 3D convolution it replaces, unless `mid_channels` is given.
+    """
+
+    def __init__(self, in_channels, out_channels, kernel_size=3, stride=(1, 1, 1), mid_channels=None):
+        super(SpatioTemporalConv, self).__init__()
+        k = kernel_size
+        if mid_channels is None:
+            mid_channels = (k * k * k * in_channels * out_channels) // (k * k * in_channels + k * out_channels)
+
+        self.spatial = nn.Conv3d(in_channels, mid_channels, kernel_size=(1, k, k), stride=(1, stride[1], stride[2]),
+                                 padding=(0, k // 2, k // 2), bias=False)
+        self.bn = nn.BatchNorm3d(mid_channels, eps=0.001, momentum=0.01)
+        self.temporal = nn.Conv3d(mid_channels, out_channels, kernel_size=(k, 1, 1), stride=(stride[0], 1, 1),
+                                  padding=(k // 2, 0, 0), bias=False)
+
+    def forward(self, x):
+        return self.temporal(F.relu(self.bn(self.spatial(x))))
+
+
+class ResBlock(nn.Module):
+
+    def __init__(self, in_channels, out_channels, stride=(1, 1, 1)):
+        super(ResBlock, self).__init__()
+        self.conv1 = SpatioTemporalConv(in_channels, out_channels, stride=stride)
+        self.bn1 = nn.BatchNorm3d(out_channels, eps=0.001, momentum=0.01)
+        self.conv2 = SpatioTemporalConv(out_channels, out_channels)
+        self.bn2 = nn.BatchNorm3d(out_channels, eps=0.001, momentum=0.01)
+
+        self.downsample = None
+        if in_channels != out_channels or tuple(stride) != (1, 1, 1):
+            self.downsample = nn.Sequential(nn.Conv3d(in_channels, out_channels, kernel_size=1, stride=stride,
+                                                      bias=False),
+                                            nn.BatchNorm3d(out_channels, eps=0.001, momentum=0.01))
+
+    def forward(self, x):
+        residual = x if self.downsample is None else self.downsample(x)
+        x = F.relu(self.bn1(self.conv1(x)))
+        x = self.bn2(self.conv2(x))
+        return F.relu(x + residual)
+
+
+class R2Plus1d(nn.Module):
+    """A small R(2+1)D network, used as a distillation student for InceptionI3d (see distill_i3d.py).
+    The model is introduced in:
+        A Closer Look at Spatiotemporal Convolutions for Action Recognition
+        Du Tran, Heng Wang, Lorenzo Torresani, Jamie Ray, Yann LeCun, Manohar Paluri
+        https://arxiv.org/abs/1711.11248
+    Like InceptionI3d it returns per-frame logits of shape batch x classes x time, so the I3D losses and
+    evaluation code work unchanged.
+    """
+
+    def __init__(self, num_classes, widths=(32, 64, 128, 256), blocks=(1, 1, 1, 1), in_channels=3,
+                 dropout_keep_prob=0.5):
+        """
+        Args:
+          num_classes: The number of outputs in the logit layer.
+          widths: Output channels of the four residual stages.
+          blocks: Number of residual blocks per stage.
+          in_channels: Input channels (3 for rgb).
+          dropout_keep_prob: Dropout probability before the logits, named as in InceptionI3d.
+        """
+        super(R2Plus1d, self).__init__()
+        self.widths = tuple(widths)
+        self.blocks = tuple(blocks)
+
+        self.stem = nn.Sequential(SpatioTemporalConv(in_channels, widths[0], kernel_size=3, stride=(1, 2, 2),
+                                                     mid_channels=45),
+                                  nn.BatchNorm3d(widths[0], eps=0.001, momentum=0.01),
+                                  nn.ReLU(inplace=True),
+                                  nn.MaxPool3d(kernel_size=(1, 3, 3), stride=(1, 2, 2), padding=(0, 1, 1)))
+
+        layers = []
+        in_ch = widths[0]
+        for i, (width, num_blocks) in enumerate(zip(widths, blocks)):
+            # halve time and space at the start of every stage but the first, which gives I3D's 8x temporal stride
+            stride = (1, 1, 1) if i == 0 else (2, 2, 2)
+            for b in range(num_blocks):
+                layers.append(ResBlock(in_ch, width, stride=stride if b == 0 else (1, 1, 1)))
+                in_ch = width
+        self.layers = nn.Sequential(*layers)
+
+        self.dropout = nn.Dropout(dropout_keep_prob)
+        self.logits = nn.Conv3d(in_ch, num_classes, kernel_size=1, bias=True)
+
+    def forward(self, x):
+        x = self.layers(self.stem(x))
+        x = F.adaptive_avg_pool3d(x, (x.size(2), 1, 1))
+        x = self.logits(self.dropout(x))
+        return x.squeeze(4).squeeze(3)
@@ -0,0 +1,130 @@
+"""Local HTTP inference service for I3D.
+
+The checkpoint is loaded once. Uploaded videos are decoded in memory on the request threads, every video is resampled
+uniformly to `--num_frames` frames (the clip length the model was trained on) so that concurrent requests can
+share a forward pass, and a MicroBatcher collects them into batches of at most `--max_batch` clips, waiting at
+most `--max_latency_ms` for a batch to fill.
+
+    python serve_i3d.py -weights archived/asl100/ckpt.pt -num_classes 100 --port 8000
+
+    curl --data-binary @video.mp4 -H 'Content-Type: video/mp4' 'http://127.0.0.1:8000/predict?top_k=5'
+    curl -d '{"path": "/data/WLASL2000/00335.mp4"}' -H 'Content-Type: application/json' http://127.0.0.1:8000/predict
+    curl http://127.0.0.1:8000/stats
+
+With --cache_dir, clip logits are cached by (video content hash, checkpoint hash, preprocessing settings), so
+repeated uploads of the same video skip decoding and the forward pass.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+
+from datasets.nslt_dataset import iter_buffer_frames, preprocess_frame
+from inference_server import MicroBatcher, serve, top_k_glosses
+from prediction_cache import PredictionCache, bytes_sha256, file_sha256
+from streaming_i3d import center_crop, load_class_names, load_model, read_video_frames
+
+
+def softmax(logits):
+    e = np.exp(logits - logits.max())
+    return e / e.sum()
+
+
+def sample_frames(frames, num_frames):
+    """`num_frames` frames spread uniformly over the video (frames are repeated for shorter videos)."""
+    idx = np.linspace(0, len(frames) - 1, num_frames).round().astype(int)
+    return [frames[i] for i in idx]
+
+
+class I3DService(object):
+
+    def __init__(self, model, class_names, num_frames=64, crop_size=224, max_batch_size=8, max_latency_ms=20.,
+                 device='cpu', cache=None, model_hash=None):
+        self.model = model
+        self.class_names = class_names
+        self.num_frames = num_frames
+        self.crop_size = crop_size
+        self.device = device
+        self.cache = cache
+        self.model_hash = model_hash
+        # everything between the video bytes and the logits, for the cache key
+        self.preprocess_config = {'num_frames': num_frames, 'crop_size': crop_size, 'sampling': 'uniform',
+                                  'output': 'clip_logits'}
+        self.batcher = MicroBatcher(self.forward, max_batch_size=max_batch_size, max_latency_ms=max_latency_ms)
+
+    def load_clip(self, frames):
+        """Turn decoded BGR frames into a (C x T x H x W) float array, preprocessed as in the NSLT loader."""
+        frames = list(frames)
+        if not frames:
+            raise ValueError('could not decode any frame')
+        clip = [center_crop(preprocess_frame(img), self.crop_size) for img in sample_frames(frames, self.num_frames)]
+        return np.asarray(clip, dtype=np.float32).transpose([3, 0, 1, 2])
+
+    @staticmethod
+    def video_path(body, content_type):
+        """The server-side path of a json request, or None for an upload."""
+        if not content_type.startswith('application/json'):
+            return None
+        path = json.loads(body.decode('utf-8'))['path']
+        if not os.path.exists(path):
+            raise ValueError('no such file: {}'.format(path))
+        return path
+
+    def decode(self, body, path):
+        if path is not None:
+            return self.load_clip(read_video_frames(path))
+        return self.load_clip(iter_buffer_frames(body))
+
+    def forward(self, clips):
+        inputs = torch.from_numpy(np.stack(clips)).to(self.device)
+        with torch.no_grad():
+            logits = torch.max(self.model(inputs), dim=2)[0]
+        return list(logits.cpu().numpy())
+
+    def predict(self, body, content_type, top_k=5):
+        path = self.video_path(body, content_type)
+
+        key = None
+        if self.cache is not None:
+            content_hash = file_sha256(path) if path is not None else bytes_sha256(body)
+            key = self.cache.key(content_hash, self.model_hash, self.preprocess_config)
+            logits = self.cache.get(key)
+            if logits is not None:
+                return top_k_glosses(softmax(logits), self.class_names, top_k)
+
+        logits = self.batcher(self.decode(body, path))
+        if key is not None:
+            self.cache.put(key, logits)
+        return top_k_glosses(softmax(logits), self.class_names, top_k)
+
+    def stats(self):
+        stats = self.batcher.stats()
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-weights', type=str, required=True)
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('--class_list', type=str, default='preprocess/wlasl_class_list.txt')
+    parser.add_argument('--num_frames', type=int, default=64)
+    parser.add_argument('--max_batch', type=int, default=8)
+    parser.add_argument('--max_latency_ms', type=float, default=20.)
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    parser.add_argument('--cache_dir', type=str, default=None, help='prediction cache directory (default: off)')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    cache = PredictionCache(args.cache_dir) if args.cache_dir else None
+
+    service = I3DService(load_model(args.weights, args.num_classes, device), load_class_names(args.class_list),
+                         num_frames=args.num_frames, max_batch_size=args.max_batch,
+                         max_latency_ms=args.max_latency_ms, device=device,
+                         cache=cache, model_hash=file_sha256(args.weights))
+    serve(service, args.host, args.port, verbose=args.verbose)
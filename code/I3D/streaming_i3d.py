@@ -0,0 +1,323 @@
+"""Continuous sign spotting with I3D over long or live videos.
+
+Frames are read from a video file, a capture device or a raw frame pipe, preprocessed once and kept in a
+ring buffer. Every `hop` frames the latest `window_size` frames are scored by I3D, and window-level detections
+are merged with temporal non-maximum suppression into (gloss, start, end, score) segments.
+
+Example, scoring a video file:
+    python streaming_i3d.py -weights archived/asl100/ckpt.pt -num_classes 100 -source video.mp4
+
+Example, scoring a live raw pipe:
+    ffmpeg -i rtsp://... -f rawvideo -pix_fmt bgr24 -s 256x256 - | \
+        python streaming_i3d.py -weights ckpt.pt -num_classes 100 -source - --width 256 --height 256
+"""
+import argparse
+import collections
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from datasets.nslt_dataset import preprocess_frame
+from pytorch_i3d import InceptionI3d
+
+
+def load_class_names(class_list_file='preprocess/wlasl_class_list.txt'):
+    """Map class indices to glosses using the tab-separated class list."""
+    class_names = {}
+    with open(class_list_file, 'r') as f:
+        for line in f:
+            idx, gloss = line.rstrip('\n').split('\t')
+            class_names[int(idx)] = gloss
+    return class_names
+
+
+def read_video_frames(source):
+    """Yield BGR frames from anything cv2.VideoCapture can open (file path, device index or stream url)."""
+    vidcap = cv2.VideoCapture(source)
+    try:
+        while True:
+            success, img = vidcap.read()
+            if not success:
+                break
+            yield img
+    finally:
+        vidcap.release()
+
+
+def read_raw_frames(stream, width, height):
+    """Yield BGR frames from a raw bgr24 byte stream, e.g. ffmpeg ... -f rawvideo -pix_fmt bgr24 -."""
+    frame_bytes = width * height * 3
+    while True:
+        buf = stream.read(frame_bytes)
+        if len(buf) < frame_bytes:
+            break
+        yield np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)
+
+
+def center_crop(img, size):
+    h, w, c = img.shape
+    i = int(np.round((h - size) / 2.))
+    j = int(np.round((w - size) / 2.))
+    return img[i:i + size, j:j + size, :]
+
+
+class FrameRingBuffer(object):
+    """Fixed-capacity buffer of preprocessed frames addressed by absolute frame number.
+
+    Frames are written in place, so a frame is decoded, resized and normalized exactly once no matter how many
+    overlapping windows it ends up in.
+    """
+
+    def __init__(self, capacity, frame_shape, dtype=np.float32):
+        self.capacity = capacity
+        self.frames = np.zeros((capacity,) + tuple(frame_shape), dtype=dtype)
+        self.num_pushed = 0
+
+    def push(self, frame):
+        self.frames[self.num_pushed % self.capacity] = frame
+        self.num_pushed += 1
+
+    @property
+    def oldest(self):
+        return max(0, self.num_pushed - self.capacity)
+
+    def window(self, end, size):
+        """Return frames [end - size, end) as a (size x H x W x C) array."""
+        start = end - size
+        if start < self.oldest or end > self.num_pushed:
+            raise IndexError('Frames [{}, {}) are not in the buffer (holding [{}, {})).'.format(
+                start, end, self.oldest, self.num_pushed))
+
+        first = start % self.capacity
+        if first + size <= self.capacity:
+            return self.frames[first:first + size]
+        return np.concatenate([self.frames[first:], self.frames[:first + size - self.capacity]], axis=0)
+
+
+def temporal_iou(a, b):
+    inter = min(a[1], b[1]) - max(a[0], b[0])
+    if inter <= 0:
+        return 0.
+    return float(inter) / (max(a[1], b[1]) - min(a[0], b[0]))
+
+
+def temporal_nms(segments, iou_threshold, kept=()):
+    """Greedy temporal NMS over (class_id, start, end, score) tuples, highest score first.
+
+    Segments in `kept` were already selected and suppress overlapping ones, but are not returned again.
+    """
+    keep = list(kept)
+    for seg in sorted(segments, key=lambda s: s[3], reverse=True):
+        if all(temporal_iou(seg[1:3], k[1:3]) <= iou_threshold for k in keep):
+            keep.append(seg)
+    return sorted(keep[len(kept):], key=lambda s: s[1])
+
+
+class StreamingSignSpotter(object):
+    """Sliding-window I3D recognizer over an incoming frame stream.
+
+    A window of `window_size` frames is scored every `hop` frames. When the consumer falls behind, all due
+    windows (up to `max_batch`) are scored in one forward pass. A detection is emitted once no later window can
+    overlap it by more than `nms_iou`, so the delay between a sign ending and its segment being reported is
+    bounded by the window size rather than the video length. Note that I3D pads every temporal convolution
+    'same'-style, so intermediate activations depend on the window boundaries; overlapping windows therefore
+    share the decoded and preprocessed frames, not backbone features.
+    """
+
+    def __init__(self, model, class_names=None, window_size=64, hop=8, crop_size=224, score_threshold=0.5,
+                 nms_iou=0.3, max_batch=4, device='cpu'):
+        assert 0 < hop <= window_size, 'hop must be in (0, window_size].'
+
+        self.model = model
+        self.class_names = class_names
+        self.window_size = window_size
+        self.hop = hop
+        self.crop_size = crop_size
+        self.score_threshold = score_threshold
+        self.nms_iou = nms_iou
+        self.max_batch = max_batch
+        self.device = device
+
+        self.ring = FrameRingBuffer(window_size + hop * max_batch, (crop_size, crop_size, 3))
+        self.due_windows = []
+        self.candidates = []
+        self.emitted = []
+
+        # a later window can only suppress a detection if it starts less than this many frames after it
+        self.suppress_range = window_size * (1. - nms_iou) / (1. + nms_iou)
+
+        self.batch_latencies = collections.deque(maxlen=1000)
+
+    def push(self, img):
+        """Add one decoded BGR frame to the stream."""
+        frame = center_crop(preprocess_frame(img), self.crop_size)
+        self.ring.push(frame)
+
+        end = self.ring.num_pushed
+        if end >= self.window_size and (end - self.window_size) % self.hop == 0:
+            self.due_windows.append(end)
+
+    def process(self):
+        """Score all due windows and return the segments that became final."""
+        # windows overwritten in the ring buffer can no longer be scored; skip them to stay real-time
+        self.due_windows = [end for end in self.due_windows if end - self.window_size >= self.ring.oldest]
+
+        while self.due_windows:
+            batch_ends = self.due_windows[:self.max_batch]
+            self.due_windows = self.due_windows[self.max_batch:]
+            self._score_windows(batch_ends)
+
+        return self._pop_final(self.ring.num_pushed - self.window_size + self.hop)
+
+    def flush(self):
+        """Score whatever is due and return every remaining segment."""
+        final = self.process()
+        return final + self._pop_final(float('inf'))
+
+    def _score_windows(self, ends):
+        start_time = time.time()
+
+        clips = np.stack([self.ring.window(end, self.window_size) for end in ends])
+        # b x t x h x w x c -> b x c x t x h x w
+        inputs = torch.from_numpy(clips.transpose([0, 4, 1, 2, 3])).to(self.device)
+
+        with torch.no_grad():
+            per_frame_logits = self.model(inputs)
+            probs = F.softmax(torch.mean(per_frame_logits, dim=2), dim=1)
+            scores, class_ids = torch.max(probs, dim=1)
+
+        for end, score, class_id in zip(ends, scores.tolist(), class_ids.tolist()):
+            if score >= self.score_threshold:
+                self.candidates.append((class_id, end - self.window_size, end, score))
+
+        self.batch_latencies.append((time.time() - start_time, len(ends)))
+
+    def _pop_final(self, next_window_start):
+        settled = [c for c in self.candidates if next_window_start - c[1] >= self.suppress_range]
+        if not settled:
+            return []
+
+        # a settled candidate is only final if no overlapping candidate (settled or not) outscores it
+        final = [seg for seg in temporal_nms(self.candidates, self.nms_iou, kept=self.emitted) if seg in settled]
+
+        self.candidates = [c for c in self.candidates if c not in settled]
+        # emitted segments keep suppressing candidates that may still overlap them
+        self.emitted = [e for e in self.emitted + final if e[2] > next_window_start]
+        return [self._to_output(seg) for seg in final]
+
+    def _to_output(self, seg):
+        class_id, start, end, score = seg
+        gloss = self.class_names.get(class_id, str(class_id)) if self.class_names else str(class_id)
+        return gloss, start, end, score
+
+    def latency_stats(self):
+        if not self.batch_latencies:
+            return {}
+        lat = np.asarray([l for l, n in self.batch_latencies]) * 1000
+        num_windows = sum(n for l, n in self.batch_latencies)
+        return {'batches': len(lat), 'windows': num_windows, 'mean_ms': float(lat.mean()),
+                'p50_ms': float(np.percentile(lat, 50)), 'p95_ms': float(np.percentile(lat, 95)),
+                'max_ms': float(lat.max())}
+
+
+def run_stream(spotter, frames, live=False, queue_size=256):
+    """Feed frames to the spotter and yield final segments as they appear.
+
+    With `live=True`, frames are read on a background thread so decoding keeps up with the source while the
+    model runs; windows completed by frames that arrived in the meantime are then scored as one batch.
+    """
+    if not live:
+        for img in frames:
+            spotter.push(img)
+            for seg in spotter.process():
+                yield seg
+    else:
+        frame_queue = queue.Queue(maxsize=queue_size)
+
+        def reader():
+            # always end with the sentinel, after the source's exception if it raised one
+            try:
+                for img in frames:
+                    frame_queue.put(img)
+            except Exception as e:
+                frame_queue.put(e)
+            finally:
+                frame_queue.put(None)
+
+        threading.Thread(target=reader, daemon=True).start()
+
+        done = False
+        while not done:
+            # block for one frame, then take what arrived while the model was busy, up to one full batch of hops
+            img = frame_queue.get()
+            num_taken = 0
+            while img is not None:
+                if isinstance(img, Exception):
+                    raise img
+                spotter.push(img)
+                num_taken += 1
+                if num_taken >= spotter.hop * spotter.max_batch:
+                    break
+                try:
+                    img = frame_queue.get_nowait()
+                except queue.Empty:
+                    break
+            done = img is None
+
+            for seg in spotter.process():
+                yield seg
+
+    for seg in spotter.flush():
+        yield seg
+
+
+def load_model(weights, num_classes, device='cpu'):
+    i3d = InceptionI3d(400, in_channels=3)
+    i3d.replace_logits(num_classes)
+    i3d.load_state_dict(torch.load(weights, map_location='cpu'))
+    i3d.to(device)
+    i3d.eval()
+    return i3d
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-weights', type=str, required=True)
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('-source', type=str, required=True,
+                        help='video file, capture device index, stream url, or - for a raw bgr24 pipe on stdin')
+    parser.add_argument('--width', type=int, help='frame width of the raw pipe')
+    parser.add_argument('--height', type=int, help='frame height of the raw pipe')
+    parser.add_argument('--class_list', type=str, default='preprocess/wlasl_class_list.txt')
+    parser.add_argument('--window', type=int, default=64)
+    parser.add_argument('--hop', type=int, default=8)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--nms_iou', type=float, default=0.3)
+    parser.add_argument('--max_batch', type=int, default=4)
+    parser.add_argument('--live', action='store_true', help='decode on a background thread')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    if args.source == '-':
+        assert args.width and args.height, '--width and --height are required for raw pipes.'
+        frames = read_raw_frames(sys.stdin.buffer, args.width, args.height)
+    else:
+        frames = read_video_frames(int(args.source) if args.source.isdigit() else args.source)
+
+    spotter = StreamingSignSpotter(load_model(args.weights, args.num_classes, device),
+                                   class_names=load_class_names(args.class_list),
+                                   window_size=args.window, hop=args.hop, score_threshold=args.threshold,
+                                   nms_iou=args.nms_iou, max_batch=args.max_batch, device=device)
+
+    for gloss, start, end, score in run_stream(spotter, frames, live=args.live):
+        print('{}\t{}\t{}\t{:.4f}'.format(gloss, start, end, score))
+        sys.stdout.flush()
+
+    print(spotter.latency_stats(), file=sys.stderr)
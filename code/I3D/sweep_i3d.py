@@ -0,0 +1,116 @@
+"""Accuracy against latency of a fine-tuned InceptionI3d at reduced input resolution and frame rate.
+
+Every operating point evaluates the whole test split as test_i3d.py does (whole videos, center crop, max over
+time), but frames are first resized so the crop covers the same field of view as the 224 px crop of the 256 px
+videos, and only every `stride`-th frame is decoded. The model itself is unchanged; the adaptive average pool
+in InceptionI3d makes it accept any crop size.
+
+    python sweep_i3d.py -weights archived/asl100/ckpt.pt -num_classes 100 -split preprocess/nslt_100.json \
+        -root ../../data/WLASL2000 --sizes 160 192 224 --strides 1 2 --out sweep_asl100.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+from torchvision import transforms
+
+import videotransforms
+from datasets.nslt_dataset_all import NSLT as Dataset
+from pytorch_i3d import InceptionI3d
+
+
+def build_transforms(size):
+    # the 224 px crop of the 256 px videos, scaled down to `size`
+    return transforms.Compose([videotransforms.Resize(int(round(256 * size / 224.))),
+                               videotransforms.CenterCrop(size)])
+
+
+def evaluate(i3d, dataloader, device, max_videos=None):
+    """Top-1/5/10 accuracy and mean forward latency per video."""
+    correct = {1: 0, 5: 0, 10: 0}
+    times = []
+    num_frames = []
+    with torch.no_grad():
+        for i, (inputs, labels, video_id) in enumerate(dataloader):
+            if i == max_videos:
+                break
+            inputs = inputs.to(device)
+            if inputs.is_cuda:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            per_frame_logits = i3d(inputs)
+            if inputs.is_cuda:
+                torch.cuda.synchronize()
+            times.append(time.perf_counter() - start)
+            num_frames.append(inputs.size(2))
+
+            predictions = torch.max(per_frame_logits, dim=2)[0][0]
+            out_labels = torch.argsort(predictions, descending=True).cpu().numpy()
+            for k in correct:
+                if labels[0].item() in out_labels[:k]:
+                    correct[k] += 1
+
+    n = len(times)
+    return {'videos': n,
+            'top1': correct[1] / float(n), 'top5': correct[5] / float(n), 'top10': correct[10] / float(n),
+            # the first video also pays for cudnn autotuning and allocator warm up
+            'mean_ms': 1000 * float(np.mean(times[1:] or times)),
+            'mean_frames': float(np.mean(num_frames))}
+
+
+def sweep(i3d, split_file, root, sizes, strides, device, num_workers=2, max_videos=None):
+    results = []
+    for stride in strides:
+        for size in sizes:
+            dataset = Dataset(split_file, 'test', root, 'rgb', build_transforms(size), temporal_stride=stride)
+            dataloader = torch.utils.data.DataLoader(dataset, batch_size=1, shuffle=False,
+                                                     num_workers=num_workers, pin_memory=False)
+            r = evaluate(i3d, dataloader, device, max_videos=max_videos)
+            r.update({'size': size, 'stride': stride})
+            print('size {} stride {}: top1 {:.4f} top5 {:.4f} top10 {:.4f} {:.1f} ms/video'.format(
+                size, stride, r['top1'], r['top5'], r['top10'], r['mean_ms']))
+            results.append(r)
+    return results
+
+
+def print_table(results):
+    reference = max(results, key=lambda r: (r['size'], -r['stride']))
+    print('{:>5} {:>7} {:>7} {:>7} {:>7} {:>10} {:>8}'.format('size', 'stride', 'top1', 'top5', 'top10',
+                                                              'ms/video', 'speedup'))
+    for r in sorted(results, key=lambda r: r['mean_ms']):
+        print('{:>5} {:>7} {:>7.4f} {:>7.4f} {:>7.4f} {:>10.1f} {:>7.2f}x'.format(
+            r['size'], r['stride'], r['top1'], r['top5'], r['top10'], r['mean_ms'],
+            reference['mean_ms'] / r['mean_ms']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-weights', type=str, required=True, help='fine-tuned InceptionI3d state dict')
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('-split', type=str, required=True)
+    parser.add_argument('-root', type=str, required=True)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[160, 192, 224])
+    parser.add_argument('--strides', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--max_videos', type=int, default=None, help='only evaluate the first n test videos')
+    parser.add_argument('--num_workers', type=int, default=2)
+    parser.add_argument('--out', type=str, default='sweep_i3d.json')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    i3d = InceptionI3d(400, in_channels=3)
+    i3d.replace_logits(args.num_classes)
+    i3d.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    i3d.to(device)
+    i3d.eval()
+
+    results = sweep(i3d, args.split, args.root, args.sizes, args.strides, device,
+                    num_workers=args.num_workers, max_videos=args.max_videos)
+    print_table(results)
+
+    with open(args.out, 'w') as f:
+        json.dump({'weights': args.weights, 'split': args.split, 'device': device,
+                   'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=2)
+    print('results written to {}'.format(args.out))
@@ -13,6 +13,7 @@ import videotransforms
 import numpy as np
 
 import torch.nn.functional as F
+from prediction_cache import PredictionCache, file_sha256
 from pytorch_i3d import InceptionI3d
 
 # from nslt_dataset_all import NSLT as Dataset
@@ -26,6 +27,7 @@ parser = argparse.ArgumentParser()
 parser.add_argument('-mode', type=str, help='rgb or flow')
 parser.add_argument('-save_model', type=str)
 parser.add_argument('-root', type=str)
+parser.add_argument('--cache_dir', type=str, default=None, help='reuse and store predictions in this directory')
 
 args = parser.parse_args()
 
@@ -54,6 +56,50 @@ def load_rgb_frames_from_video(video_path, start=0, num=-1):
     return torch.Tensor(np.asarray(frames, dtype=np.float32))
 
 
+class CachedVideoDataset(torch.utils.data.Dataset):
+    """Wraps an nslt_dataset_all.NSLT so that videos with cached logits are neither read nor decoded.
+
+    Returns (inputs, label, video_id, cached_logits, key); exactly one of inputs and cached_logits is an empty
+    tensor, so the batches still collate.
+    """
+
+    def __init__(self, dataset, cache, model_hash, config):
+        self.dataset = dataset
+        self.cache = cache
+        self.model_hash = model_hash
+        self.config = config
+
+    def __getitem__(self, index):
+        vid = self.dataset.data[index][0]
+        key = self.cache.key(file_sha256(os.path.join(self.dataset.root, vid + '.mp4')), self.model_hash,
+                             self.config)
+        logits = self.cache.get(key)
+        if logits is not None:
+            return torch.zeros(0), self.dataset.data[index][1], vid, torch.from_numpy(logits), key
+
+        inputs, label, vid = self.dataset[index]
+        return inputs, label, vid, torch.zeros(0), key
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def with_prediction_cache(dataset, cache_dir, weights, config):
+    """Wrap `dataset` so cached videos skip decoding; returns (dataset, cache), cache is None without cache_dir."""
+    if not cache_dir:
+        return dataset, None
+    cache = PredictionCache(cache_dir)
+    return CachedVideoDataset(dataset, cache, file_sha256(weights), config), cache
+
+
+def unpack(data):
+    """(inputs, labels, video_id, cached logits, cache key) of a batch, with or without a prediction cache."""
+    if len(data) == 5:
+        return data
+    inputs, labels, video_id = data
+    return inputs, labels, video_id, None, None
+
+
 def run(init_lr=0.1,
         max_steps=64e3,
         mode='rgb',
@@ -61,11 +107,15 @@ def run(init_lr=0.1,
         train_split='charades/charades.json',
         batch_size=3 * 15,
         save_model='',
-        weights=None):
+        weights=None,
+        cache_dir=None):
     # setup dataset
     test_transforms = transforms.Compose([videotransforms.CenterCrop(224)])
 
     val_dataset = Dataset(train_split, 'test', root, mode, test_transforms)
+    # the cached output is the per-frame logits of the whole video, center cropped to 224
+    val_dataset, cache = with_prediction_cache(val_dataset, cache_dir, weights,
+                                               {'eval': 'run', 'mode': mode, 'crop_size': 224, 'stride': 1})
     val_dataloader = torch.utils.data.DataLoader(val_dataset, batch_size=1,
                                                  shuffle=False, num_workers=2,
                                                  pin_memory=False)
@@ -99,10 +149,17 @@ def run(init_lr=0.1,
     top10_fp = np.zeros(num_classes, dtype=np.int)
     top10_tp = np.zeros(num_classes, dtype=np.int)
 
+    num_cached = 0
     for data in dataloaders["test"]:
-        inputs, labels, video_id = data  # inputs: b, c, t, h, w
+        inputs, labels, video_id, cached, key = unpack(data)  # inputs: b, c, t, h, w
 
-        per_frame_logits = i3d(inputs)
+        if cached is not None and cached.numel():
+            per_frame_logits = cached
+            num_cached += 1
+        else:
+            per_frame_logits = i3d(inputs)
+            if cache is not None:
+                cache.put(key[0], per_frame_logits[0])
 
         predictions = torch.max(per_frame_logits, dim=2)[0]
         out_labels = np.argsort(predictions.cpu().detach().numpy()[0])
@@ -127,18 +184,23 @@ def run(init_lr=0.1,
               float(correct_10) / len(dataloaders["test"]))
 
         # per-class accuracy
+    if cache is not None:
+        print('{} of {} videos served from the prediction cache'.format(num_cached, len(dataloaders["test"])))
     top1_per_class = np.mean(top1_tp / (top1_tp + top1_fp))
     top5_per_class = np.mean(top5_tp / (top5_tp + top5_fp))
     top10_per_class = np.mean(top10_tp / (top10_tp + top10_fp))
     print('top-k average per class acc: {}, {}, {}'.format(top1_per_class, top5_per_class, top10_per_class))
 
 
-def ensemble(mode, root, train_split, weights, num_classes):
+def ensemble(mode, root, train_split, weights, num_classes, cache_dir=None):
     # setup dataset
     test_transforms = transforms.Compose([videotransforms.CenterCrop(224)])
     # test_transforms = transforms.Compose([])
 
     val_dataset = Dataset(train_split, 'test', root, mode, test_transforms)
+    # the cached output is the class scores averaged over 64-frame segments
+    val_dataset, cache = with_prediction_cache(val_dataset, cache_dir, weights,
+                                               {'eval': 'ensemble', 'mode': mode, 'crop_size': 224, 'segment': 64})
     val_dataloader = torch.utils.data.DataLoader(val_dataset, batch_size=1,
                                                  shuffle=False, num_workers=2,
                                                  pin_memory=False)
@@ -174,11 +236,13 @@ def ensemble(mode, root, train_split, weights, num_classes):
     top10_tp = np.zeros(num_classes, dtype=np.int)
 
     for data in dataloaders["test"]:
-        inputs, labels, video_id = data  # inputs: b, c, t, h, w
+        inputs, labels, video_id, cached, key = unpack(data)  # inputs: b, c, t, h, w
 
-        t = inputs.size(2)
         num = 64
-        if t > num:
+        if cached is not None and cached.numel():
+            predictions = cached[0]
+        elif inputs.size(2) > num:
+            t = inputs.size(2)
             num_segments = math.floor(t / num)
 
             segments = []
@@ -197,6 +261,9 @@ def ensemble(mode, root, train_split, weights, num_classes):
             per_frame_logits = i3d(inputs)
             predictions = torch.mean(per_frame_logits, dim=2)[0]
 
+        if cache is not None and not cached.numel():
+            cache.put(key[0], predictions)
+
         out_labels = np.argsort(predictions.cpu().detach().numpy())
 
         if labels[0].item() in out_labels[-5:]:
@@ -251,10 +318,8 @@ def run_on_tensor(weights, ip_tensor, num_classes):
 
 
 def get_slide_windows(frames, window_size, stride=1):
-    indices = torch.arange(0, frames.shape[0])
-    window_indices = indices.unfold(0, window_size, stride)
-
-    return frames[window_indices, :, :, :].transpose(1, 2)
+    # unfold returns a strided view (n x c x h x w x window), so overlapping windows are not copied
+    return frames.unfold(0, window_size, stride).permute(0, 1, 4, 2, 3)
 
 
 if __name__ == '__main__':
@@ -269,4 +334,5 @@ if __name__ == '__main__':
     train_split = 'preprocess/nslt_{}.json'.format(num_classes)
     weights = 'archived/asl2000/FINAL_nslt_2000_iters=5104_top1=32.48_top5=57.31_top10=66.31.pt'
 
-    run(mode=mode, root=root, save_model=save_model, train_split=train_split, weights=weights)
+    run(mode=mode, root=root, save_model=save_model, train_split=train_split, weights=weights,
+        cache_dir=args.cache_dir)
@@ -1,5 +1,6 @@
 import os
 import argparse
+import time
 
 import torch
 import torch.nn as nn
@@ -13,7 +14,10 @@ import videotransforms
 
 import numpy as np
 
+from checkpoint_manager import CheckpointManager, capture_rng_state, restore_rng_state
 from configs import Config
+from multigrid import MultigridSchedule, train_transforms as multigrid_transforms
+from pipeline_profiler import StageProfiler, TimedCollate
 from pytorch_i3d import InceptionI3d
 
 # from datasets.nslt_dataset import NSLT as Dataset
@@ -27,6 +31,8 @@ parser.add_argument('-mode', type=str, help='rgb or flow')
 parser.add_argument('-save_model', type=str)
 parser.add_argument('-root', type=str)
 parser.add_argument('--num_class', type=int)
+parser.add_argument('--resume', type=str, nargs='?', const='latest', default=None,
+                    help='resume from the latest checkpoint in save_model, or from the given checkpoint file')
 
 args = parser.parse_args()
 
@@ -42,19 +48,41 @@ def run(configs,
         root='/ssd/Charades_v1_rgb',
         train_split='charades/charades.json',
         save_model='',
-        weights=None):
+        weights=None,
+        resume=None):
     print(configs)
 
     # setup dataset
-    train_transforms = transforms.Compose([videotransforms.RandomCrop(224),
-                                           videotransforms.RandomHorizontalFlip(), ])
+    # clip shape and batch size of the training data follow the multigrid schedule (a single 64x224 phase by default)
+    schedule = MultigridSchedule.from_config(configs)
+    print(schedule)
+    phase_cfg = schedule.phases[0]
     test_transforms = transforms.Compose([videotransforms.CenterCrop(224)])
 
-    dataset = Dataset(train_split, 'train', root, mode, train_transforms)
-    dataloader = torch.utils.data.DataLoader(dataset, batch_size=configs.batch_size, shuffle=True, num_workers=0,
-                                             pin_memory=True)
+    dataset = Dataset(train_split, 'train', root, mode, multigrid_transforms(phase_cfg.crop_size),
+                      num_frames=phase_cfg.num_frames, temporal_stride=phase_cfg.temporal_stride)
 
-    val_dataset = Dataset(train_split, 'test', root, mode, test_transforms)
+    num_workers = 0
+
+    # optional data pipeline profiling, reported every PROFILE_INTERVAL training iterations; it keeps one row of
+    # timings per loader worker, so it must know the loader's worker count
+    profiler = None
+    if configs.profile_interval > 0:
+        profiler = StageProfiler(Dataset.PROFILE_STAGES + ('collate', 'data_wait', 'step'), num_workers=num_workers)
+        dataset.profiler = profiler
+
+    def train_loader(phase_cfg):
+        dataset.transforms = multigrid_transforms(phase_cfg.crop_size)
+        dataset.num_frames = phase_cfg.num_frames
+        dataset.temporal_stride = phase_cfg.temporal_stride
+        return torch.utils.data.DataLoader(dataset, batch_size=phase_cfg.batch_size, shuffle=True,
+                                           num_workers=num_workers,
+                                           pin_memory=True,
+                                           collate_fn=TimedCollate(profiler) if profiler else None)
+
+    dataloader = train_loader(phase_cfg)
+
+    val_dataset = Dataset(train_split, 'test', root, mode, test_transforms, temporal_stride=configs.temporal_stride)
     val_dataloader = torch.utils.data.DataLoader(val_dataset, batch_size=configs.batch_size, shuffle=True, num_workers=2,
                                                  pin_memory=False)
 
@@ -90,10 +118,32 @@ def run(configs,
     best_val_score = 0
     # train it
     scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=5, factor=0.3)
+
+    ckpt_manager = CheckpointManager(save_model or '.', prefix='nslt_{}'.format(num_classes),
+                                     keep_last=configs.keep_last, keep_best=configs.keep_best, mode='max')
+    if resume:
+        checkpoint = ckpt_manager.load(None if resume == 'latest' else resume)
+        if checkpoint is None:
+            print('no checkpoint to resume from in {}, starting from scratch'.format(save_model))
+        else:
+            i3d.module.load_state_dict(checkpoint['model'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            scheduler.load_state_dict(checkpoint['scheduler'])
+            steps, epoch, best_val_score = checkpoint['steps'], checkpoint['epoch'], checkpoint['best_val_score']
+            restore_rng_state(checkpoint['rng'])
+            print('resumed from epoch {} step {}'.format(epoch, steps))
+
     while steps < configs.max_steps and epoch < 400:  # for epoch in range(num_epochs):
         print('Step {}/{}'.format(steps, configs.max_steps))
         print('-' * 10)
 
+        # the schedule moves to the next clip shape at epoch boundaries
+        if schedule.phase_at(steps) != phase_cfg:
+            phase_cfg = schedule.phase_at(steps)
+            dataloaders['train'] = train_loader(phase_cfg)
+            print('multigrid phase: {} frames x {}px, batch size {}'.format(phase_cfg.num_frames, phase_cfg.crop_size,
+                                                                           phase_cfg.batch_size))
+
         epoch += 1
         # Each epoch has a training and validation phase
         for phase in ['train', 'test']:
@@ -111,8 +161,15 @@ def run(configs,
             optimizer.zero_grad()
 
             confusion_matrix = np.zeros((num_classes, num_classes), dtype=np.int)
+            profile_phase = profiler is not None and phase == 'train'
+            num_profiled = 0
+            fetch_start = time.perf_counter()
             # Iterate over data.
             for data in dataloaders[phase]:
+                batch_ready = time.perf_counter()
+                if profile_phase:
+                    profiler.add('data_wait', batch_ready - fetch_start)
+
                 num_iter += 1
                 # get the inputs
                 if data == -1: # bracewell does not compile opencv with ffmpeg, strange errors occur resulting in no video loaded
@@ -167,6 +224,13 @@ def run(configs,
                                                                                                                  tot_loss / 10,
                                                                                                                  acc))
                         tot_loss = tot_loc_loss = tot_cls_loss = 0.
+
+                if profile_phase:
+                    fetch_start = time.perf_counter()
+                    profiler.add('step', fetch_start - batch_ready)
+                    num_profiled += 1
+                    if num_profiled % configs.profile_interval == 0:
+                        print(profiler.report())
             if phase == 'test':
                 val_score = float(np.trace(confusion_matrix)) / np.sum(confusion_matrix)
                 if val_score > best_val_score or epoch % 2 == 0:
@@ -174,7 +238,7 @@ def run(configs,
                     model_name = save_model + "nslt_" + str(num_classes) + "_" + str(steps).zfill(
                                    6) + '_%3f.pt' % val_score
 
-                    torch.save(i3d.module.state_dict(), model_name)
+                    ckpt_manager.save_weights(i3d.module.state_dict(), model_name)
                     print(model_name)
 
                 print('VALIDATION: {} Loc Loss: {:.4f} Cls Loss: {:.4f} Tot Loss: {:.4f} Accu :{:.4f}'.format(phase,
@@ -186,6 +250,16 @@ def run(configs,
 
                 scheduler.step(tot_loss * num_steps_per_update / num_iter)
 
+                ckpt_manager.save(steps, {'model': i3d.module.state_dict(),
+                                          'optimizer': optimizer.state_dict(),
+                                          'scheduler': scheduler.state_dict(),
+                                          'steps': steps,
+                                          'epoch': epoch,
+                                          'best_val_score': best_val_score,
+                                          'rng': capture_rng_state()}, score=val_score)
+
+    ckpt_manager.close()
+
 
 if __name__ == '__main__':
     # WLASL setting
@@ -201,4 +275,5 @@ if __name__ == '__main__':
 
     configs = Config(config_file)
     print(root, train_split)
-    run(configs=configs, mode=mode, root=root, save_model=save_model, train_split=train_split, weights=weights)
+    run(configs=configs, mode=mode, root=root, save_model=save_model, train_split=train_split, weights=weights,
+        resume=args.resume)
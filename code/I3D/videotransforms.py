@@ -2,6 +2,8 @@ import numpy as np
 import numbers
 import random
 
+import cv2
+
 class RandomCrop(object):
     """Crop the given video sequences (t x h x w) at a random location.
     Args:
@@ -100,3 +102,38 @@ class RandomHorizontalFlip(object):
 
     def __repr__(self):
         return self.__class__.__name__ + '(p={})'.format(self.p)
+
+
+class Resize(object):
+    """Resize the given seq Images.
+    Args:
+        size (sequence or int): Desired output size (h, w). If size is an int, the shorter side is
+            matched to it and the aspect ratio is kept.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    def __call__(self, imgs):
+        """
+        Args:
+            imgs (seq Images): seq Images of shape (t x h x w x c) to be resized.
+        Returns:
+            seq Images: Resized seq images.
+        """
+        t, h, w, c = imgs.shape
+        if isinstance(self.size, numbers.Number):
+            if h < w:
+                th, tw = int(self.size), int(round(w * self.size / h))
+            else:
+                th, tw = int(round(h * self.size / w)), int(self.size)
+        else:
+            th, tw = self.size
+        if (th, tw) == (h, w):
+            return imgs
+
+        return np.asarray([cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA) for img in imgs],
+                          dtype=imgs.dtype).reshape(t, th, tw, c)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(size={0})'.format(self.size)
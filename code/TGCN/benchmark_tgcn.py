@@ -0,0 +1,379 @@
+"""Synthetic-data benchmarks for the Pose-TGCN pipeline.
+
+Generates random OpenPose keypoint json files and a matching WLASL-style split file, then measures
+    - Sign_Dataset loading throughput (samples/sec) for the training and test sampling strategies, from the json
+      files and from a pose store (gen_features.py), and of the device-resident DevicePoseDataset,
+    - GCN_muti_att forward and forward/backward latency for several batch sizes and clip lengths,
+    - the same for several graph sizes (KEYPOINTS) and top-k sparse attention (ATT_TOPK),
+    - full training step throughput (cross entropy, backward, Adam step), with a per-step loss.item() and with
+      the on-device metrics of train_utils.train,
+    - training steps of N models one after the other against one step of their stacked ensemble (sweep_tgcn.py).
+Results are written as json; pass --compare to print the change against an earlier result file.
+
+    python benchmark_tgcn.py --out bench_tgcn.json
+    python benchmark_tgcn.py --out bench_tgcn_new.json --compare bench_tgcn.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+
+from configs import Config
+from device_dataset import DevicePoseDataset
+from gen_features import generate
+from pose_store import PoseStore
+from sign_dataset import KEYPOINT_SETS, Sign_Dataset
+from sweep_tgcn import EnsembleGCN, StackedAdam
+from tgcn_model import GCN_muti_att
+from train_utils import MetricAccumulator
+
+
+def make_synthetic_data(root, num_glosses=10, videos_per_gloss=4, num_frames=60, seed=0):
+    """Write random OpenPose json files (one per frame) and a WLASL-style split file under `root`."""
+    rng = np.random.RandomState(seed)
+    pose_root = os.path.join(root, 'pose_per_individual_videos')
+    os.makedirs(pose_root, exist_ok=True)
+
+    content = []
+    vid_counter = 0
+    for g in range(num_glosses):
+        instances = []
+        for v in range(videos_per_gloss):
+            video_id = str(vid_counter).zfill(5)
+            vid_counter += 1
+            os.makedirs(os.path.join(pose_root, video_id), exist_ok=True)
+
+            # random walk around a random rest pose, in pixel coordinates of a 256 x 256 frame
+            rest = rng.uniform(32, 224, (25 + 21 + 21, 2))
+            for f in range(1, num_frames + 1):
+                xy = rest + rng.normal(0, 2, rest.shape) * f ** 0.5
+                kps = np.concatenate([xy, rng.uniform(0.3, 1., (xy.shape[0], 1))], axis=1)
+                person = {'pose_keypoints_2d': kps[:25].ravel().tolist(),
+                          'hand_left_keypoints_2d': kps[25:46].ravel().tolist(),
+                          'hand_right_keypoints_2d': kps[46:].ravel().tolist()}
+                with open(os.path.join(pose_root, video_id, 'image_{}_keypoints.json'.format(str(f).zfill(5))),
+                          'w') as fp:
+                    json.dump({'version': 1.3, 'people': [person]}, fp)
+
+            instances.append({'video_id': video_id, 'split': 'train' if v % 4 else 'test',
+                              'frame_start': 1, 'frame_end': num_frames})
+        content.append({'gloss': 'gloss{}'.format(g), 'instances': instances})
+
+    split_file = os.path.join(root, 'synthetic.json')
+    with open(split_file, 'w') as f:
+        json.dump(content, f)
+
+    return pose_root, split_file
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def time_fn(fn, device, warmup=2, iters=10):
+    """Mean and min seconds per call of `fn` after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    sync(device)
+
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        sync(device)
+        times.append(time.perf_counter() - start)
+    return float(np.mean(times)), float(np.min(times))
+
+
+def bench_sign_dataset(pose_root, split_file, num_samples, worker_counts, batch_size, epochs=1, pose_store=None):
+    results = []
+    cases = [('rnd_start', ['train', 'val']), ('k_copies', ['test'])]
+    for strategy, split in cases:
+        dataset = Sign_Dataset(index_file_path=split_file, split=split, pose_root=pose_root,
+                               sample_strategy=strategy, num_samples=num_samples, pose_store=pose_store)
+        for num_workers in worker_counts:
+            loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True,
+                                                 num_workers=num_workers)
+            start = time.perf_counter()
+            num_seen = 0
+            for _ in range(epochs):
+                for X, y, video_ids in loader:
+                    num_seen += X.size(0)
+            elapsed = time.perf_counter() - start
+            params = {'sample_strategy': strategy, 'num_workers': num_workers, 'num_samples': num_samples,
+                      'batch_size': batch_size}
+            if pose_store is not None:
+                params['source'] = 'pose_store'
+            results.append({'name': 'sign_dataset', 'params': params, 'samples_per_sec': num_seen / elapsed})
+    return results
+
+
+def bench_device_dataset(pose_root, split_file, num_samples, batch_size, device, pose_store, epochs=5):
+    results = []
+    cases = [('rnd_start', ['train', 'val']), ('k_copies', ['test'])]
+    for strategy, split in cases:
+        dataset = Sign_Dataset(index_file_path=split_file, split=split, pose_root=pose_root,
+                               sample_strategy=strategy, num_samples=num_samples, pose_store=pose_store)
+        loader = DevicePoseDataset(dataset, device=device).loader(batch_size, shuffle=True)
+        start = time.perf_counter()
+        num_seen = 0
+        for _ in range(epochs):
+            for X, y, video_ids in loader:
+                num_seen += X.size(0)
+        sync(device)
+        elapsed = time.perf_counter() - start
+        results.append({'name': 'device_dataset',
+                        'params': {'sample_strategy': strategy, 'num_samples': num_samples, 'batch_size': batch_size,
+                                   'device': device.type},
+                        'samples_per_sec': num_seen / elapsed})
+    return results
+
+
+def bench_model(device, configs, num_classes, batch_sizes, clip_lengths, warmup, iters):
+    results = []
+    for num_samples in clip_lengths:
+        model = GCN_muti_att(input_feature=num_samples * 2, hidden_feature=configs.hidden_size,
+                             num_class=num_classes, p_dropout=configs.drop_p, num_stage=configs.num_stages).to(device)
+        for batch_size in batch_sizes:
+            params = {'batch_size': batch_size, 'num_samples': num_samples, 'hidden_size': configs.hidden_size,
+                      'num_stages': configs.num_stages}
+            X = torch.randn(batch_size, 55, num_samples * 2, device=device)
+
+            model.eval()
+
+            def forward():
+                with torch.no_grad():
+                    model(X)
+
+            mean_s, min_s = time_fn(forward, device, warmup, iters)
+            results.append({'name': 'gcn_forward', 'params': params, 'mean_ms': 1000 * mean_s,
+                            'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s})
+
+            model.train()
+
+            def forward_backward():
+                model.zero_grad()
+                model(X).sum().backward()
+
+            mean_s, min_s = time_fn(forward_backward, device, warmup, iters)
+            results.append({'name': 'gcn_forward_backward', 'params': params, 'mean_ms': 1000 * mean_s,
+                            'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s})
+    return results
+
+
+def bench_graph_sizes(device, configs, num_classes, batch_size, keypoint_sets, att_topks, warmup, iters):
+    """Forward and forward/backward latency of GCN_muti_att for several node sets and top-k attention sizes."""
+    results = []
+    num_samples = configs.num_samples
+    for keypoints in keypoint_sets:
+        num_nodes = len(KEYPOINT_SETS[keypoints])
+        for topk in att_topks:
+            model = GCN_muti_att(input_feature=num_samples * 2, hidden_feature=configs.hidden_size,
+                                 num_class=num_classes, p_dropout=configs.drop_p, num_stage=configs.num_stages,
+                                 num_nodes=num_nodes, att_topk=topk or None).to(device)
+            X = torch.randn(batch_size, num_nodes, num_samples * 2, device=device)
+            params = {'keypoints': keypoints, 'num_nodes': num_nodes, 'att_topk': topk, 'batch_size': batch_size,
+                      'num_samples': num_samples, 'hidden_size': configs.hidden_size,
+                      'num_stages': configs.num_stages}
+
+            model.eval()
+
+            def forward():
+                with torch.no_grad():
+                    model(X)
+
+            def forward_backward():
+                model.zero_grad()
+                model(X).sum().backward()
+
+            mean_s, min_s = time_fn(forward, device, warmup, iters)
+            results.append({'name': 'graph_forward', 'params': params, 'mean_ms': 1000 * mean_s,
+                            'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s})
+            model.train()
+            mean_s, min_s = time_fn(forward_backward, device, warmup, iters)
+            results.append({'name': 'graph_forward_backward', 'params': params, 'mean_ms': 1000 * mean_s,
+                            'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s})
+    return results
+
+
+def bench_train_step(device, configs, num_classes, warmup, iters):
+    num_samples, batch_size = configs.num_samples, configs.batch_size
+    model = GCN_muti_att(input_feature=num_samples * 2, hidden_feature=configs.hidden_size,
+                         num_class=num_classes, p_dropout=configs.drop_p, num_stage=configs.num_stages).to(device)
+    model.train()
+    optimizer = optim.Adam(model.parameters(), lr=configs.init_lr, eps=configs.adam_eps,
+                           weight_decay=configs.adam_weight_decay)
+
+    X = torch.randn(batch_size, 55, num_samples * 2, device=device)
+    y = torch.randint(0, num_classes, (batch_size,), device=device)
+
+    metrics = MetricAccumulator()
+
+    def step():
+        optimizer.zero_grad()
+        out = model(X)
+        loss = F.cross_entropy(out, y)
+        loss.backward()
+        optimizer.step()
+        loss.item()
+
+    def sync_free_step():
+        # as train_utils.train: metrics stay on the device between log lines
+        optimizer.zero_grad()
+        out = model(X)
+        loss = F.cross_entropy(out, y)
+        metrics.update(loss, out, y)
+        loss.backward()
+        optimizer.step()
+
+    results = []
+    for name, fn in [('gcn_train_step', step), ('gcn_train_step_sync_free', sync_free_step)]:
+        mean_s, min_s = time_fn(fn, device, warmup, iters)
+        results.append({'name': name,
+                        'params': {'batch_size': batch_size, 'num_samples': num_samples,
+                                   'hidden_size': configs.hidden_size, 'num_stages': configs.num_stages},
+                        'mean_ms': 1000 * mean_s, 'min_ms': 1000 * min_s, 'samples_per_sec': batch_size / mean_s})
+    return results
+
+
+def bench_ensemble(device, configs, num_classes, ensemble_sizes, warmup, iters):
+    num_samples, batch_size = configs.num_samples, configs.batch_size
+    X = torch.randn(batch_size, 55, num_samples * 2, device=device)
+    y = torch.randint(0, num_classes, (batch_size,), device=device)
+
+    results = []
+    for num_models in ensemble_sizes:
+        models = [GCN_muti_att(input_feature=num_samples * 2, hidden_feature=configs.hidden_size,
+                               num_class=num_classes, p_dropout=configs.drop_p,
+                               num_stage=configs.num_stages).to(device).train() for _ in range(num_models)]
+        optimizers = [optim.Adam(model.parameters(), lr=configs.init_lr, eps=configs.adam_eps) for model in models]
+        ensemble = EnsembleGCN(models, [configs.drop_p] * num_models).to(device).train()
+        ensemble_optimizer = StackedAdam(ensemble.params.values(), lr=[configs.init_lr] * num_models,
+                                         weight_decay=[0.] * num_models, eps=configs.adam_eps)
+
+        def serial_step():
+            for model, optimizer in zip(models, optimizers):
+                optimizer.zero_grad()
+                F.cross_entropy(model(X), y).backward()
+                optimizer.step()
+
+        def ensemble_step():
+            out = ensemble(X)
+            losses = F.cross_entropy(out.reshape(-1, num_classes), y.repeat(num_models), reduction='none')
+            ensemble_optimizer.zero_grad()
+            losses.view(num_models, -1).mean(dim=1).sum().backward()
+            ensemble_optimizer.step()
+
+        for name, fn in [('gcn_serial_models_step', serial_step), ('gcn_ensemble_step', ensemble_step)]:
+            mean_s, min_s = time_fn(fn, device, warmup, iters)
+            # samples_per_sec counts every (model, sample) pair
+            results.append({'name': name,
+                            'params': {'num_models': num_models, 'batch_size': batch_size,
+                                       'num_samples': num_samples, 'hidden_size': configs.hidden_size,
+                                       'num_stages': configs.num_stages},
+                            'mean_ms': 1000 * mean_s, 'min_ms': 1000 * min_s,
+                            'samples_per_sec': num_models * batch_size / mean_s})
+    return results
+
+
+def environment(device):
+    env = {'torch': torch.__version__, 'python': platform.python_version(), 'platform': platform.platform(),
+           'cpu_count': os.cpu_count(), 'torch_threads': torch.get_num_threads(), 'device': str(device)}
+    if device.type == 'cuda':
+        env['gpu'] = torch.cuda.get_device_name(device)
+    return env
+
+
+def result_key(r):
+    return r['name'] + json.dumps(r['params'], sort_keys=True)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+
+    print('{:<22} {:<85} {:>10} {:>10} {:>8}'.format('benchmark', 'params', 'baseline', 'current', 'ratio'))
+    for r in results:
+        b = baseline.get(result_key(r))
+        if b is None:
+            continue
+        print('{:<22} {:<85} {:>10.1f} {:>10.1f} {:>7.2f}x'.format(
+            r['name'], json.dumps(r['params'], sort_keys=True), b['samples_per_sec'], r['samples_per_sec'],
+            r['samples_per_sec'] / b['samples_per_sec']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default='configs/asl100.ini')
+    parser.add_argument('--out', type=str, default='bench_tgcn.json')
+    parser.add_argument('--compare', type=str, default=None, help='earlier result file to compare against')
+    parser.add_argument('--num_glosses', type=int, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--clip_lengths', type=int, nargs='+', default=[25, 50])
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--keypoint_sets', type=str, nargs='+', default=['full', 'hands', 'reduced'],
+                        choices=sorted(KEYPOINT_SETS))
+    parser.add_argument('--att_topks', type=int, nargs='+', default=[0, 8], help='0: dense attention')
+    parser.add_argument('--ensemble_sizes', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--skip', type=str, nargs='*', default=[],
+                        choices=['data', 'model', 'graph', 'train', 'ensemble'])
+    parser.add_argument('--workdir', type=str, default=None, help='where to generate data (default: a temp dir)')
+    args = parser.parse_args()
+
+    configs = Config(args.config)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(0)
+    np.random.seed(0)
+
+    results = []
+    if 'data' not in args.skip:
+        workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='wlasl_bench_'))
+        try:
+            pose_root, split_file = make_synthetic_data(workdir, num_glosses=args.num_glosses)
+            results += bench_sign_dataset(pose_root, split_file, configs.num_samples, args.workers,
+                                          batch_size=configs.batch_size)
+            generate(pose_root, os.path.join(workdir, 'pose_store'), num_workers=0)
+            results += bench_sign_dataset(pose_root, split_file, configs.num_samples, args.workers,
+                                          batch_size=configs.batch_size,
+                                          pose_store=PoseStore(os.path.join(workdir, 'pose_store')))
+            results += bench_device_dataset(pose_root, split_file, configs.num_samples, configs.batch_size, device,
+                                            PoseStore(os.path.join(workdir, 'pose_store')))
+        finally:
+            if args.workdir is None:
+                shutil.rmtree(workdir)
+
+    if 'model' not in args.skip:
+        results += bench_model(device, configs, args.num_glosses, args.batch_sizes, args.clip_lengths,
+                               args.warmup, args.iters)
+
+    if 'graph' not in args.skip:
+        results += bench_graph_sizes(device, configs, args.num_glosses, configs.batch_size, args.keypoint_sets,
+                                     args.att_topks, args.warmup, args.iters)
+
+    if 'train' not in args.skip:
+        results += bench_train_step(device, configs, args.num_glosses, args.warmup, args.iters)
+
+    if 'ensemble' not in args.skip:
+        results += bench_ensemble(device, configs, args.num_glosses, args.ensemble_sizes, args.warmup, args.iters)
+
+    for r in results:
+        print(r)
+
+    with open(args.out, 'w') as f:
+        json.dump({'benchmark': 'tgcn', 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': args.config,
+                   'env': environment(device), 'results': results}, f, indent=2)
+    print('results written to {}'.format(args.out))
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,165 @@
+import json
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+
+def capture_rng_state():
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def snapshot(obj):
+    """Recursively copy all tensors in a (nested) state to CPU, so training can go on while it is written."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+class CheckpointManager(object):
+    """Writes training checkpoints on a background thread and keeps the last N plus the best K of them.
+
+    A checkpoint is whatever dict the trainer passes in, typically model, optimizer and scheduler state dicts,
+    step counters and RNG states (see `capture_rng_state`). The state is copied to CPU memory before `save`
+    returns; serialization, the atomic rename and deleting rotated-out checkpoints happen in the background.
+    The list of kept checkpoints is recorded in `<prefix>_checkpoints.json` inside `save_dir`.
+    """
+
+    def __init__(self, save_dir, prefix='ckpt', keep_last=3, keep_best=2, mode='max'):
+        assert mode in ('max', 'min'), 'mode must be max or min.'
+
+        self.save_dir = save_dir
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.mode = mode
+        self.manifest_path = os.path.join(save_dir, prefix + '_checkpoints.json')
+
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+
+        self.entries = []
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                self.entries = json.load(f)
+
+        # a single pending save at a time: the trainer blocks instead of piling snapshots up in memory
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def save(self, step, state, score=None):
+        """Snapshot `state` and write it as the checkpoint for `step` in the background."""
+        path = os.path.join(self.save_dir, '{}_{}.pt'.format(self.prefix, str(step).zfill(6)))
+        self._submit(('checkpoint', path, snapshot(state), {'step': step, 'score': score}))
+        return path
+
+    def save_weights(self, state_dict, path):
+        """Write a plain state dict (e.g. for test scripts) in the background, outside of the rotation."""
+        self._submit(('weights', path, snapshot(state_dict), None))
+
+    def latest(self):
+        """Path of the most recent checkpoint recorded in the manifest, or None."""
+        self.wait()
+        if not self.entries:
+            return None
+        return max(self.entries, key=lambda e: e['step'])['path']
+
+    def best(self):
+        self.wait()
+        scored = [e for e in self.entries if e['score'] is not None]
+        if not scored:
+            return None
+        return self._sort_by_score(scored)[0]['path']
+
+    def load(self, path=None, map_location='cpu'):
+        """Load the checkpoint at `path`, or the latest one if no path is given."""
+        path = path or self.latest()
+        if path is None:
+            return None
+        try:
+            # checkpoints hold RNG states, which are not plain tensors
+            return torch.load(path, map_location=map_location, weights_only=False)
+        except TypeError:  # torch versions before weights_only was introduced
+            return torch.load(path, map_location=map_location)
+
+    def wait(self):
+        """Block until all submitted checkpoints are on disk."""
+        self._queue.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._worker.join()
+
+    def _submit(self, job):
+        if self._error is not None:
+            self.wait()
+        self._queue.put(job)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                kind, path, state, entry = job
+
+                tmp_path = path + '.tmp'
+                torch.save(state, tmp_path)
+                os.replace(tmp_path, path)
+
+                if kind == 'checkpoint':
+                    entry['path'] = path
+                    self.entries = [e for e in self.entries if e['path'] != path] + [entry]
+                    self._rotate()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _sort_by_score(self, entries):
+        return sorted(entries, key=lambda e: e['score'], reverse=self.mode == 'max')
+
+    def _rotate(self):
+        keep = sorted(self.entries, key=lambda e: e['step'])[-self.keep_last:] if self.keep_last > 0 else []
+        scored = [e for e in self.entries if e['score'] is not None]
+        if self.keep_best > 0:
+            keep += self._sort_by_score(scored)[:self.keep_best]
+        keep_paths = set(e['path'] for e in keep)
+
+        for e in self.entries:
+            if e['path'] not in keep_paths and os.path.exists(e['path']):
+                os.remove(e['path'])
+        self.entries = [e for e in self.entries if e['path'] in keep_paths]
+
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
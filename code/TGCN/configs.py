@@ -13,6 +13,15 @@ class Config:
         self.log_interval = int(train_config['LOG_INTERVAL'])
         self.num_samples = int(train_config['NUM_SAMPLES'])
         self.drop_p = float(train_config['DROP_P'])
+        # test-time clips per video (k_copies sampling), optional
+        self.num_copies = int(train_config.get('NUM_COPIES', 4))
+
+        # checkpointing, optional
+        self.keep_last = int(train_config.get('KEEP_LAST_CHECKPOINTS', 3))
+        self.keep_best = int(train_config.get('KEEP_BEST_CHECKPOINTS', 2))
+
+        # data pipeline profiling, optional (0 disables it)
+        self.profile_interval = int(train_config.get('PROFILE_INTERVAL', 0))
 
         # optimizer
         opt_config = config['OPTIMIZER']
@@ -24,6 +33,21 @@ class Config:
         gcn_config = config['GCN']
         self.hidden_size = int(gcn_config['HIDDEN_SIZE'])
         self.num_stages = int(gcn_config['NUM_STAGES'])
+        # graph nodes (a sign_dataset.KEYPOINT_SETS name) and top-k sparse attention, optional
+        self.keypoints = gcn_config.get('KEYPOINTS', 'full')
+        self.att_topk = int(gcn_config.get('ATT_TOPK', 0)) or None
+
+        # batched training augmentation (pose_augment.PoseAugment), optional
+        self.augment = None
+        if config.has_section('AUGMENT'):
+            aug_config = config['AUGMENT']
+            self.augment = {'rotation': float(aug_config.get('ROTATION', 0)),
+                            'scale': float(aug_config.get('SCALE', 0)),
+                            'shear': float(aug_config.get('SHEAR', 0)),
+                            'translate': float(aug_config.get('TRANSLATE', 0)),
+                            'mirror_p': float(aug_config.get('MIRROR_P', 0)),
+                            'temporal_jitter': int(aug_config.get('TEMPORAL_JITTER', 0)),
+                            'keypoint_dropout': float(aug_config.get('KEYPOINT_DROPOUT', 0))}
 
     def __str__(self):
         return 'bs={}_ns={}_drop={}_lr={}_eps={}_wd={}'.format(
@@ -0,0 +1,140 @@
+"""Device-resident version of Sign_Dataset.
+
+All poses of the split are loaded once into one contiguous (frames, 55, 2) tensor, optionally on the training
+device, with per-video offsets. A batch is then built without a DataLoader: the frame indices of all its samples
+are computed with tensor arithmetic (same rnd_start / k_copies rules as sign_dataset.py) and gathered in one
+indexing op.
+
+    dataset = Sign_Dataset(split_file, ['train', 'val'], pose_root, num_samples=50, pose_store=PoseStore(root))
+    train_loader = DevicePoseDataset(dataset, device='cuda').loader(batch_size=64, shuffle=True)
+    for X, y, video_ids in train_loader:   # X: (64, 55, 100) on the device
+        ...
+
+Frames without a detection are filled once at load time with the previous detected pose (the first detected pose
+for leading frames), instead of per sampled window as Sign_Dataset does; videos with complete detections give
+exactly the same batches.
+"""
+import math
+import os
+
+import numpy as np
+import torch
+
+from pose_store import read_video_poses
+
+
+def _fill_missing(poses):
+    """Replace NaN frames of a (frames, 55, C) array by the previous detected frame, leading ones by the first."""
+    detected = ~np.isnan(poses[:, 0, 0])
+    if not detected.any():
+        return np.zeros_like(poses)
+    latest = np.maximum.accumulate(np.where(detected, np.arange(len(poses)), -1))
+    latest[latest < 0] = np.argmax(detected)
+    return poses[latest]
+
+
+class DevicePoseDataset(object):
+
+    def __init__(self, dataset, device='cpu', dtype=torch.float32):
+        """`dataset` is a Sign_Dataset; its split, labels, sampling strategy and pose source are reused."""
+        assert dataset.sample_strategy in ('rnd_start', 'k_copies'), \
+            'unsupported sample strategy: {}'.format(dataset.sample_strategy)
+        self.dataset = dataset
+        self.device = device
+        self.sample_strategy = dataset.sample_strategy
+        self.num_samples = dataset.num_samples
+        self.num_copies = dataset.num_copies
+
+        arrays = {}
+        offsets, first_frames, lengths = {}, {}, {}
+        num_frames = 0
+        for video_id, _, _, _ in dataset.data:
+            if video_id in arrays:
+                continue
+            if dataset.pose_store is not None:
+                entry = dataset.pose_store.videos[video_id]
+                first_frame, poses = entry['first_frame'], np.asarray(dataset.pose_store.video(video_id))
+            else:
+                first_frame, poses = read_video_poses(os.path.join(dataset.pose_root, video_id))
+            arrays[video_id] = _fill_missing(poses[:, dataset.keypoints, :2].astype(np.float32))
+            offsets[video_id], first_frames[video_id], lengths[video_id] = num_frames, first_frame, len(poses)
+            num_frames += len(poses)
+
+        self.poses = torch.from_numpy(np.concatenate(list(arrays.values()))).to(device=device, dtype=dtype)
+
+        # per sample: where its video starts in self.poses, the frame id stored there, and its frame range
+        self.video_ids = [video_id for video_id, _, _, _ in dataset.data]
+        self.labels = torch.tensor([int(gloss_cat) for _, gloss_cat, _, _ in dataset.data], device=device)
+        self.offsets = torch.tensor([offsets[vid] for vid in self.video_ids], device=device)
+        self.first_frames = torch.tensor([first_frames[vid] for vid in self.video_ids], device=device)
+        self.lengths = torch.tensor([lengths[vid] for vid in self.video_ids], device=device)
+        self.frame_starts = torch.tensor([start for _, _, start, _ in dataset.data], device=device)
+        self.frame_ends = torch.tensor([end for _, _, _, end in dataset.data], device=device)
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def frame_ids(self, index):
+        """(B, L) frame ids to sample for the samples `index` (a 1-d long tensor)."""
+        start, end = self.frame_starts[index], self.frame_ends[index]
+        num_frames = end - start + 1
+        ns = self.num_samples
+        steps = torch.arange(ns, device=self.device)
+
+        if self.sample_strategy == 'rnd_start':
+            # a random start among the num_frames - ns possible ones, or the whole (padded) clip if it is too short
+            choices = (num_frames - ns).clamp(min=1)
+            offset = (torch.rand(len(index), device=self.device) * choices).long()
+            first = torch.where(num_frames > ns, start + offset, start)
+            return torch.min(first.unsqueeze(1) + steps, end.unsqueeze(1))
+
+        # k_copies: see k_copies_fixed_length_sequential_sampling
+        k = self.num_copies
+        copies = torch.arange(k, device=self.device)
+        # short clips: the clip padded with its last frame, repeated k times
+        short = torch.min(start.unsqueeze(1) + steps, end.unsqueeze(1)).repeat(1, k)
+        # long clips: k consecutive windows around the middle
+        middle = ((start + end) // 2 - ns * k // 2).unsqueeze(1) + torch.arange(ns * k, device=self.device)
+        # otherwise: k overlapping windows spread over the clip
+        stride = (num_frames - ns) // max(k - 1, 1)
+        spread = (start.unsqueeze(1) + copies * stride.unsqueeze(1)).unsqueeze(2) + steps
+        spread = spread.view(len(index), ns * k)
+
+        ids = torch.where((num_frames <= ns).unsqueeze(1), short, spread)
+        return torch.where((num_frames > ns * k).unsqueeze(1), middle, ids)
+
+    def batch(self, index):
+        """(X, y, video_ids) of the samples `index`, laid out as Sign_Dataset + default collate would."""
+        index = torch.as_tensor(index, device=self.device)
+        ids = self.frame_ids(index)
+        rows = (ids - self.first_frames[index].unsqueeze(1)).clamp(min=0)
+        rows = torch.min(rows, (self.lengths[index] - 1).unsqueeze(1)) + self.offsets[index].unsqueeze(1)
+
+        # (B, L, 55, 2) -> (B, 55, 2L) with x and y of a frame side by side
+        X = self.poses[rows].permute(0, 2, 1, 3).reshape(len(index), self.poses.size(1), -1)
+        return X, self.labels[index], [self.video_ids[i] for i in index.tolist()]
+
+    def loader(self, batch_size, shuffle=True, drop_last=False):
+        return DeviceBatchLoader(self, batch_size, shuffle, drop_last)
+
+
+class DeviceBatchLoader(object):
+    """Iterates over a DevicePoseDataset in batches; stands in for a DataLoader in train_utils.train/validation."""
+
+    def __init__(self, dataset, batch_size, shuffle=True, drop_last=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return int(math.ceil(len(self.dataset) / float(self.batch_size)))
+
+    def __iter__(self):
+        n = len(self.dataset)
+        order = torch.randperm(n, device=self.dataset.device) if self.shuffle else \
+            torch.arange(n, device=self.dataset.device)
+        for i in range(len(self)):
+            yield self.dataset.batch(order[i * self.batch_size: (i + 1) * self.batch_size])
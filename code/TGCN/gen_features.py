@@ -1,95 +1,86 @@
-import json
+"""Pack the OpenPose keypoints of a dataset into a pose store (see pose_store.py).
+
+Videos are handed out one at a time to `--workers` processes, so a few long glosses do not hold up the others,
+and the parsed arrays are appended to the store by the main process only. The store's index doubles as the
+completion manifest: it is flushed every `--flush_every` videos and a restarted run skips every video listed in
+it, without looking at their frame files.
+
+    python gen_features.py --pose_root ../../data/pose_per_individual_videos --out ../../data/pose_store \
+        --split ../../data/splits/asl2000.json --workers 8
+"""
+import argparse
 import os
 import time
-
 from multiprocessing import Pool
-import torch
-
-
-def compute_difference(x):
-    diff = []
-
-    for i, xx in enumerate(x):
-        temp = []
-        for j, xxx in enumerate(x):
-            if i != j:
-                temp.append(xx - xxx)
-
-        diff.append(temp)
-
-    return diff
-
-
-def gen(entry_list):
-    for i, entry in enumerate(entry_list):
-        for instance in entry['instances']:
-            vid = instance['video_id']
-
-            frame_start = instance['frame_start']
-            frame_end = instance['frame_end']
-
-            save_to = os.path.join('/home/dxli/workspace/nslt/code/Pose-GCN/posegcn/features', vid)
-
-            if not os.path.exists(save_to):
-                os.mkdir(save_to)
-
-            for frame_id in range(frame_start, frame_end + 1):
-                frame_id = 'image_{}'.format(str(frame_id).zfill(5))
-
-                ft_path = os.path.join(save_to, frame_id + '_ft.pt')
-                if not os.path.exists(ft_path):
-                    try:
-                        pose_content = json.load(open(os.path.join('/home/dxli/workspace/nslt/data/pose/pose_per_individual_videos',
-                                                                   vid, frame_id + '_keypoints.json')))["people"][0]
-                    except IndexError:
-                        continue
-
-                    body_pose = pose_content["pose_keypoints_2d"]
-                    left_hand_pose = pose_content["hand_left_keypoints_2d"]
-                    right_hand_pose = pose_content["hand_right_keypoints_2d"]
-
-                    body_pose.extend(left_hand_pose)
-                    body_pose.extend(right_hand_pose)
-
-                    x = [v for i, v in enumerate(body_pose) if i % 3 == 0 and i // 3 not in body_pose_exclude]
-                    y = [v for i, v in enumerate(body_pose) if i % 3 == 1 and i // 3 not in body_pose_exclude]
-                    # conf = [v for i, v in enumerate(body_pose) if i % 3 == 2 and i // 3 not in body_pose_exclude]
-
-                    x = 2 * ((torch.FloatTensor(x) / 256.0) - 0.5)
-                    y = 2 * ((torch.FloatTensor(y) / 256.0) - 0.5)
-                    # conf = torch.FloatTensor(conf)
-
-                    x_diff = torch.FloatTensor(compute_difference(x)) / 2
-                    y_diff = torch.FloatTensor(compute_difference(y)) / 2
-
-                    zero_indices = (x_diff == 0).nonzero()
-                    orient = y_diff / x_diff
-                    orient[zero_indices] = 0
-
-                    xy = torch.stack([x, y]).transpose_(0, 1)
-                    ft = torch.cat([xy, x_diff, y_diff, orient], dim=1)
-
-                    torch.save(ft, ft_path)
-
-        print('Finish {}-th entry'.format(i))
-
-
-body_pose_exclude = {9, 10, 11, 22, 23, 24, 12, 13, 14, 19, 20, 21}
-index_file_path = '/home/dxli/workspace/nslt/data/splits-with-dialect-annotated/asl2000.json'
-
-with open(index_file_path, 'r') as f:
-    content = json.load(f)
-
-# create label encoder
-
-start_time = time.time()
-
-entries_1 = content[0: 700]
-entries_2 = content[700: 1400]
-entries_3 = content[1400: ]
-
-entry_splits = [entries_1, entries_2, entries_3]
-
-p = Pool(3)
-print(p.map(gen, entry_splits))
 
+from pose_store import PoseStoreWriter, read_video_poses, video_ids_of_split
+
+
+def _read_video(args):
+    pose_root, video_id = args
+    first_frame, poses = read_video_poses(os.path.join(pose_root, video_id))
+    return video_id, first_frame, poses
+
+
+def generate(pose_root, out, video_ids=None, num_workers=4, dtype='float32', flush_every=100, log_every=50):
+    """Add the videos under `pose_root` (all of them, or `video_ids`) that are not yet in the store at `out`."""
+    if video_ids is None:
+        video_ids = sorted(os.listdir(pose_root))
+
+    writer = PoseStoreWriter(out, dtype=dtype)
+    # a video can be listed under several glosses in a split file
+    todo = sorted(set(vid for vid in video_ids if vid not in writer))
+    missing = set(vid for vid in todo if not os.path.isdir(os.path.join(pose_root, vid)))
+    todo = [vid for vid in todo if vid not in missing]
+    print('{} videos to process, {} already done, {} without a pose directory'.format(
+        len(todo), len(writer.index['videos']) + len(writer.index['empty']), len(missing)))
+
+    tasks = [(pose_root, vid) for vid in todo]
+    pool = Pool(num_workers) if num_workers > 0 else None
+    results = pool.imap_unordered(_read_video, tasks) if pool else map(_read_video, tasks)
+
+    start = time.time()
+    num_frames = 0
+    try:
+        for i, (vid, first_frame, poses) in enumerate(results):
+            if poses is None:
+                print('no keypoint files for {}'.format(vid))
+                writer.mark_empty(vid)
+            else:
+                writer.add(vid, first_frame, poses)
+                num_frames += len(poses)
+
+            done = i + 1
+            if done % flush_every == 0:
+                writer.flush()
+            if done % log_every == 0 or done == len(todo):
+                elapsed = max(time.time() - start, 1e-6)
+                print('{}/{} videos, {:.1f} videos/s, {:.0f} frames/s, eta {:.0f}s'.format(
+                    done, len(todo), done / elapsed, num_frames / elapsed, (len(todo) - done) * elapsed / done))
+    finally:
+        if pool:
+            pool.terminate()
+        # keep whatever was finished, also after an interrupt
+        writer.close()
+
+    print('done in {:.1f}s, store has {} videos'.format(time.time() - start, len(writer.index['videos'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pose_root', type=str, required=True, help='pose_per_individual_videos directory')
+    parser.add_argument('--out', type=str, required=True, help='pose store directory')
+    parser.add_argument('--split', type=str, nargs='*', default=None,
+                        help='only process the videos of these split files (default: every video directory)')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes (0: run in this process)')
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float32', 'float16'])
+    parser.add_argument('--flush_every', type=int, default=100, help='videos between index (manifest) updates')
+    parser.add_argument('--log_every', type=int, default=50)
+    args = parser.parse_args()
+
+    video_ids = None
+    if args.split:
+        video_ids = [vid for split_file in args.split for vid in video_ids_of_split(split_file)]
+
+    generate(args.pose_root, args.out, video_ids, num_workers=args.workers, dtype=args.dtype,
+             flush_every=args.flush_every, log_every=args.log_every)
@@ -0,0 +1,77 @@
+import time
+from contextlib import contextmanager
+
+import torch
+import torch.utils.data as data_utl
+from torch.utils.data.dataloader import default_collate
+
+
+class StageProfiler(object):
+    """Accumulates time spent in named data-pipeline stages, across DataLoader workers.
+
+    Totals live in a shared-memory tensor with one row per process (row 0 for the main process, row i + 1 for
+    worker i), so workers never contend for a lock and the main process can read the aggregate at any time.
+    The profiler has to be created before the DataLoader starts its workers.
+    """
+
+    def __init__(self, stages, num_workers=0):
+        self.stages = list(stages)
+        self.index = {name: i for i, name in enumerate(self.stages)}
+        # (process, stage, [total seconds, count])
+        self.totals = torch.zeros(num_workers + 1, len(self.stages), 2, dtype=torch.float64).share_memory_()
+        self.started = time.time()
+
+    def add(self, name, seconds, count=1):
+        info = data_utl.get_worker_info()
+        row = 0 if info is None else info.id + 1
+        stage = self.totals[row, self.index[name]]
+        stage[0] += seconds
+        stage[1] += count
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def reset(self):
+        self.totals.zero_()
+        self.started = time.time()
+
+    def snapshot(self):
+        """Return {stage: (total seconds, count)} summed over all processes."""
+        totals = self.totals.sum(dim=0).tolist()
+        return {name: (totals[i][0], int(totals[i][1])) for i, name in enumerate(self.stages)}
+
+    def report(self):
+        elapsed = time.time() - self.started
+        lines = ['data pipeline over {:.1f}s wall time:'.format(elapsed),
+                 '{:<18} {:>9} {:>10} {:>10}'.format('stage', 'count', 'total s', 'mean ms')]
+        for name, (total, count) in self.snapshot().items():
+            if count:
+                lines.append('{:<18} {:>9d} {:>10.2f} {:>10.3f}'.format(name, count, total, 1000 * total / count))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def stage(profiler, name):
+    """Time a block as `name` if a profiler is set, otherwise do nothing."""
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name):
+            yield
+
+
+class TimedCollate(object):
+    """DataLoader collate function recorded as the 'collate' stage (a class, so it pickles for spawned workers)."""
+
+    def __init__(self, profiler, collate_fn=default_collate):
+        self.profiler = profiler
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch):
+        with stage(self.profiler, 'collate'):
+            return self.collate_fn(batch)
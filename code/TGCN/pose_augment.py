@@ -0,0 +1,107 @@
+"""Batched augmentation of TGCN pose inputs.
+
+PoseAugment works on a whole training batch X of shape (B, N, 2T) (x and y of a frame side by side, as built by
+Sign_Dataset) on whatever device X lives on, with one tensor op per augmentation and independent random
+parameters per sample:
+    - a random affine map of the keypoint coordinates: rotation, scale, shear and translation,
+    - horizontal mirroring, which also swaps left and right keypoints (shoulders, elbows, wrists, eyes, ears, hands),
+    - temporal jitter: every frame is replaced by one of its neighbours within `temporal_jitter` frames,
+    - keypoint dropout: single keypoints of single frames are set to 0 (the frame centre).
+
+    augment = PoseAugment(rotation=10, scale=0.1, mirror_p=0.5, keypoints=configs.keypoints)
+    X = augment(X)
+"""
+import math
+
+import torch
+
+from sign_dataset import keypoint_indices
+
+# left/right pairs in the 55-node layout: body nodes 0-12 are OpenPose BODY_25 0-8 and 15-18, then both hands
+_BODY_MIRROR_PAIRS = [(2, 5), (3, 6), (4, 7), (9, 10), (11, 12)]
+_LEFT_HAND, _RIGHT_HAND, _HAND_SIZE = 13, 34, 21
+
+
+def mirror_permutation(keypoints='full'):
+    """For every node of the keypoint set, the index (within the set) of its mirror image."""
+    full = list(range(55))
+    for a, b in _BODY_MIRROR_PAIRS:
+        full[a], full[b] = b, a
+    for i in range(_HAND_SIZE):
+        full[_LEFT_HAND + i], full[_RIGHT_HAND + i] = _RIGHT_HAND + i, _LEFT_HAND + i
+
+    nodes = keypoint_indices(keypoints)
+    position = {node: i for i, node in enumerate(nodes)}
+    missing = [full[node] for node in nodes if full[node] not in position]
+    if missing:
+        raise ValueError('keypoint set is not closed under mirroring, missing nodes {}'.format(missing))
+    return [position[full[node]] for node in nodes]
+
+
+def _uniform(n, low, high, device):
+    return torch.rand(n, device=device) * (high - low) + low
+
+
+class PoseAugment(object):
+    """Random augmentation of (B, N, 2T) pose batches; every argument set to 0 disables that augmentation."""
+
+    def __init__(self, rotation=0., scale=0., shear=0., translate=0., mirror_p=0., temporal_jitter=0,
+                 keypoint_dropout=0., keypoints='full'):
+        self.rotation = math.radians(rotation)
+        self.scale = scale
+        self.shear = shear
+        self.translate = translate
+        self.mirror_p = mirror_p
+        self.temporal_jitter = int(temporal_jitter)
+        self.keypoint_dropout = keypoint_dropout
+        self.mirror_perm = mirror_permutation(keypoints) if mirror_p > 0 else None
+
+    @classmethod
+    def from_config(cls, configs):
+        """PoseAugment from the [AUGMENT] section of a Config, or None if it has none."""
+        if not configs.augment:
+            return None
+        return cls(keypoints=configs.keypoints, **configs.augment)
+
+    def __call__(self, X):
+        b, n, length = X.shape
+        poses = X.view(b, n, length // 2, 2)
+
+        if self.temporal_jitter > 0:
+            poses = self._temporal_jitter(poses)
+        if self.mirror_p > 0:
+            poses = self._mirror(poses)
+        if self.rotation or self.scale or self.shear or self.translate:
+            poses = self._affine(poses)
+        if self.keypoint_dropout > 0:
+            keep = torch.rand(poses.shape[:3], device=X.device) >= self.keypoint_dropout
+            poses = poses * keep.unsqueeze(-1).to(poses.dtype)
+
+        return poses.reshape(b, n, length)
+
+    def _affine(self, poses):
+        b, device = poses.size(0), poses.device
+        angle = _uniform(b, -self.rotation, self.rotation, device)
+        scale = _uniform(b, 1 - self.scale, 1 + self.scale, device)
+        shear = _uniform(b, -self.shear, self.shear, device)
+        cos, sin = torch.cos(angle), torch.sin(angle)
+
+        # rotation @ shear(x += shear * y), times scale, as (B, 2, 2)
+        matrix = torch.stack([torch.stack([cos, cos * shear - sin], dim=1),
+                              torch.stack([sin, sin * shear + cos], dim=1)], dim=1) * scale.view(b, 1, 1)
+        shift = _uniform(2 * b, -self.translate, self.translate, device).view(b, 1, 1, 2)
+        return torch.einsum('bntj,bij->bnti', poses, matrix) + shift
+
+    def _mirror(self, poses):
+        flip = torch.rand(poses.size(0), device=poses.device) < self.mirror_p
+        sign = torch.tensor([-1., 1.], device=poses.device, dtype=poses.dtype)
+        mirrored = poses[:, self.mirror_perm] * sign
+        return torch.where(flip.view(-1, 1, 1, 1), mirrored, poses)
+
+    def _temporal_jitter(self, poses):
+        b, n, t, _ = poses.shape
+        j = self.temporal_jitter
+        offsets = torch.randint(-j, j + 1, (b, t), device=poses.device)
+        # sorted, so that the frames stay in order
+        frames = (torch.arange(t, device=poses.device) + offsets).clamp(0, t - 1).sort(dim=1)[0]
+        return poses.gather(2, frames.view(b, 1, t, 1).expand(b, n, t, 2))
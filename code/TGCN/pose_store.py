@@ -0,0 +1,172 @@
+"""Packed per-video pose arrays.
+
+Reading a training sample from the OpenPose output costs one json file per sampled frame. This module packs the
+keypoints of every video once into a single append-only binary file
+
+    <root>/poses.bin     all frames of all videos back to back, (frames, 55, 3) float32 or float16 per video
+    <root>/index.json    dtype, shape and, per video, the offset of its first frame in poses.bin
+
+so that a dataset reads any set of frames of a video with one slice of a memory map. The three channels are the
+normalized (x, y) used by the model (as keypoints_to_xy) and the raw OpenPose confidence. Frames where nobody was
+detected, or whose json file is missing, are stored as NaN. Stores are written by gen_features.py:
+
+    python gen_features.py --pose_root ../../data/pose_per_individual_videos --split ../../data/splits/asl2000.json \
+        --out ../../data/pose_store --workers 8
+"""
+import json
+import os
+
+import numpy as np
+
+from sign_dataset import BODY_POSE_EXCLUDE
+
+NUM_NODES = 55
+NUM_CHANNELS = 3
+# OpenPose body (25) + left hand (21) + right hand (21) keypoints that make up the 55 graph nodes
+KEYPOINT_INDICES = [i for i in range(25 + 21 + 21) if i not in BODY_POSE_EXCLUDE]
+
+INDEX_FILE = 'index.json'
+DATA_FILE = 'poses.bin'
+
+
+def person_to_array(person):
+    """(55, 3) float32 array of normalized x, y and confidence of one OpenPose person entry."""
+    keypoints = list(person['pose_keypoints_2d'])
+    keypoints.extend(person['hand_left_keypoints_2d'])
+    keypoints.extend(person['hand_right_keypoints_2d'])
+    keypoints = np.asarray(keypoints, dtype=np.float32).reshape(-1, 3)[KEYPOINT_INDICES]
+
+    keypoints[:, :2] = 2 * ((keypoints[:, :2] / 256.0) - 0.5)
+    return keypoints
+
+
+def read_video_poses(video_dir):
+    """(first frame id, (frames, 55, 3) float32 array) of a directory of image_XXXXX_keypoints.json files."""
+    frame_files = {}
+    for name in os.listdir(video_dir):
+        if name.startswith('image_') and name.endswith('_keypoints.json'):
+            frame_files[int(name[6:11])] = name
+    if not frame_files:
+        return None, None
+
+    first, last = min(frame_files), max(frame_files)
+    poses = np.full((last - first + 1, NUM_NODES, NUM_CHANNELS), np.nan, dtype=np.float32)
+    for frame_id, name in frame_files.items():
+        with open(os.path.join(video_dir, name), 'r') as f:
+            people = json.load(f)['people']
+        if people:
+            poses[frame_id - first] = person_to_array(people[0])
+    return first, poses
+
+
+class PoseStoreWriter(object):
+    """Appends videos to a pose store; the index is rewritten on flush()/close(), so an interrupted run
+    loses at most the videos added since the last flush."""
+
+    def __init__(self, root, dtype='float32'):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self.data_path = os.path.join(root, DATA_FILE)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+            assert self.index['dtype'] == np.dtype(dtype).name, \
+                'store {} holds {}, not {}'.format(root, self.index['dtype'], dtype)
+            self.index.setdefault('empty', [])
+        else:
+            self.index = {'dtype': np.dtype(dtype).name, 'num_nodes': NUM_NODES, 'num_channels': NUM_CHANNELS,
+                          'num_frames': 0, 'videos': {}, 'empty': []}
+
+        self.dtype = np.dtype(self.index['dtype'])
+        self.data = open(self.data_path, 'ab')
+        # drop frames appended after the last index update, e.g. by a run that was killed
+        self.data.truncate(self.index['num_frames'] * self._frame_bytes())
+
+    def _frame_bytes(self):
+        return NUM_NODES * NUM_CHANNELS * self.dtype.itemsize
+
+    def __contains__(self, video_id):
+        """Whether the video was already processed, i.e. added or found to have no keypoint files."""
+        return video_id in self.index['videos'] or video_id in self.index['empty']
+
+    def mark_empty(self, video_id):
+        self.index['empty'].append(video_id)
+
+    def add(self, video_id, first_frame, poses):
+        assert video_id not in self.index['videos'], 'video {} is already in the store'.format(video_id)
+        poses = np.ascontiguousarray(poses, dtype=self.dtype)
+        assert poses.shape[1:] == (NUM_NODES, NUM_CHANNELS), poses.shape
+
+        self.data.write(poses.tobytes())
+        self.index['videos'][video_id] = {'offset': self.index['num_frames'], 'num_frames': len(poses),
+                                          'first_frame': first_frame}
+        self.index['num_frames'] += len(poses)
+
+    def flush(self):
+        self.data.flush()
+        os.fsync(self.data.fileno())
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self.flush()
+        self.data.close()
+
+
+class PoseStore(object):
+    """Read-only view of a pose store. The memory map is opened lazily, so a store can be handed to
+    DataLoader workers."""
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, INDEX_FILE), 'r') as f:
+            self.index = json.load(f)
+        self.videos = self.index['videos']
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.memmap(os.path.join(self.root, DATA_FILE), dtype=self.index['dtype'], mode='r',
+                                   shape=(self.index['num_frames'], self.index['num_nodes'],
+                                          self.index['num_channels']))
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __contains__(self, video_id):
+        return video_id in self.videos
+
+    def __len__(self):
+        return len(self.videos)
+
+    def video(self, video_id):
+        """All frames of a video as a (frames, 55, 3) memory mapped array."""
+        entry = self.videos[video_id]
+        return self.data[entry['offset']: entry['offset'] + entry['num_frames']]
+
+    def read(self, video_id, frame_ids):
+        """(len(frame_ids), 55, 3) float32 array of the given frame ids; NaN for frames outside the video."""
+        entry = self.videos[video_id]
+        rows = np.asarray(frame_ids, dtype=np.int64) - entry['first_frame']
+        inside = (rows >= 0) & (rows < entry['num_frames'])
+
+        out = np.full((len(rows), self.index['num_nodes'], self.index['num_channels']), np.nan, dtype=np.float32)
+        if inside.any():
+            # one contiguous read covering all requested frames
+            lo, hi = rows[inside].min(), rows[inside].max() + 1
+            block = self.data[entry['offset'] + lo: entry['offset'] + hi]
+            out[inside] = block[rows[inside] - lo]
+        return out
+
+
+def video_ids_of_split(split_file):
+    with open(split_file, 'r') as f:
+        return [instance['video_id'] for entry in json.load(f) for instance in entry['instances']]
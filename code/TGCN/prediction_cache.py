@@ -0,0 +1,110 @@
+"""Prediction cache keyed by (input content hash, checkpoint hash, preprocessing config).
+
+Logits are stored as float16 .npy files under `root` (sharded by the first two hex digits of the key) with an
+in-memory LRU in front. Since the key covers the input bytes, the exact weights and every preprocessing
+setting that changes the output, a hit can skip both decoding and the forward pass, and stale entries can
+never be returned; they are just never looked up again.
+
+    cache = PredictionCache('prediction_cache')
+    key = cache.key(file_sha256(video_path), file_sha256(weights), {'crop_size': 224, 'num_frames': 64})
+    logits = cache.get(key)
+    if logits is None:
+        logits = ...
+        cache.put(key, logits)
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+_file_hashes = {}
+
+
+def bytes_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """sha256 of a file's content, remembered per (path, size, mtime) for the life of the process."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        _file_hashes[memo_key] = h.hexdigest()
+    return _file_hashes[memo_key]
+
+
+class PredictionCache(object):
+
+    def __init__(self, root, max_memory_items=1024):
+        self.root = root
+        self.max_memory_items = max_memory_items
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(content_hash, model_hash, config):
+        config = json.dumps(config, sort_keys=True)
+        return bytes_sha256('{}|{}|{}'.format(content_hash, model_hash, config).encode('utf-8'))
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + '.npy')
+
+    def get(self, key):
+        """The cached logits as a float32 array, or None."""
+        with self._lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key].astype(np.float32)
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        logits = np.load(path)
+        with self._lock:
+            self.hits += 1
+            self._remember(key, logits)
+        return logits.astype(np.float32)
+
+    def put(self, key, logits):
+        if isinstance(logits, torch.Tensor):
+            logits = logits.detach().cpu().numpy()
+        logits = np.asarray(logits, dtype=np.float16)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write under a unique name and rename, so concurrent readers never see a partial file
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, logits)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._remember(key, logits)
+
+    def _remember(self, key, logits):
+        self.memory[key] = logits
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / float(total) if total else 0.,
+                    'memory_items': len(self.memory)}
+
@@ -0,0 +1,190 @@
+"""Local HTTP inference service for Pose-TGCN.
+
+The checkpoint is loaded once. A request carries the OpenPose keypoints of one video as json, either
+    {"frames": [<OpenPose frame json>, ...]}          frames as written by OpenPose, with a "people" list
+    {"frames": [{"pose_keypoints_2d": [...], "hand_left_keypoints_2d": [...], "hand_right_keypoints_2d": [...]}]}
+    {"path": "/data/pose_per_individual_videos/00335"}  a directory of OpenPose json files on the server
+Frames are sampled as in test_tgcn.py (num_copies fixed-length copies), and a MicroBatcher collects concurrent
+requests into one forward pass.
+
+    python serve_tgcn.py -weights archived/asl100/ckpt.pth -config configs/asl100.ini -num_classes 100
+    curl -d @poses_00335.json -H 'Content-Type: application/json' 'http://127.0.0.1:8001/predict?top_k=5'
+    curl http://127.0.0.1:8001/stats
+
+With --cache_dir, logits are cached by (pose content hash, checkpoint hash, sampling settings), so repeated
+requests for the same poses skip feature extraction and the forward pass.
+"""
+import argparse
+import json
+import os
+
+import torch
+import torch.nn.functional as F
+
+from configs import Config
+from inference_server import MicroBatcher, serve, top_k_glosses
+from prediction_cache import PredictionCache, bytes_sha256, file_sha256
+from sign_dataset import KEYPOINT_SETS, k_copies_fixed_length_sequential_sampling, keypoint_indices, keypoints_to_xy
+from tgcn_fused import fuse
+from tgcn_model import GCN_muti_att
+from train_utils import multi_view_forward
+
+
+def load_class_names(class_list_file, num_classes, split_file=None):
+    """Class index -> gloss, in the order of Sign_Dataset's LabelEncoder (sorted glosses of the subset).
+
+    The glosses of the subset are read from `split_file` if given, otherwise they are the first `num_classes`
+    entries of the WLASL class list, which is how the asl100/300/1000/2000 subsets are built.
+    """
+    if split_file is not None:
+        with open(split_file, 'r') as f:
+            glosses = [entry['gloss'] for entry in json.load(f)]
+    else:
+        glosses = []
+        with open(class_list_file, 'r') as f:
+            for line in f:
+                idx, gloss = line.rstrip('\n').split('\t')
+                if int(idx) < num_classes:
+                    glosses.append(gloss)
+    return {i: gloss for i, gloss in enumerate(sorted(glosses))}
+
+
+def read_pose_dir(pose_dir):
+    """OpenPose frame dicts of a directory of *_keypoints.json files, in frame order, and a hash of their content."""
+    frames = []
+    file_hashes = []
+    for name in sorted(os.listdir(pose_dir)):
+        if name.endswith('_keypoints.json'):
+            path = os.path.join(pose_dir, name)
+            with open(path, 'r') as f:
+                frames.append(json.load(f))
+            file_hashes.append(file_sha256(path))
+    return frames, bytes_sha256(''.join(file_hashes).encode('utf-8'))
+
+
+def frames_to_xy(frames):
+    """(55, 2) keypoint tensors of the frames, repeating the previous frame where nobody was detected."""
+    poses = []
+    for frame in frames:
+        person = frame
+        if 'people' in frame:
+            person = frame['people'][0] if frame['people'] else None
+        if person is None:
+            if poses:
+                poses.append(poses[-1])
+            continue
+        x, y = keypoints_to_xy(person)
+        poses.append(torch.stack([x, y], dim=1))
+    if not poses:
+        raise ValueError('no person detected in any frame')
+    return poses
+
+
+class TGCNService(object):
+
+    def __init__(self, model, class_names, num_samples=50, num_copies=4, max_batch_size=32, max_latency_ms=10.,
+                 device='cpu', cache=None, model_hash=None, keypoints='full'):
+        self.model = model
+        self.class_names = class_names
+        self.num_samples = num_samples
+        self.num_copies = num_copies
+        self.keypoints = keypoint_indices(keypoints)
+        self.device = device
+        self.cache = cache
+        self.model_hash = model_hash
+        # everything between the poses and the logits, for the cache key
+        self.preprocess_config = {'num_samples': num_samples, 'num_copies': num_copies, 'sampling': 'k_copies'}
+        if self.keypoints != KEYPOINT_SETS['full']:
+            self.preprocess_config['keypoints'] = self.keypoints
+        self.batcher = MicroBatcher(self.forward, max_batch_size=max_batch_size, max_latency_ms=max_latency_ms)
+
+    @staticmethod
+    def read_frames(body):
+        """The OpenPose frames of a request and a hash of their content."""
+        request = json.loads(body.decode('utf-8'))
+        if 'path' in request:
+            if not os.path.isdir(request['path']):
+                raise ValueError('no such directory: {}'.format(request['path']))
+            return read_pose_dir(request['path'])
+        return request['frames'], bytes_sha256(body)
+
+    def decode(self, frames):
+        poses = frames_to_xy(frames)
+
+        frames_to_sample = k_copies_fixed_length_sequential_sampling(0, len(poses) - 1, self.num_samples,
+                                                                     self.num_copies)
+        # 55 x (2 * num_samples * num_copies), laid out as in Sign_Dataset
+        x = torch.cat([poses[i] for i in frames_to_sample], dim=1)
+        return x[self.keypoints] if self.keypoints != KEYPOINT_SETS['full'] else x
+
+    def forward(self, xs):
+        X = torch.stack(xs).to(self.device)
+        with torch.no_grad():
+            output = multi_view_forward(self.model, X, self.num_copies)
+        return list(output.cpu())
+
+    def predict(self, body, content_type, top_k=5):
+        frames, content_hash = self.read_frames(body)
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(content_hash, self.model_hash, self.preprocess_config)
+            logits = self.cache.get(key)
+            if logits is not None:
+                return top_k_glosses(F.softmax(torch.from_numpy(logits), dim=0).numpy(), self.class_names, top_k)
+
+        logits = self.batcher(self.decode(frames))
+        if key is not None:
+            self.cache.put(key, logits)
+        return top_k_glosses(F.softmax(logits, dim=0).numpy(), self.class_names, top_k)
+
+    def stats(self):
+        stats = self.batcher.stats()
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+
+def load_model(weights, configs, num_classes, device='cpu'):
+    state_dict = torch.load(weights, map_location='cpu')
+    # train_tgcn.py and test_tgcn.py disagree on the hidden size, so take it from the checkpoint
+    model = GCN_muti_att(input_feature=configs.num_samples * 2, hidden_feature=state_dict['gc1.weight'].size(1),
+                         num_class=num_classes, p_dropout=configs.drop_p, num_stage=configs.num_stages,
+                         num_nodes=state_dict['gc1.att'].size(0), att_topk=configs.att_topk)
+    model.load_state_dict(state_dict)
+    model.to(device)
+    model.eval()
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-weights', type=str, required=True)
+    parser.add_argument('-config', type=str, required=True)
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('--split', type=str, default=None, help='split file the model was trained on')
+    parser.add_argument('--class_list', type=str, default='../I3D/preprocess/wlasl_class_list.txt')
+    parser.add_argument('--num_copies', type=int, default=None, help='default: NUM_COPIES of the config')
+    parser.add_argument('--max_batch', type=int, default=32)
+    parser.add_argument('--max_latency_ms', type=float, default=10.)
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    parser.add_argument('--cache_dir', type=str, default=None, help='prediction cache directory (default: off)')
+    parser.add_argument('--fused', action='store_true', help='serve the BatchNorm-folded TorchScript model')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    configs = Config(args.config)
+    cache = PredictionCache(args.cache_dir) if args.cache_dir else None
+
+    model = load_model(args.weights, configs, args.num_classes, device)
+    if args.fused:
+        model = fuse(model)
+
+    service = TGCNService(model,
+                          load_class_names(args.class_list, args.num_classes, args.split),
+                          num_samples=configs.num_samples, num_copies=args.num_copies or configs.num_copies,
+                          max_batch_size=args.max_batch, max_latency_ms=args.max_latency_ms, device=device,
+                          cache=cache, model_hash=file_sha256(args.weights), keypoints=configs.keypoints)
+    serve(service, args.host, args.port, verbose=args.verbose)
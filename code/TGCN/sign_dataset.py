@@ -10,99 +10,69 @@ import torch
 import torch.nn as nn
 
 import utils
+from pipeline_profiler import stage
 
 from torch.utils.data import Dataset
 from sklearn.preprocessing import OneHotEncoder, LabelEncoder
 
 
-def compute_difference(x):
-    diff = []
+BODY_POSE_EXCLUDE = {9, 10, 11, 22, 23, 24, 12, 13, 14, 19, 20, 21}
 
-    for i, xx in enumerate(x):
-        temp = []
-        for j, xxx in enumerate(x):
-            if i != j:
-                temp.append(xx - xxx)
+# node subsets of the 55-node layout: 13 body keypoints (OpenPose BODY_25 0-8 and 15-18), then 21 left hand and
+# 21 right hand keypoints
+_LEFT_HAND, _RIGHT_HAND = 13, 34
+# wrist, and base and tip of every finger
+_HAND_REDUCED = [0, 1, 4, 5, 8, 9, 12, 13, 16, 17, 20]
+KEYPOINT_SETS = {
+    'full': list(range(55)),
+    'hands': list(range(_LEFT_HAND, 55)),
+    # nose, neck, shoulders, elbows, wrists and the reduced hands
+    'reduced': list(range(8)) + [_LEFT_HAND + i for i in _HAND_REDUCED] + [_RIGHT_HAND + i for i in _HAND_REDUCED],
+}
 
-        diff.append(temp)
 
-    return diff
+def keypoint_indices(keypoints):
+    """Node indices of a KEYPOINT_SETS name or an explicit list of indices into the 55-node layout."""
+    if isinstance(keypoints, str):
+        if keypoints not in KEYPOINT_SETS:
+            raise ValueError('unknown keypoint set {}, expected one of {}'.format(keypoints, sorted(KEYPOINT_SETS)))
+        return KEYPOINT_SETS[keypoints]
+    return list(keypoints)
 
 
-def read_pose_file(filepath):
-    body_pose_exclude = {9, 10, 11, 22, 23, 24, 12, 13, 14, 19, 20, 21}
-
-    try:
-        content = json.load(open(filepath))["people"][0]
-    except IndexError:
-        return None
-
-    path_parts = os.path.split(filepath)
-
-    frame_id = path_parts[1][:11]
-    vid = os.path.split(path_parts[0])[-1]
-
-    save_to = os.path.join('/home/dxli/workspace/nslt/code/Pose-GCN/posegcn/features', vid)
-
-    try:
-        ft = torch.load(os.path.join(save_to, frame_id + '_ft.pt'))
-
-        xy = ft[:, :2]
-        # angles = torch.atan(ft[:, 110:]) / 90
-        # ft = torch.cat([xy, angles], dim=1)
-        return xy
-
-    except FileNotFoundError:
-        print(filepath)
-        body_pose = content["pose_keypoints_2d"]
-        left_hand_pose = content["hand_left_keypoints_2d"]
-        right_hand_pose = content["hand_right_keypoints_2d"]
-
-        body_pose.extend(left_hand_pose)
-        body_pose.extend(right_hand_pose)
-
-        x = [v for i, v in enumerate(body_pose) if i % 3 == 0 and i // 3 not in body_pose_exclude]
-        y = [v for i, v in enumerate(body_pose) if i % 3 == 1 and i // 3 not in body_pose_exclude]
-        # conf = [v for i, v in enumerate(body_pose) if i % 3 == 2 and i // 3 not in body_pose_exclude]
-
-        x = 2 * ((torch.FloatTensor(x) / 256.0) - 0.5)
-        y = 2 * ((torch.FloatTensor(y) / 256.0) - 0.5)
-        # conf = torch.FloatTensor(conf)
+def keypoints_to_xy(person):
+    """Normalized (x, y) of the 55 body and hand keypoints of one OpenPose person entry, as two tensors."""
+    body_pose = list(person["pose_keypoints_2d"])
+    body_pose.extend(person["hand_left_keypoints_2d"])
+    body_pose.extend(person["hand_right_keypoints_2d"])
 
-        x_diff = torch.FloatTensor(compute_difference(x)) / 2
-        y_diff = torch.FloatTensor(compute_difference(y)) / 2
+    x = [v for i, v in enumerate(body_pose) if i % 3 == 0 and i // 3 not in BODY_POSE_EXCLUDE]
+    y = [v for i, v in enumerate(body_pose) if i % 3 == 1 and i // 3 not in BODY_POSE_EXCLUDE]
 
-        zero_indices = (x_diff == 0).nonzero()
+    x = 2 * ((torch.FloatTensor(x) / 256.0) - 0.5)
+    y = 2 * ((torch.FloatTensor(y) / 256.0) - 0.5)
+    return x, y
 
-        orient = y_diff / x_diff
-        orient[zero_indices] = 0
 
-        xy = torch.stack([x, y]).transpose_(0, 1)
-
-        ft = torch.cat([xy, x_diff, y_diff, orient], dim=1)
-
-        path_parts = os.path.split(filepath)
-
-        frame_id = path_parts[1][:11]
-        vid = os.path.split(path_parts[0])[-1]
-
-        save_to = os.path.join('code/Pose-GCN/posegcn/features', vid)
-        if not os.path.exists(save_to):
-            os.mkdir(save_to)
-        torch.save(ft, os.path.join(save_to, frame_id + '_ft.pt'))
-
-        xy = ft[:, :2]
-        # angles = torch.atan(ft[:, 110:]) / 90
-        # ft = torch.cat([xy, angles], dim=1)
-        #
-        return xy
+def read_pose_file(filepath):
+    """(55, 2) normalized keypoints of the first person in an OpenPose json file, or None if nobody was detected."""
+    with open(filepath, 'r') as f:
+        people = json.load(f)["people"]
+    if not people:
+        return None
 
-    # return ft
+    x, y = keypoints_to_xy(people[0])
+    return torch.stack([x, y], dim=1)
 
 
 class Sign_Dataset(Dataset):
+    # stages recorded when a pipeline_profiler.StageProfiler is set as `profiler`
+    PROFILE_STAGES = ('sample_indices', 'read_pose_file', 'img_transforms', 'concat', 'video_transforms')
+
     def __init__(self, index_file_path, split, pose_root, sample_strategy='rnd_start', num_samples=25, num_copies=4,
-                 img_transforms=None, video_transforms=None, test_index_file=None):
+                 img_transforms=None, video_transforms=None, test_index_file=None, pose_store=None, keypoints='full'):
+        """`pose_store` is an optional pose_store.PoseStore; poses are then read from it instead of the per-frame
+        OpenPose json files under `pose_root`. `keypoints` selects the graph nodes (see KEYPOINT_SETS)."""
         assert os.path.exists(index_file_path), "Non-existent indexing file path: {}.".format(index_file_path)
         assert os.path.exists(pose_root), "Path to poses does not exist: {}.".format(pose_root)
 
@@ -125,6 +95,9 @@ class Sign_Dataset(Dataset):
         self.video_transforms = video_transforms
 
         self.num_copies = num_copies
+        self.pose_store = pose_store
+        self.keypoints = keypoint_indices(keypoints)
+        self.profiler = None
 
     def __len__(self):
         return len(self.data)
@@ -133,9 +106,12 @@ class Sign_Dataset(Dataset):
         video_id, gloss_cat, frame_start, frame_end = self.data[index]
         # frames of dimensions (T, H, W, C)
         x = self._load_poses(video_id, frame_start, frame_end, self.sample_strategy, self.num_samples)
+        if self.keypoints != KEYPOINT_SETS['full']:
+            x = x[self.keypoints]
 
         if self.video_transforms:
-            x = self.video_transforms(x)
+            with stage(self.profiler, 'video_transforms'):
+                x = self.video_transforms(x)
 
         y = gloss_cat
 
@@ -177,24 +153,30 @@ class Sign_Dataset(Dataset):
          """
         poses = []
 
-        if sample_strategy == 'rnd_start':
-            frames_to_sample = rand_start_sampling(frame_start, frame_end, num_samples)
-        elif sample_strategy == 'seq':
-            frames_to_sample = sequential_sampling(frame_start, frame_end, num_samples)
-        elif sample_strategy == 'k_copies':
-            frames_to_sample = k_copies_fixed_length_sequential_sampling(frame_start, frame_end, num_samples,
-                                                                         self.num_copies)
-        else:
-            raise NotImplementedError('Unimplemented sample strategy found: {}.'.format(sample_strategy))
+        with stage(self.profiler, 'sample_indices'):
+            if sample_strategy == 'rnd_start':
+                frames_to_sample = rand_start_sampling(frame_start, frame_end, num_samples)
+            elif sample_strategy == 'seq':
+                frames_to_sample = sequential_sampling(frame_start, frame_end, num_samples)
+            elif sample_strategy == 'k_copies':
+                frames_to_sample = k_copies_fixed_length_sequential_sampling(frame_start, frame_end, num_samples,
+                                                                             self.num_copies)
+            else:
+                raise NotImplementedError('Unimplemented sample strategy found: {}.'.format(sample_strategy))
+
+        if self.pose_store is not None:
+            return self._load_poses_from_store(video_id, frames_to_sample, num_samples)
 
         for i in frames_to_sample:
             pose_path = os.path.join(self.pose_root, video_id, self.framename.format(str(i).zfill(5)))
             # pose = cv2.imread(frame_path, cv2.COLOR_BGR2RGB)
-            pose = read_pose_file(pose_path)
+            with stage(self.profiler, 'read_pose_file'):
+                pose = read_pose_file(pose_path)
 
             if pose is not None:
                 if self.img_transforms:
-                    pose = self.img_transforms(pose)
+                    with stage(self.profiler, 'img_transforms'):
+                        pose = self.img_transforms(pose)
 
                 poses.append(pose)
             else:
@@ -203,20 +185,47 @@ class Sign_Dataset(Dataset):
                 except IndexError:
                     print(pose_path)
 
-        pad = None
+        with stage(self.profiler, 'concat'):
+            pad = None
 
-        # if len(frames_to_sample) < num_samples:
-        if len(poses) < num_samples:
-            num_padding = num_samples - len(frames_to_sample)
-            last_pose = poses[-1]
-            pad = last_pose.repeat(1, num_padding)
+            # if len(frames_to_sample) < num_samples:
+            if len(poses) < num_samples:
+                num_padding = num_samples - len(frames_to_sample)
+                last_pose = poses[-1]
+                pad = last_pose.repeat(1, num_padding)
 
-        poses_across_time = torch.cat(poses, dim=1)
-        if pad is not None:
-            poses_across_time = torch.cat([poses_across_time, pad], dim=1)
+            poses_across_time = torch.cat(poses, dim=1)
+            if pad is not None:
+                poses_across_time = torch.cat([poses_across_time, pad], dim=1)
 
         return poses_across_time
 
+    def _load_poses_from_store(self, video_id, frames_to_sample, num_samples):
+        """Same output as the json path of _load_poses: frames without a detection repeat the previous pose,
+        leading ones are dropped, and short clips are padded with the last pose."""
+        with stage(self.profiler, 'read_pose_file'):
+            poses = self.pose_store.read(video_id, frames_to_sample)[:, :, :2]
+
+        with stage(self.profiler, 'concat'):
+            detected = ~np.isnan(poses[:, 0, 0])
+            if not detected.any():
+                raise ValueError('no pose detected in the sampled frames of {}'.format(video_id))
+            # index of the latest detected frame at or before each sampled frame
+            latest = np.maximum.accumulate(np.where(detected, np.arange(len(poses)), -1))
+            poses = torch.from_numpy(poses[latest[latest >= 0]])
+
+        if self.img_transforms:
+            with stage(self.profiler, 'img_transforms'):
+                poses = torch.stack([self.img_transforms(pose) for pose in poses])
+
+        with stage(self.profiler, 'concat'):
+            if len(poses) < num_samples:
+                num_padding = max(num_samples - len(frames_to_sample), 0)
+                poses = torch.cat([poses, poses[-1:].expand(num_padding, -1, -1)])
+
+            # (T, 55, 2) -> (55, 2T) with x and y of a frame side by side, as torch.cat(poses, dim=1)
+            return poses.permute(1, 0, 2).reshape(poses.size(1), -1)
+
 
 def rand_start_sampling(frame_start, frame_end, num_samples):
     """Randomly select a starting point and return the continuous ${num_samples} frames."""
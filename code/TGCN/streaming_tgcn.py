@@ -0,0 +1,319 @@
+"""Real-time sign recognition with Pose-TGCN over an incoming pose stream.
+
+Per-frame keypoints are converted to the normalized (x, y) graph nodes once and kept in a ring buffer. Every
+`hop` frames the latest NUM_SAMPLES frames are classified by GCN_muti_att, the class probabilities are smoothed
+over consecutive windows, and the top-k glosses of every window are emitted as one json line.
+
+A source is one of
+    -                   OpenPose frame json (or a single person entry) per line on stdin
+    poses.jsonl         the same, from a file
+    <directory>         a directory of OpenPose *_keypoints.json files, as in pose_per_individual_videos
+    poses.npy           a (frames, 55, 2 or 3) array of normalized keypoints; NaN frames have no detection
+
+    python streaming_tgcn.py -weights archived/asl100/ckpt.pth -config configs/asl100.ini -num_classes 100 \
+        -source ../../data/pose_per_individual_videos/00335 --hop 5 --fps 25
+    openpose_to_jsonl ... | python streaming_tgcn.py ... -source - --live
+"""
+import argparse
+import collections
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from configs import Config
+from inference_server import top_k_glosses
+from serve_tgcn import load_class_names, load_model, read_pose_dir
+from sign_dataset import keypoint_indices, keypoints_to_xy
+from tgcn_fused import fuse
+
+
+def person_of(frame):
+    """The first person of an OpenPose frame dict (or the dict itself if it is a person entry), or None."""
+    if 'people' in frame:
+        return frame['people'][0] if frame['people'] else None
+    return frame
+
+
+def read_json_lines(stream):
+    """Yield one OpenPose frame dict per non-empty line."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_json_lines_file(path):
+    with open(path, 'r') as f:
+        for frame in read_json_lines(f):
+            yield frame
+
+
+def read_pose_array(path):
+    """Yield the (55, 2) frames of a .npy pose array, None where nobody was detected."""
+    poses = np.load(path, mmap_mode='r')
+    for pose in poses:
+        pose = np.asarray(pose[:, :2], dtype=np.float32)
+        yield None if np.isnan(pose).any() else pose
+
+
+def open_source(source):
+    if source == '-':
+        return read_json_lines(sys.stdin)
+    if os.path.isdir(source):
+        frames, _ = read_pose_dir(source)
+        return iter(frames)
+    if source.endswith('.npy'):
+        return read_pose_array(source)
+    return read_json_lines_file(source)
+
+
+def paced(frames, fps):
+    """Yield `frames` no faster than `fps` per second, to replay a recorded source in real time."""
+    start = time.time()
+    for i, frame in enumerate(frames):
+        delay = start + i / float(fps) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        yield frame
+
+
+class PoseRingBuffer(object):
+    """Fixed-capacity buffer of (num_nodes, 2) poses addressed by absolute frame number."""
+
+    def __init__(self, capacity, num_nodes):
+        self.capacity = capacity
+        self.poses = np.zeros((capacity, num_nodes, 2), dtype=np.float32)
+        self.num_pushed = 0
+
+    def push(self, pose):
+        self.poses[self.num_pushed % self.capacity] = pose
+        self.num_pushed += 1
+
+    @property
+    def oldest(self):
+        return max(0, self.num_pushed - self.capacity)
+
+    def window(self, end, size):
+        """Poses [end - size, end) as a (size, num_nodes, 2) array."""
+        start = end - size
+        if start < self.oldest or end > self.num_pushed:
+            raise IndexError('Frames [{}, {}) are not in the buffer (holding [{}, {})).'.format(
+                start, end, self.oldest, self.num_pushed))
+        rows = np.arange(start, end) % self.capacity
+        return self.poses[rows]
+
+
+class StreamingPoseRecognizer(object):
+    """Sliding-window GCN_muti_att recognizer over a stream of per-frame keypoints.
+
+    A window of `window_size` frames (the NUM_SAMPLES the model was trained with) is classified every `hop`
+    frames. When the consumer falls behind, all due windows (up to `max_batch`) are classified in one forward
+    pass; windows already overwritten in the ring buffer are dropped rather than delaying the stream further.
+    Window probabilities are smoothed with an exponential moving average, `smoothing` being the weight of the
+    previous windows (0: no smoothing).
+
+    Frames without a detection repeat the previous pose, as in serve_tgcn.py. Frames before the first detection
+    are not buffered, but reported frame numbers always count every input frame.
+    """
+
+    def __init__(self, model, class_names=None, window_size=50, hop=5, top_k=5, smoothing=0.5, max_batch=8,
+                 keypoints='full', device='cpu'):
+        assert 0 < hop <= window_size, 'hop must be in (0, window_size].'
+        assert 0 <= smoothing < 1, 'smoothing must be in [0, 1).'
+
+        self.model = model
+        self.class_names = class_names
+        self.window_size = window_size
+        self.hop = hop
+        self.top_k = top_k
+        self.smoothing = smoothing
+        self.max_batch = max_batch
+        self.keypoints = keypoint_indices(keypoints)
+        self.device = device
+
+        self.ring = PoseRingBuffer(window_size + hop * max_batch, len(self.keypoints))
+        self.num_frames = 0
+        self.first_detection = None
+        self.last_pose = None
+        self.smoothed = None
+        # (end in ring frames, time the last frame of the window was pushed)
+        self.due_windows = []
+        self.num_dropped = 0
+
+        self.batch_latencies = collections.deque(maxlen=1000)
+        self.window_lags = collections.deque(maxlen=1000)
+
+    def push(self, frame):
+        """Add the keypoints of one frame: an OpenPose frame or person dict, a (55, 2) array, or None."""
+        self.num_frames += 1
+        pose = frame
+        if isinstance(frame, dict):
+            person = person_of(frame)
+            pose = None
+            if person is not None:
+                x, y = keypoints_to_xy(person)
+                pose = torch.stack([x, y], dim=1).numpy()
+
+        if pose is None:
+            if self.last_pose is None:
+                return
+            pose = self.last_pose
+        else:
+            pose = np.asarray(pose, dtype=np.float32)[self.keypoints]
+            if self.first_detection is None:
+                self.first_detection = self.num_frames - 1
+        self.last_pose = pose
+        self.ring.push(pose)
+
+        end = self.ring.num_pushed
+        if end >= self.window_size and (end - self.window_size) % self.hop == 0:
+            self.due_windows.append((end, time.time()))
+
+    def process(self):
+        """Classify all due windows and return their predictions, oldest first."""
+        stale = [w for w in self.due_windows if w[0] - self.window_size < self.ring.oldest]
+        self.num_dropped += len(stale)
+        self.due_windows = [w for w in self.due_windows if w[0] - self.window_size >= self.ring.oldest]
+
+        predictions = []
+        while self.due_windows:
+            batch = self.due_windows[:self.max_batch]
+            self.due_windows = self.due_windows[self.max_batch:]
+            predictions.extend(self._classify(batch))
+        return predictions
+
+    def _classify(self, windows):
+        start_time = time.time()
+
+        poses = np.stack([self.ring.window(end, self.window_size) for end, _ in windows])
+        # B x T x N x 2 -> B x N x 2T, with x and y of a frame side by side as in Sign_Dataset
+        X = torch.from_numpy(poses).permute(0, 2, 1, 3).reshape(len(windows), poses.shape[2], -1)
+
+        with torch.no_grad():
+            probs = F.softmax(self.model(X.to(self.device)), dim=1).cpu().numpy()
+
+        done = time.time()
+        self.batch_latencies.append((done - start_time, len(windows)))
+
+        predictions = []
+        for (end, pushed), p in zip(windows, probs):
+            if self.smoothed is None or self.smoothing == 0:
+                self.smoothed = p
+            else:
+                self.smoothed = self.smoothing * self.smoothed + (1 - self.smoothing) * p
+            self.window_lags.append(done - pushed)
+
+            first = self.first_detection + end - self.window_size
+            predictions.append({'start': first, 'end': first + self.window_size,
+                                'top_k': top_k_glosses(self.smoothed, self.class_names, self.top_k)})
+        return predictions
+
+    def latency_stats(self):
+        """Forward pass time per batch, and lag between a window's last frame arriving and its prediction."""
+        if not self.batch_latencies:
+            return {}
+        lat = np.asarray([l for l, n in self.batch_latencies]) * 1000
+        lag = np.asarray(self.window_lags) * 1000
+        return {'frames': self.num_frames, 'batches': len(lat),
+                'windows': sum(n for l, n in self.batch_latencies), 'dropped_windows': self.num_dropped,
+                'batch_mean_ms': float(lat.mean()), 'batch_p95_ms': float(np.percentile(lat, 95)),
+                'lag_p50_ms': float(np.percentile(lag, 50)), 'lag_p95_ms': float(np.percentile(lag, 95)),
+                'lag_max_ms': float(lag.max())}
+
+
+def run_stream(recognizer, frames, live=False, queue_size=256):
+    """Feed frames to the recognizer and yield predictions as they appear.
+
+    With `live=True`, frames are read on a background thread so parsing keeps up with the source while the
+    model runs; windows completed by frames that arrived in the meantime are then classified as one batch.
+    """
+    if not live:
+        for frame in frames:
+            recognizer.push(frame)
+            for prediction in recognizer.process():
+                yield prediction
+        return
+
+    frame_queue = queue.Queue(maxsize=queue_size)
+
+    def reader():
+        # always end with the sentinel, after the source's exception if it raised one
+        try:
+            for frame in frames:
+                frame_queue.put(frame)
+        except Exception as e:
+            frame_queue.put(e)
+        finally:
+            frame_queue.put(StopIteration)
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    done = False
+    while not done:
+        # block for one frame, then take what arrived while the model was busy, up to one full batch of hops
+        frame = frame_queue.get()
+        num_taken = 0
+        while frame is not StopIteration:
+            if isinstance(frame, Exception):
+                raise frame
+            recognizer.push(frame)
+            num_taken += 1
+            if num_taken >= recognizer.hop * recognizer.max_batch:
+                break
+            try:
+                frame = frame_queue.get_nowait()
+            except queue.Empty:
+                break
+        done = frame is StopIteration
+
+        for prediction in recognizer.process():
+            yield prediction
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-weights', type=str, required=True)
+    parser.add_argument('-config', type=str, required=True)
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('-source', type=str, required=True,
+                        help='json lines file, OpenPose json directory, .npy pose array, or - for json lines on stdin')
+    parser.add_argument('--split', type=str, default=None, help='split file the model was trained on')
+    parser.add_argument('--class_list', type=str, default='../I3D/preprocess/wlasl_class_list.txt')
+    parser.add_argument('--hop', type=int, default=5)
+    parser.add_argument('--top_k', type=int, default=5)
+    parser.add_argument('--smoothing', type=float, default=0.5, help='weight of the previous windows (0: off)')
+    parser.add_argument('--max_batch', type=int, default=8)
+    parser.add_argument('--fps', type=float, default=None, help='replay a recorded source at this frame rate')
+    parser.add_argument('--live', action='store_true', help='read frames on a background thread')
+    parser.add_argument('--fused', action='store_true', help='use the BatchNorm-folded TorchScript model')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    configs = Config(args.config)
+
+    model = load_model(args.weights, configs, args.num_classes, device)
+    if args.fused:
+        model = fuse(model)
+
+    recognizer = StreamingPoseRecognizer(model, class_names=load_class_names(args.class_list, args.num_classes,
+                                                                             args.split),
+                                         window_size=configs.num_samples, hop=args.hop, top_k=args.top_k,
+                                         smoothing=args.smoothing, max_batch=args.max_batch,
+                                         keypoints=configs.keypoints, device=device)
+
+    frames = open_source(args.source)
+    if args.fps:
+        frames = paced(frames, args.fps)
+
+    for prediction in run_stream(recognizer, frames, live=args.live):
+        print(json.dumps(prediction))
+        sys.stdout.flush()
+
+    print(recognizer.latency_stats(), file=sys.stderr)
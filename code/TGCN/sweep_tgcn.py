@@ -0,0 +1,355 @@
+"""Hyperparameter sweep of GCN_muti_att, training many models at once.
+
+A single GCN_muti_att is far too small to keep a GPU (or a many-core CPU) busy. EnsembleGCN holds the parameters of
+M models of the same shape (NUM_STAGES, HIDDEN_SIZE) stacked along a leading model dimension, so every layer of
+all M models is one batched matmul, and StackedAdam updates all of them with one set of tensor ops while keeping
+a learning rate, weight decay and Adam moments per model. All models see the same batches from one data stream;
+dropout, learning rate, weight decay and seed can differ per model.
+
+The grid is the product of the values given on the command line (default: the value in the config); runs are
+grouped by shape and every group is trained as one ensemble (in chunks of --max_models). Each model keeps its own
+metrics and its best weights are written as a plain GCN_muti_att state dict, loadable by test_tgcn.py and
+serve_tgcn.py. Results go to <out>/results.json.
+
+    python sweep_tgcn.py -config configs/asl100.ini -split ../../data/splits/asl100.json \
+        -pose_root ../../data/pose_per_individual_videos --pose_store ../../data/pose_store \
+        --hidden_sizes 64 128 --num_stages 12 24 --drop_ps 0.2 0.3 0.5 --lrs 1e-3 3e-4 --out sweeps/asl100
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from checkpoint_manager import CheckpointManager
+from configs import Config
+from device_dataset import DevicePoseDataset
+from pose_augment import PoseAugment
+from pose_store import PoseStore
+from sign_dataset import Sign_Dataset, keypoint_indices
+from tgcn_model import GCN_muti_att
+
+
+def _key(name):
+    # ParameterDict keys cannot contain dots
+    return name.replace('.', '__')
+
+
+class EnsembleGCN(nn.Module):
+    """M GCN_muti_att models of one shape with stacked parameters; forward maps (B, N, F) to (M, B, num_class).
+
+    Parameters and buffers are named as in GCN_muti_att, with a leading model dimension. Eval mode gives the same
+    outputs as the individual models; in training mode every model uses its own batch statistics and dropout rate.
+    """
+
+    def __init__(self, models, drop_ps):
+        super(EnsembleGCN, self).__init__()
+        first = models[0]
+        self.num_models = len(models)
+        self.num_stage = first.num_stage
+        self.is_resi = bool(first.gcbs[0].is_resi) if first.num_stage > 0 else True
+        self.att_topk = first.gc1.topk
+        self.bn_eps, self.bn_momentum = first.bn1.eps, first.bn1.momentum
+
+        states = [model.state_dict() for model in models]
+        parameter_names = set(name for name, _ in first.named_parameters())
+        self.names = list(states[0].keys())
+        self.params = nn.ParameterDict()
+        for name in self.names:
+            stacked = torch.stack([state[name] for state in states]).clone()
+            if name in parameter_names:
+                self.params[_key(name)] = nn.Parameter(stacked)
+            else:
+                self.register_buffer(_key(name), stacked)
+        self.register_buffer('drop_p', torch.tensor(drop_ps, dtype=torch.float32))
+
+    def _get(self, name):
+        key = _key(name)
+        return self.params[key] if key in self.params else getattr(self, key)
+
+    def model_state_dict(self, i):
+        """State dict of model `i`, as a GCN_muti_att would have it."""
+        return {name: self._get(name)[i].detach() for name in self.names}
+
+    # activations are kept as (M, N, B, F), so that both matmuls of a layer are one bmm over the models
+    def _gc(self, x, prefix):
+        m, n, b, f = x.shape
+        att = self._get(prefix + '.att')
+        if self.att_topk is not None:
+            indices = att.abs().topk(self.att_topk, dim=-1)[1]
+            att = torch.zeros_like(att).scatter(-1, indices, att.gather(-1, indices))
+        weight = self._get(prefix + '.weight')
+        support = torch.bmm(x.reshape(m, n * b, f), weight)
+        output = torch.bmm(att, support.view(m, n, -1)).view(m, n, b, -1)
+        return output + self._get(prefix + '.bias')[:, None, None, :]
+
+    def _bn(self, y, prefix):
+        # BatchNorm1d(N * F) of every model is one batch_norm over (B, M * N * F); the stacked (M, N * F) buffers
+        # are updated in place through their flat views
+        m, n, b, f = y.shape
+        flat = y.permute(2, 0, 1, 3).reshape(b, m * n * f)
+        if self.training:
+            self._get(prefix + '.num_batches_tracked').add_(1)
+        flat = F.batch_norm(flat, self._get(prefix + '.running_mean').view(-1),
+                            self._get(prefix + '.running_var').view(-1), self._get(prefix + '.weight').view(-1),
+                            self._get(prefix + '.bias').view(-1), self.training, self.bn_momentum, self.bn_eps)
+        return flat.view(b, m, n, f).permute(1, 2, 0, 3)
+
+    def _dropout(self, y):
+        if not self.training:
+            return y
+        keep = (1 - self.drop_p).view(-1, 1, 1, 1)
+        return y * (torch.rand_like(y) < keep).to(y.dtype) / keep
+
+    def _layer(self, x, gc, bn):
+        return self._dropout(torch.tanh(self._bn(self._gc(x, gc), bn)))
+
+    def forward(self, x):
+        # the same (B, N, F) batch for every model
+        x = x.transpose(0, 1).unsqueeze(0).expand(self.num_models, -1, -1, -1)
+        y = self._layer(x, 'gc1', 'bn1')
+        for i in range(self.num_stage):
+            block = 'gcbs.{}.'.format(i)
+            z = self._layer(y, block + 'gc1', block + 'bn1')
+            z = self._layer(z, block + 'gc2', block + 'bn2')
+            y = z + y if self.is_resi else z
+        out = torch.mean(y, dim=1)
+        return torch.bmm(out, self._get('fc_out.weight').transpose(1, 2)) + self._get('fc_out.bias').unsqueeze(1)
+
+
+class StackedAdam(object):
+    """torch.optim.Adam (L2 weight decay) over parameters with a leading model dimension, with a learning rate and
+    weight decay per model; models never interact."""
+
+    def __init__(self, params, lr, weight_decay, betas=(0.9, 0.999), eps=1e-8):
+        self.params = [p for p in params if p.requires_grad]
+        self.lr = torch.as_tensor(lr, dtype=torch.float32)
+        self.weight_decay = torch.as_tensor(weight_decay, dtype=torch.float32)
+        self.betas = betas
+        self.eps = eps
+        self.step_count = 0
+        self.exp_avg = [torch.zeros_like(p) for p in self.params]
+        self.exp_avg_sq = [torch.zeros_like(p) for p in self.params]
+
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self):
+        self.step_count += 1
+        beta1, beta2 = self.betas
+        bias_correction1 = 1 - beta1 ** self.step_count
+        bias_correction2 = 1 - beta2 ** self.step_count
+
+        for p, exp_avg, exp_avg_sq in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            if p.grad is None:
+                continue
+            shape = (-1,) + (1,) * (p.dim() - 1)
+            grad = p.grad + self.weight_decay.to(p.device).view(shape) * p
+            exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+            exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+            denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(self.eps)
+            step_size = (self.lr.to(p.device) / bias_correction1).view(shape)
+            p.sub_(step_size * exp_avg / denom)
+
+    def state_dict(self):
+        return {'step_count': self.step_count, 'exp_avg': self.exp_avg, 'exp_avg_sq': self.exp_avg_sq}
+
+    def load_state_dict(self, state):
+        self.step_count = state['step_count']
+        for dst, src in zip(self.exp_avg + self.exp_avg_sq, state['exp_avg'] + state['exp_avg_sq']):
+            dst.copy_(src)
+
+
+def run_name(run):
+    return 'h{hidden_size}_s{num_stages}_p{drop_p}_lr{lr}_wd{weight_decay}_seed{seed}'.format(**run)
+
+
+def build_grid(configs, args):
+    values = {'hidden_size': args.hidden_sizes or [configs.hidden_size],
+              'num_stages': args.num_stages or [configs.num_stages],
+              'drop_p': args.drop_ps or [configs.drop_p],
+              'lr': args.lrs or [configs.init_lr],
+              'weight_decay': args.weight_decays or [configs.adam_weight_decay],
+              'seed': args.seeds}
+    keys = sorted(values)
+    return [dict(zip(keys, combination)) for combination in itertools.product(*[values[k] for k in keys])]
+
+
+def ensemble_metrics(out, y, top_n=(1, 5, 10)):
+    """Per model loss sum and top-n hit counts of (M, B, C) outputs, as an (M, 1 + len(top_n)) tensor."""
+    m, b, c = out.shape
+    losses = F.cross_entropy(out.reshape(m * b, c), y.repeat(m), reduction='none').view(m, b)
+    ranked = out.argsort(dim=2, descending=True)
+    hits = [(ranked[:, :, :min(n, c)] == y.view(1, b, 1)).any(dim=2).sum(dim=1) for n in top_n]
+    return torch.stack([losses.sum(dim=1)] + [h.to(losses.dtype) for h in hits], dim=1)
+
+
+def evaluate(ensemble, loader, num_copies, device):
+    """Per model mean loss and top-1/5/10 accuracy of the k_copies test views, as an (M, 4) tensor."""
+    ensemble.eval()
+    totals, count = 0, 0
+    with torch.no_grad():
+        for X, y, _ in loader:
+            X, y = X.to(device), y.to(device).view(-1)
+            # fold the copies into the batch as train_utils.multi_view_forward, then average them per model
+            batch_size, num_nodes, length = X.size()
+            stride = length // num_copies
+            views = X[:, :, :num_copies * stride].reshape(batch_size, num_nodes, num_copies, stride)
+            views = views.permute(0, 2, 1, 3).reshape(batch_size * num_copies, num_nodes, stride)
+            out = ensemble(views).view(ensemble.num_models, batch_size, num_copies, -1).mean(dim=2)
+            totals = totals + ensemble_metrics(out, y)
+            count += len(y)
+    return totals / max(count, 1)
+
+
+def train_group(group_name, runs, configs, train_loader, val_loader, num_classes, out_dir, device, augment=None,
+                resume=False):
+    """Train the runs (all of one shape) as one ensemble; returns the per run results."""
+    num_nodes = len(keypoint_indices(configs.keypoints))
+    models = []
+    for run in runs:
+        torch.manual_seed(run['seed'])
+        models.append(GCN_muti_att(input_feature=configs.num_samples * 2, hidden_feature=run['hidden_size'],
+                                   num_class=num_classes, p_dropout=run['drop_p'], num_stage=run['num_stages'],
+                                   num_nodes=num_nodes, att_topk=configs.att_topk))
+    ensemble = EnsembleGCN(models, [run['drop_p'] for run in runs]).to(device)
+    optimizer = StackedAdam(ensemble.params.values(), lr=[run['lr'] for run in runs],
+                            weight_decay=[run['weight_decay'] for run in runs], eps=configs.adam_eps)
+
+    names = [run_name(run) for run in runs]
+    history = [{'train_loss': [], 'train_acc': [], 'val_loss': [], 'val_top1': [], 'val_top5': [],
+                'val_top10': []} for _ in runs]
+    best = [0.] * len(runs)
+    start_epoch = 0
+
+    ckpt_manager = CheckpointManager(os.path.join(out_dir, group_name), prefix='ensemble',
+                                     keep_last=configs.keep_last, keep_best=0)
+    if resume:
+        checkpoint = ckpt_manager.load()
+        if checkpoint is not None and checkpoint['names'] == names:
+            ensemble.load_state_dict(checkpoint['ensemble'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            history, best = checkpoint['history'], checkpoint['best']
+            start_epoch = checkpoint['epoch'] + 1
+            print('resumed {} from epoch {}'.format(group_name, checkpoint['epoch']))
+
+    print('training {} models of shape {} ({} parameters each)'.format(
+        len(runs), group_name, sum(p.numel() for p in models[0].parameters())))
+    for epoch in range(start_epoch, configs.max_epochs):
+        start = time.time()
+        ensemble.train()
+        totals, count = 0, 0
+        for X, y, _ in train_loader:
+            X, y = X.to(device, non_blocking=True), y.to(device, non_blocking=True).view(-1)
+            if augment is not None:
+                X = augment(X)
+
+            out = ensemble(X)
+            m, b, c = out.shape
+            losses = F.cross_entropy(out.reshape(m * b, c), y.repeat(m), reduction='none').view(m, b).mean(dim=1)
+
+            optimizer.zero_grad()
+            # the models share no parameters, so the gradient of the sum is every model's own gradient
+            losses.sum().backward()
+            optimizer.step()
+
+            with torch.no_grad():
+                totals = totals + torch.stack([losses * b, (out.argmax(dim=2) == y).sum(dim=1).to(losses.dtype)],
+                                              dim=1)
+            count += b
+
+        train_stats = (totals / max(count, 1)).cpu()
+        val_stats = evaluate(ensemble, val_loader, configs.num_copies, device).cpu()
+
+        for i in range(len(runs)):
+            for key, value in zip(['train_loss', 'train_acc'], train_stats[i].tolist()):
+                history[i][key].append(value)
+            for key, value in zip(['val_loss', 'val_top1', 'val_top5', 'val_top10'], val_stats[i].tolist()):
+                history[i][key].append(value)
+            if val_stats[i, 1].item() > best[i]:
+                best[i] = val_stats[i, 1].item()
+                ckpt_manager.save_weights(ensemble.model_state_dict(i), os.path.join(out_dir, names[i] + '.pth'))
+
+        top = int(val_stats[:, 1].argmax())
+        print('{} epoch {}: {:.1f}s, mean val acc {:.2f}%, best {:.2f}% ({})'.format(
+            group_name, epoch + 1, time.time() - start, 100 * val_stats[:, 1].mean().item(),
+            100 * val_stats[top, 1].item(), names[top]))
+
+        ckpt_manager.save(epoch, {'ensemble': ensemble.state_dict(), 'optimizer': optimizer.state_dict(),
+                                  'epoch': epoch, 'names': names, 'history': history, 'best': best})
+
+    ckpt_manager.close()
+    return [dict(run, name=name, best_val_top1=b, history=h) for run, name, b, h in zip(runs, names, best, history)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-config', type=str, required=True, help='base config, e.g. configs/asl100.ini')
+    parser.add_argument('-split', type=str, required=True)
+    parser.add_argument('-pose_root', type=str, required=True)
+    parser.add_argument('--pose_store', type=str, default=None)
+    parser.add_argument('--hidden_sizes', type=int, nargs='+', default=None)
+    parser.add_argument('--num_stages', type=int, nargs='+', default=None)
+    parser.add_argument('--drop_ps', type=float, nargs='+', default=None)
+    parser.add_argument('--lrs', type=float, nargs='+', default=None)
+    parser.add_argument('--weight_decays', type=float, nargs='+', default=None)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--max_models', type=int, default=64, help='models trained together at most')
+    parser.add_argument('--device_data', action='store_true', help='keep all poses on the training device')
+    parser.add_argument('--num_workers', type=int, default=0, help='DataLoader workers')
+    parser.add_argument('--out', type=str, default='sweeps')
+    parser.add_argument('--resume', action='store_true', help='continue groups from their latest checkpoint')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    configs = Config(args.config)
+    pose_store = PoseStore(args.pose_store) if args.pose_store else None
+    os.makedirs(args.out, exist_ok=True)
+
+    # one data stream for every model of the sweep
+    train_dataset = Sign_Dataset(index_file_path=args.split, split=['train', 'val'], pose_root=args.pose_root,
+                                 img_transforms=None, video_transforms=None, num_samples=configs.num_samples,
+                                 pose_store=pose_store, keypoints=configs.keypoints)
+    val_dataset = Sign_Dataset(index_file_path=args.split, split='test', pose_root=args.pose_root,
+                               img_transforms=None, video_transforms=None, num_samples=configs.num_samples,
+                               sample_strategy='k_copies', num_copies=configs.num_copies, pose_store=pose_store,
+                               keypoints=configs.keypoints)
+    if args.device_data:
+        train_loader = DevicePoseDataset(train_dataset, device=device).loader(configs.batch_size, shuffle=True)
+        val_loader = DevicePoseDataset(val_dataset, device=device).loader(configs.batch_size, shuffle=False)
+    else:
+        train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=configs.batch_size, shuffle=True,
+                                                   num_workers=args.num_workers)
+        val_loader = torch.utils.data.DataLoader(val_dataset, batch_size=configs.batch_size,
+                                                 num_workers=args.num_workers)
+    num_classes = len(train_dataset.label_encoder.classes_)
+    augment = PoseAugment.from_config(configs)
+
+    grid = build_grid(configs, args)
+    groups = {}
+    for run in grid:
+        groups.setdefault((run['hidden_size'], run['num_stages']), []).append(run)
+    print('{} runs in {} shape groups'.format(len(grid), len(groups)))
+
+    results = []
+    for shape in sorted(groups):
+        runs = groups[shape]
+        for i in range(0, len(runs), args.max_models):
+            group_name = 'h{}_s{}'.format(*shape)
+            if len(runs) > args.max_models:
+                group_name += '_{}'.format(i // args.max_models)
+            results.extend(train_group(group_name, runs[i:i + args.max_models], configs, train_loader, val_loader, num_classes,
+                                       args.out, device, augment=augment, resume=args.resume))
+            with open(os.path.join(args.out, 'results.json'), 'w') as f:
+                json.dump(results, f, indent=2)
+
+    print('{:<48} {:>10}'.format('run', 'val top-1'))
+    for result in sorted(results, key=lambda r: r['best_val_top1'], reverse=True):
+        print('{:<48} {:>9.2f}%'.format(result['name'], 100 * result['best_val_top1']))
@@ -1,15 +1,16 @@
 import os
 
 from configs import Config
-from sign_dataset import Sign_Dataset
+from sign_dataset import Sign_Dataset, keypoint_indices
 import numpy as np
 import torch
 from sklearn.metrics import accuracy_score
 
 from tgcn_model import GCN_muti_att
+from train_utils import multi_view_forward
 
 
-def test(model, test_loader):
+def test(model, test_loader, num_copies=4):
     # set model as testing mode
     model.eval()
 
@@ -19,8 +20,6 @@ def test(model, test_loader):
     all_video_ids = []
     all_pool_out = []
 
-    num_copies = 4
-
     with torch.no_grad():
         for batch_idx, data in enumerate(test_loader):
             print('starting batch: {}'.format(batch_idx))
@@ -28,17 +27,7 @@ def test(model, test_loader):
             X, y, video_ids = data
             X, y = X.cuda(), y.cuda().view(-1, )
 
-            all_output = []
-
-            stride = X.size()[2] // num_copies
-
-            for i in range(num_copies):
-                X_slice = X[:, :, i * stride: (i + 1) * stride]
-                output = model(X_slice)
-                all_output.append(output)
-
-            all_output = torch.stack(all_output, dim=1)
-            output = torch.mean(all_output, dim=1)
+            output = multi_view_forward(model, X, num_copies)
 
             y_pred = output.max(1, keepdim=True)[1]  # (y_pred != output) get the index of the max log-probability
 
@@ -109,13 +98,16 @@ if __name__ == '__main__':
                            img_transforms=None, video_transforms=None,
                            num_samples=num_samples,
                            sample_strategy='k_copies',
+                           num_copies=configs.num_copies,
+                           keypoints=configs.keypoints,
                            test_index_file=split_file
                            )
     data_loader = torch.utils.data.DataLoader(dataset=dataset, batch_size=batch_size, shuffle=True)
 
     # setup the model
     model = GCN_muti_att(input_feature=num_samples * 2, hidden_feature=hidden_size,
-                         num_class=int(trained_on[3:]), p_dropout=drop_p, num_stage=num_stages).cuda()
+                         num_class=int(trained_on[3:]), p_dropout=drop_p, num_stage=num_stages,
+                         num_nodes=len(keypoint_indices(configs.keypoints)), att_topk=configs.att_topk).cuda()
 
     print('Loading model...')
 
@@ -123,4 +115,4 @@ if __name__ == '__main__':
     model.load_state_dict(checkpoint)
     print('Finish loading model!')
 
-    test(model, data_loader)
+    test(model, data_loader, num_copies=configs.num_copies)
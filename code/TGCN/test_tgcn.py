@@ -1,15 +1,17 @@
 import os
 
 from configs import Config
-from sign_dataset import Sign_Dataset
+from pose_store import PoseStore
+from sign_dataset import Sign_Dataset, keypoint_indices
 import numpy as np
 import torch
 from sklearn.metrics import accuracy_score
 
 from tgcn_model import GCN_muti_att
+from train_utils import multi_view_forward
 
 
-def test(model, test_loader):
+def test(model, test_loader, num_copies=4):
     # set model as testing mode
     model.eval()
 
@@ -19,8 +21,6 @@ def test(model, test_loader):
     all_video_ids = []
     all_pool_out = []
 
-    num_copies = 4
-
     with torch.no_grad():
         for batch_idx, data in enumerate(test_loader):
             print('starting batch: {}'.format(batch_idx))
@@ -28,17 +28,7 @@ def test(model, test_loader):
             X, y, video_ids = data
             X, y = X.cuda(), y.cuda().view(-1, )
 
-            all_output = []
-
-            stride = X.size()[2] // num_copies
-
-            for i in range(num_copies):
-                X_slice = X[:, :, i * stride: (i + 1) * stride]
-                output = model(X_slice)
-                all_output.append(output)
-
-            all_output = torch.stack(all_output, dim=1)
-            output = torch.mean(all_output, dim=1)
+            output = multi_view_forward(model, X, num_copies)
 
             y_pred = output.max(1, keepdim=True)[1]  # (y_pred != output) get the index of the max log-probability
 
@@ -97,6 +87,8 @@ if __name__ == '__main__':
     # test_on_split_file = os.path.join(root, 'data/splits-with-dialect-annotated/{}.json'.format(tested_on))
 
     pose_data_root = os.path.join(root, 'data/pose_per_individual_videos')
+    # set to a pose store written by gen_features.py to skip parsing the OpenPose json files
+    pose_store_root = None
     config_file = os.path.join(root, 'code/TGCN/archived/{}/{}.ini'.format(trained_on, trained_on))
     configs = Config(config_file)
 
@@ -110,13 +102,17 @@ if __name__ == '__main__':
                            img_transforms=None, video_transforms=None,
                            num_samples=num_samples,
                            sample_strategy='k_copies',
-                           test_index_file=split_file
+                           num_copies=configs.num_copies,
+                           keypoints=configs.keypoints,
+                           test_index_file=split_file,
+                           pose_store=PoseStore(pose_store_root) if pose_store_root else None
                            )
     data_loader = torch.utils.data.DataLoader(dataset=dataset, batch_size=batch_size, shuffle=True)
 
     # setup the model
     model = GCN_muti_att(input_feature=num_samples * 2, hidden_feature=hidden_size,
-                         num_class=int(trained_on[3:]), p_dropout=drop_p, num_stage=num_stages).cuda()
+                         num_class=int(trained_on[3:]), p_dropout=drop_p, num_stage=num_stages,
+                         num_nodes=len(keypoint_indices(configs.keypoints)), att_topk=configs.att_topk).cuda()
 
     print('Loading model...')
 
@@ -124,4 +120,4 @@ if __name__ == '__main__':
     model.load_state_dict(checkpoint)
     print('Finish loading model!')
 
-    test(model, data_loader)
+    test(model, data_loader, num_copies=configs.num_copies)
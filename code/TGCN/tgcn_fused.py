@@ -0,0 +1,161 @@
+"""Fused inference path for GCN_muti_att.
+
+In eval mode every GraphConvolution_att + BatchNorm1d(N * F) pair is an affine map per (node, feature) after the
+two matmuls, so the GCN bias and the BatchNorm statistics are folded into one scale and one shift per layer and
+each layer becomes
+    tanh(addcmul(shift, att @ (x @ weight), scale))
+(with top-k sparse attention, att is the pruned dense matrix). Dropout is the identity in eval mode and disappears.
+The parameters of all GC_Blocks are stacked into a few tensors and the module is TorchScript compatible, so the
+whole forward runs without Python dispatch per layer.
+
+    fused = fuse(model)                                # scripted and frozen FusedGCN
+    check_parity(model, fused, torch.randn(8, 55, 100))
+
+    python tgcn_fused.py -weights archived/asl100/ckpt.pth -config configs/asl100.ini -num_classes 100
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from configs import Config
+from sign_dataset import keypoint_indices
+from tgcn_model import GCN_muti_att
+
+
+def fold_batchnorm(gc, bn):
+    """(weight, att, scale, shift) such that bn(gc(x)) == att @ (x @ weight) * scale + shift in eval mode."""
+    num_nodes, out_features = gc.att.size(0), gc.out_features
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    scale, shift = scale.view(num_nodes, out_features), shift.view(num_nodes, out_features)
+    if gc.bias is not None:
+        shift = shift + gc.bias * scale
+    return gc.weight, gc.dense_att(), scale, shift
+
+
+class FusedGCN(nn.Module):
+    """Eval-only equivalent of a trained GCN_muti_att; the weights are copied, not shared."""
+
+    def __init__(self, model):
+        super(FusedGCN, self).__init__()
+        self.num_stage = model.num_stage
+        self.is_resi = bool(model.gcbs[0].is_resi) if model.num_stage > 0 else True
+
+        with torch.no_grad():
+            weight, att, scale, shift = fold_batchnorm(model.gc1, model.bn1)
+            self.register_buffer('weight', weight.clone())
+            self.register_buffer('att', att.clone())
+            self.register_buffer('scale', scale.clone())
+            self.register_buffer('shift', shift.clone())
+
+            hidden = model.gc1.out_features
+            num_nodes = model.gc1.att.size(0)
+            # (num_stage, 2, ...): the two layers of every GC_Block
+            layers = [[fold_batchnorm(block.gc1, block.bn1), fold_batchnorm(block.gc2, block.bn2)]
+                      for block in model.gcbs]
+            shapes = [(hidden, hidden), (num_nodes, num_nodes), (num_nodes, hidden), (num_nodes, hidden)]
+            stacked = []
+            for i, shape in enumerate(shapes):
+                if layers:
+                    stacked.append(torch.stack([torch.stack([layer[i] for layer in block]) for block in layers]))
+                else:
+                    stacked.append(torch.zeros((0, 2) + shape))
+            self.register_buffer('block_weight', stacked[0].clone())
+            self.register_buffer('block_att', stacked[1].clone())
+            self.register_buffer('block_scale', stacked[2].clone())
+            self.register_buffer('block_shift', stacked[3].clone())
+
+            self.register_buffer('fc_weight', model.fc_out.weight.clone())
+            self.register_buffer('fc_bias', model.fc_out.bias.clone())
+
+    def forward(self, x):
+        y = torch.tanh(torch.addcmul(self.shift, torch.matmul(self.att, torch.matmul(x, self.weight)), self.scale))
+
+        for i in range(self.num_stage):
+            z = torch.matmul(self.block_att[i, 0], torch.matmul(y, self.block_weight[i, 0]))
+            z = torch.tanh(torch.addcmul(self.block_shift[i, 0], z, self.block_scale[i, 0]))
+            z = torch.matmul(self.block_att[i, 1], torch.matmul(z, self.block_weight[i, 1]))
+            z = torch.tanh(torch.addcmul(self.block_shift[i, 1], z, self.block_scale[i, 1]))
+            if self.is_resi:
+                y = z + y
+            else:
+                y = z
+
+        return F.linear(torch.mean(y, dim=1), self.fc_weight, self.fc_bias)
+
+
+def fuse(model, script=True):
+    """FusedGCN of a trained model, compiled with TorchScript (and frozen where supported) if `script`."""
+    fused = FusedGCN(model.eval()).eval()
+    if not script:
+        return fused
+    scripted = torch.jit.script(fused)
+    if hasattr(torch.jit, 'freeze'):
+        scripted = torch.jit.freeze(scripted)
+    return scripted
+
+
+def check_parity(model, fused, x, atol=1e-4):
+    """Max absolute difference between the eval outputs of `model` and `fused` on `x`; raises if above `atol`."""
+    model.eval()
+    with torch.no_grad():
+        diff = (model(x) - fused(x)).abs().max().item()
+    if diff > atol:
+        raise AssertionError('fused model differs by {:.2e} (atol {:.0e})'.format(diff, atol))
+    return diff
+
+
+def measure_latency(model, x, warmup=5, iters=20):
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start) / iters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-config', type=str, required=True)
+    parser.add_argument('-num_classes', type=int, required=True)
+    parser.add_argument('-weights', type=str, default=None, help='checkpoint (default: random weights)')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 16, 64])
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    configs = Config(args.config)
+
+    hidden_size = configs.hidden_size
+    state_dict = None
+    if args.weights:
+        state_dict = torch.load(args.weights, map_location='cpu')
+        hidden_size = state_dict['gc1.weight'].size(1)
+    num_nodes = len(keypoint_indices(configs.keypoints))
+    model = GCN_muti_att(input_feature=configs.num_samples * 2, hidden_feature=hidden_size,
+                         num_class=args.num_classes, p_dropout=configs.drop_p, num_stage=configs.num_stages,
+                         num_nodes=num_nodes, att_topk=configs.att_topk)
+    if state_dict is not None:
+        model.load_state_dict(state_dict)
+    else:
+        # non-trivial BatchNorm statistics, so that folding them is actually exercised
+        model.train()
+        with torch.no_grad():
+            for _ in range(10):
+                model(torch.randn(32, num_nodes, configs.num_samples * 2))
+    model.to(device).eval()
+
+    variants = [('eager', model), ('fused', fuse(model, script=False)), ('fused_script', fuse(model))]
+    print('{:<14} {:>6} {:>12} {:>10}'.format('model', 'batch', 'latency ms', 'max diff'))
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, num_nodes, configs.num_samples * 2, device=device)
+        for name, m in variants:
+            diff = check_parity(model, m, x)
+            print('{:<14} {:>6} {:>12.2f} {:>10.1e}'.format(name, batch_size, measure_latency(m, x), diff))
@@ -17,12 +17,15 @@ class GraphConvolution_att(nn.Module):
     Simple GCN layer, similar to https://arxiv.org/abs/1609.02907
     """
 
-    def __init__(self, in_features, out_features, bias=True, init_A=0):
+    def __init__(self, in_features, out_features, bias=True, init_A=0, num_nodes=55, topk=None):
         super(GraphConvolution_att, self).__init__()
         self.in_features = in_features
         self.out_features = out_features
+        self.num_nodes = num_nodes
+        # keep only the topk largest-magnitude attention weights of every node (None: dense)
+        self.topk = topk if topk and topk < num_nodes else None
         self.weight = Parameter(torch.FloatTensor(in_features, out_features))
-        self.att = Parameter(torch.FloatTensor(55, 55))
+        self.att = Parameter(torch.FloatTensor(num_nodes, num_nodes))
         if bias:
             self.bias = Parameter(torch.FloatTensor(out_features))
         else:
@@ -36,10 +39,23 @@ class GraphConvolution_att(nn.Module):
         if self.bias is not None:
             self.bias.data.uniform_(-stdv, stdv)
 
+    def sparse_att(self):
+        """(indices, weights), both num_nodes x topk, of the attention entries kept for every node."""
+        indices = self.att.abs().topk(self.topk, dim=1)[1]
+        return indices, self.att.gather(1, indices)
+
+    def dense_att(self):
+        """The attention matrix actually applied, with the pruned entries zeroed."""
+        if self.topk is None:
+            return self.att
+        indices, weights = self.sparse_att()
+        return torch.zeros_like(self.att).scatter(1, indices, weights)
+
     def forward(self, input):
         # AHW
         support = torch.matmul(input, self.weight)  # HW
-        output = torch.matmul(self.att, support)  # g
+        # with topk, the pruned matrix: a dense N x N matmul beats torch.sparse.mm at these graph sizes
+        output = torch.matmul(self.dense_att(), support)  # g
         if self.bias is not None:
             return output + self.bias
         else:
@@ -53,17 +69,17 @@ class GraphConvolution_att(nn.Module):
 
 class GC_Block(nn.Module):
 
-    def __init__(self, in_features, p_dropout, bias=True, is_resi=True):
+    def __init__(self, in_features, p_dropout, bias=True, is_resi=True, num_nodes=55, att_topk=None):
         super(GC_Block, self).__init__()
         self.in_features = in_features
         self.out_features = in_features
         self.is_resi = is_resi
 
-        self.gc1 = GraphConvolution_att(in_features, in_features)
-        self.bn1 = nn.BatchNorm1d(55 * in_features)
+        self.gc1 = GraphConvolution_att(in_features, in_features, num_nodes=num_nodes, topk=att_topk)
+        self.bn1 = nn.BatchNorm1d(num_nodes * in_features)
 
-        self.gc2 = GraphConvolution_att(in_features, in_features)
-        self.bn2 = nn.BatchNorm1d(55 * in_features)
+        self.gc2 = GraphConvolution_att(in_features, in_features, num_nodes=num_nodes, topk=att_topk)
+        self.bn2 = nn.BatchNorm1d(num_nodes * in_features)
 
         self.do = nn.Dropout(p_dropout)
         self.act_f = nn.Tanh()
@@ -92,16 +108,19 @@ class GC_Block(nn.Module):
 
 
 class GCN_muti_att(nn.Module):
-    def __init__(self, input_feature, hidden_feature, num_class, p_dropout, num_stage=1, is_resi=True):
+    def __init__(self, input_feature, hidden_feature, num_class, p_dropout, num_stage=1, is_resi=True, num_nodes=55,
+                 att_topk=None):
         super(GCN_muti_att, self).__init__()
         self.num_stage = num_stage
+        self.num_nodes = num_nodes
 
-        self.gc1 = GraphConvolution_att(input_feature, hidden_feature)
-        self.bn1 = nn.BatchNorm1d(55 * hidden_feature)
+        self.gc1 = GraphConvolution_att(input_feature, hidden_feature, num_nodes=num_nodes, topk=att_topk)
+        self.bn1 = nn.BatchNorm1d(num_nodes * hidden_feature)
 
         self.gcbs = []
         for i in range(num_stage):
-            self.gcbs.append(GC_Block(hidden_feature, p_dropout=p_dropout, is_resi=is_resi))
+            self.gcbs.append(GC_Block(hidden_feature, p_dropout=p_dropout, is_resi=is_resi, num_nodes=num_nodes,
+                                      att_topk=att_topk))
 
         self.gcbs = nn.ModuleList(self.gcbs)
 
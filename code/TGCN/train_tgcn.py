@@ -1,3 +1,4 @@
+import argparse
 import logging
 import os
 
@@ -7,15 +8,21 @@ import torch.optim as optim
 from torch.utils.data import Dataset
 
 import utils
+from checkpoint_manager import CheckpointManager, capture_rng_state, restore_rng_state
 from configs import Config
+from device_dataset import DevicePoseDataset
+from pipeline_profiler import StageProfiler, TimedCollate
+from pose_augment import PoseAugment
 from tgcn_model import GCN_muti_att
-from sign_dataset import Sign_Dataset
+from pose_store import PoseStore
+from sign_dataset import Sign_Dataset, keypoint_indices
 from train_utils import train, validation
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 
 
-def run(split_file, pose_data_root, configs, save_model_to=None):
+def run(split_file, pose_data_root, configs, save_model_to=None, checkpoint_dir='checkpoints', resume=None,
+        pose_store=None, device_data=False):
     epochs = configs.max_epochs
     log_interval = configs.log_interval
     num_samples = configs.num_samples
@@ -25,24 +32,46 @@ def run(split_file, pose_data_root, configs, save_model_to=None):
 
     # setup dataset
     train_dataset = Sign_Dataset(index_file_path=split_file, split=['train', 'val'], pose_root=pose_data_root,
-                                 img_transforms=None, video_transforms=None, num_samples=num_samples)
+                                 img_transforms=None, video_transforms=None, num_samples=num_samples,
+                                 pose_store=pose_store, keypoints=configs.keypoints)
+
+    num_workers = 0
+
+    # optional data pipeline profiling, reported every PROFILE_INTERVAL training batches; it keeps one row of
+    # timings per loader worker, so it must know the loader's worker count
+    profiler = None
+    if configs.profile_interval > 0:
+        profiler = StageProfiler(Sign_Dataset.PROFILE_STAGES + ('collate', 'data_wait', 'step'),
+                                 num_workers=num_workers)
+        train_dataset.profiler = profiler
 
     train_data_loader = torch.utils.data.DataLoader(dataset=train_dataset, batch_size=configs.batch_size,
-                                                    shuffle=True)
+                                                    shuffle=True, num_workers=num_workers,
+                                                    collate_fn=TimedCollate(profiler) if profiler else None)
 
     val_dataset = Sign_Dataset(index_file_path=split_file, split='test', pose_root=pose_data_root,
                                img_transforms=None, video_transforms=None,
                                num_samples=num_samples,
-                               sample_strategy='k_copies')
+                               sample_strategy='k_copies', num_copies=configs.num_copies, pose_store=pose_store,
+                               keypoints=configs.keypoints)
     val_data_loader = torch.utils.data.DataLoader(dataset=val_dataset, batch_size=configs.batch_size,
                                                   shuffle=True)
 
+    if device_data:
+        # preload all poses on the GPU and sample whole batches there, without DataLoader workers
+        train_data_loader = DevicePoseDataset(train_dataset, device='cuda').loader(configs.batch_size, shuffle=True)
+        val_data_loader = DevicePoseDataset(val_dataset, device='cuda').loader(configs.batch_size, shuffle=True)
+
     logging.info('\n'.join(['Class labels are: '] + [(str(i) + ' - ' + label) for i, label in
                                                      enumerate(train_dataset.label_encoder.classes_)]))
 
     # setup the model
     model = GCN_muti_att(input_feature=num_samples*2, hidden_feature=num_samples*2,
-                         num_class=len(train_dataset.label_encoder.classes_), p_dropout=drop_p, num_stage=num_stages).cuda()
+                         num_class=len(train_dataset.label_encoder.classes_), p_dropout=drop_p, num_stage=num_stages,
+                         num_nodes=len(keypoint_indices(configs.keypoints)), att_topk=configs.att_topk).cuda()
+
+    # optional batched augmentation of the training batches, from the [AUGMENT] config section
+    augment = PoseAugment.from_config(configs)
 
     # setup training parameters, learning rate, optimizer, scheduler
     lr = configs.init_lr
@@ -56,17 +85,38 @@ def run(split_file, pose_data_root, configs, save_model_to=None):
     epoch_val_scores = []
 
     best_test_acc = 0
+    start_epoch = 0
+
+    ckpt_manager = CheckpointManager(checkpoint_dir, prefix='gcn', keep_last=configs.keep_last,
+                                     keep_best=configs.keep_best, mode='max')
+    if resume:
+        checkpoint = ckpt_manager.load(None if resume == 'latest' else resume)
+        if checkpoint is None:
+            print('no checkpoint to resume from in {}, starting from scratch'.format(checkpoint_dir))
+        else:
+            model.load_state_dict(checkpoint['model'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            start_epoch = checkpoint['epoch'] + 1
+            best_test_acc = checkpoint['best_test_acc']
+            epoch_train_losses, epoch_train_scores, epoch_val_losses, epoch_val_scores = checkpoint['history']
+            restore_rng_state(checkpoint['rng'])
+            print('resumed from epoch {}'.format(checkpoint['epoch']))
+
     # start training
-    for epoch in range(int(epochs)):
+    for epoch in range(start_epoch, int(epochs)):
         # train, test model
 
         print('start training.')
         train_losses, train_scores, train_gts, train_preds = train(log_interval, model,
-                                                                   train_data_loader, optimizer, epoch)
+                                                                   train_data_loader, optimizer, epoch,
+                                                                   profiler=profiler,
+                                                                   profile_interval=configs.profile_interval,
+                                                                   augment=augment)
         print('start testing.')
         val_loss, val_score, val_gts, val_preds, incorrect_samples = validation(model,
                                                                                 val_data_loader, epoch,
-                                                                                save_to=save_model_to)
+                                                                                save_to=save_model_to,
+                                                                                num_copies=configs.num_copies)
         # print('start testing.')
         # val_loss, val_score, val_gts, val_preds, incorrect_samples = validation(model,
         #                                                                         val_data_loader, epoch,
@@ -96,8 +146,18 @@ def run(split_file, pose_data_root, configs, save_model_to=None):
             best_test_acc = val_score[0]
             best_epoch_num = epoch
 
-            torch.save(model.state_dict(), os.path.join('checkpoints', subset, 'gcn_epoch={}_val_acc={}.pth'.format(
-                best_epoch_num, best_test_acc)))
+            ckpt_manager.save_weights(model.state_dict(), os.path.join(
+                checkpoint_dir, 'gcn_epoch={}_val_acc={}.pth'.format(best_epoch_num, best_test_acc)))
+
+        ckpt_manager.save(epoch, {'model': model.state_dict(),
+                                  'optimizer': optimizer.state_dict(),
+                                  'epoch': epoch,
+                                  'best_test_acc': best_test_acc,
+                                  'history': (epoch_train_losses, epoch_train_scores,
+                                              epoch_val_losses, epoch_val_scores),
+                                  'rng': capture_rng_state()}, score=val_score[0])
+
+    ckpt_manager.close()
 
     utils.plot_curves()
 
@@ -108,6 +168,15 @@ def run(split_file, pose_data_root, configs, save_model_to=None):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', type=str, nargs='?', const='latest', default=None,
+                        help='resume from the latest checkpoint, or from the given checkpoint file')
+    parser.add_argument('--pose_store', type=str, default=None,
+                        help='read poses from a store written by gen_features.py instead of the json files')
+    parser.add_argument('--device_data', action='store_true',
+                        help='keep all poses on the GPU and sample batches there instead of using a DataLoader')
+    args = parser.parse_args()
+
     root = '/media/anudisk/github/WLASL'
 
     subset = 'asl100'
@@ -120,6 +189,8 @@ if __name__ == "__main__":
     logging.basicConfig(filename='output/{}.log'.format(os.path.basename(config_file)[:-4]), level=logging.DEBUG, filemode='w+')
 
     logging.info('Calling main.run()')
-    run(split_file=split_file, configs=configs, pose_data_root=pose_data_root)
+    run(split_file=split_file, configs=configs, pose_data_root=pose_data_root,
+        checkpoint_dir=os.path.join('checkpoints', subset), resume=args.resume,
+        pose_store=PoseStore(args.pose_store) if args.pose_store else None, device_data=args.device_data)
     logging.info('Finished main.run()')
     # utils.plot_curves()
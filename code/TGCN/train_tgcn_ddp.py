@@ -0,0 +1,244 @@
+"""Multi-process data-parallel CPU training of GCN_muti_att with torch.distributed (gloo).
+
+Every rank trains a DistributedDataParallel replica on its DistributedSampler shard of Sign_Dataset with
+`--threads` intra-op threads, so a many-core node is used by several moderately threaded processes instead of one
+process whose small per-layer matmuls do not scale. The per-rank batch size is BATCH_SIZE / world size, which
+keeps the global batch (and so the learning rate of the config) unchanged. The test split is sharded as well and
+the metrics are summed over all ranks. Only rank 0 logs and writes checkpoints; the loss and accuracy history
+is kept in the checkpoints and written to output/ once at the end.
+
+    python train_tgcn_ddp.py --subset asl100 asl300 asl1000 asl2000 --nprocs 8 --threads 4 --pose_store ../../data/pose_store
+
+Also runs under torchrun, which sets RANK / WORLD_SIZE / MASTER_ADDR / MASTER_PORT (--nprocs is then ignored):
+    torchrun --nproc_per_node 8 train_tgcn_ddp.py --subset asl100 --threads 4
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+
+from checkpoint_manager import CheckpointManager
+from configs import Config
+from pose_augment import PoseAugment
+from pose_store import PoseStore
+from sign_dataset import Sign_Dataset, keypoint_indices
+from tgcn_model import GCN_muti_att
+from train_utils import compute_loss, multi_view_forward, train
+
+TOP_N = (1, 3, 5, 10, 30)
+
+
+def _single_thread_worker(worker_id):
+    torch.set_num_threads(1)
+
+
+def distributed_validation(model, test_loader, num_copies, num_classes, world_size):
+    """Mean loss and top-1/3/5/10/30 accuracy over the test samples of all ranks."""
+    model.eval()
+    # loss sum, sample count, then one hit count per TOP_N
+    totals = torch.zeros(2 + len(TOP_N), dtype=torch.float64)
+    with torch.no_grad():
+        for X, y, video_ids in test_loader:
+            y = y.view(-1)
+            output = multi_view_forward(model, X, num_copies)
+            totals[0] += compute_loss(output, y).item() * len(y)
+            totals[1] += len(y)
+            ranked = output.argsort(dim=1, descending=True)
+            for i, n in enumerate(TOP_N):
+                totals[2 + i] += (ranked[:, :min(n, num_classes)] == y.unsqueeze(1)).any(dim=1).sum().item()
+
+    if world_size > 1:
+        dist.all_reduce(totals)
+    count = max(totals[1].item(), 1)
+    return totals[0].item() / count, [totals[2 + i].item() / count for i in range(len(TOP_N))]
+
+
+def run(rank, world_size, split_file, pose_data_root, configs, checkpoint_dir, resume=None, pose_store=None,
+        threads=1, num_workers=0, seed=0):
+    torch.set_num_threads(threads)
+    is_main = rank == 0
+
+    num_samples = configs.num_samples
+    batch_size = max(configs.batch_size // world_size, 1)
+
+    # setup dataset
+    train_dataset = Sign_Dataset(index_file_path=split_file, split=['train', 'val'], pose_root=pose_data_root,
+                                 img_transforms=None, video_transforms=None, num_samples=num_samples,
+                                 pose_store=pose_store, keypoints=configs.keypoints)
+    train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=seed)
+    train_data_loader = DataLoader(train_dataset, batch_size=batch_size, sampler=train_sampler,
+                                   num_workers=num_workers, persistent_workers=num_workers > 0,
+                                   worker_init_fn=_single_thread_worker)
+
+    val_dataset = Sign_Dataset(index_file_path=split_file, split='test', pose_root=pose_data_root,
+                               img_transforms=None, video_transforms=None, num_samples=num_samples,
+                               sample_strategy='k_copies', num_copies=configs.num_copies, pose_store=pose_store,
+                               keypoints=configs.keypoints)
+    # strided shards without the padding of DistributedSampler, so every test sample is counted exactly once
+    val_data_loader = DataLoader(Subset(val_dataset, range(rank, len(val_dataset), world_size)),
+                                 batch_size=batch_size, num_workers=num_workers,
+                                 persistent_workers=num_workers > 0, worker_init_fn=_single_thread_worker)
+
+    num_classes = len(train_dataset.label_encoder.classes_)
+    if is_main:
+        logging.info('\n'.join(['Class labels are: '] + [(str(i) + ' - ' + label) for i, label in
+                                                         enumerate(train_dataset.label_encoder.classes_)]))
+
+    # setup the model; DDP broadcasts rank 0's initial weights to the other ranks
+    torch.manual_seed(seed)
+    model = GCN_muti_att(input_feature=num_samples * 2, hidden_feature=num_samples * 2,
+                         num_class=num_classes, p_dropout=configs.drop_p, num_stage=configs.num_stages,
+                         num_nodes=len(keypoint_indices(configs.keypoints)), att_topk=configs.att_topk)
+    optimizer = optim.Adam(model.parameters(), lr=configs.init_lr, eps=configs.adam_eps,
+                           weight_decay=configs.adam_weight_decay)
+    # dropout and augmentation draw different numbers on every rank
+    torch.manual_seed(seed + 1 + rank)
+
+    augment = PoseAugment.from_config(configs)
+
+    epoch_train_losses = []
+    epoch_train_scores = []
+    epoch_val_losses = []
+    epoch_val_scores = []
+    best_test_acc = 0
+    start_epoch = 0
+
+    ckpt_manager = None
+    if is_main:
+        ckpt_manager = CheckpointManager(checkpoint_dir, prefix='gcn', keep_last=configs.keep_last,
+                                         keep_best=configs.keep_best, mode='max')
+    if resume:
+        # rank 0 reads the checkpoint and hands it to the other ranks
+        checkpoint = [ckpt_manager.load(None if resume == 'latest' else resume) if is_main else None]
+        if world_size > 1:
+            dist.broadcast_object_list(checkpoint, src=0)
+        checkpoint = checkpoint[0]
+        if checkpoint is None:
+            if is_main:
+                print('no checkpoint to resume from in {}, starting from scratch'.format(checkpoint_dir))
+        else:
+            model.load_state_dict(checkpoint['model'])
+            optimizer.load_state_dict(checkpoint['optimizer'])
+            start_epoch = checkpoint['epoch'] + 1
+            best_test_acc = checkpoint['best_test_acc']
+            epoch_train_losses, epoch_train_scores, epoch_val_losses, epoch_val_scores = checkpoint['history']
+            if is_main:
+                print('resumed from epoch {}'.format(checkpoint['epoch']))
+
+    ddp_model = DistributedDataParallel(model)
+
+    # only rank 0 prints training progress
+    log_interval = configs.log_interval if is_main else len(train_data_loader) + 1
+
+    for epoch in range(start_epoch, int(configs.max_epochs)):
+        train_sampler.set_epoch(epoch)
+        train_losses, train_scores, _, _ = train(log_interval, ddp_model, train_data_loader, optimizer, epoch,
+                                                 device='cpu', augment=augment, world_size=world_size)
+
+        # epoch means of the training metrics over all ranks
+        train_stats = torch.tensor([np.mean(train_losses), np.mean(train_scores)], dtype=torch.float64)
+        if world_size > 1:
+            dist.all_reduce(train_stats)
+        train_stats /= world_size
+
+        val_loss, val_score = distributed_validation(model, val_data_loader, configs.num_copies, num_classes,
+                                                     world_size)
+        if not is_main:
+            continue
+
+        print('\nEpoch {}: train loss {:.4f}, train acc {:.2f}%, val loss {:.4f}, val acc {:.2f}%\n'.format(
+            epoch + 1, train_stats[0].item(), 100 * train_stats[1].item(), val_loss, 100 * val_score[0]))
+        logging.info('========================\nEpoch: {} Average loss: {:.4f}'.format(epoch, val_loss))
+        for n, score in zip(TOP_N, val_score):
+            logging.info('Top-{} acc: {:.4f}'.format(n, 100 * score))
+
+        epoch_train_losses.append(train_stats[0].item())
+        epoch_train_scores.append(train_stats[1].item())
+        epoch_val_losses.append(val_loss)
+        epoch_val_scores.append(val_score[0])
+
+        if val_score[0] > best_test_acc:
+            best_test_acc = val_score[0]
+            ckpt_manager.save_weights(model.state_dict(), os.path.join(
+                checkpoint_dir, 'gcn_epoch={}_val_acc={}.pth'.format(epoch, best_test_acc)))
+
+        ckpt_manager.save(epoch, {'model': model.state_dict(),
+                                  'optimizer': optimizer.state_dict(),
+                                  'epoch': epoch,
+                                  'best_test_acc': best_test_acc,
+                                  'history': (epoch_train_losses, epoch_train_scores,
+                                              epoch_val_losses, epoch_val_scores)}, score=val_score[0])
+
+    if is_main:
+        ckpt_manager.close()
+        os.makedirs('output', exist_ok=True)
+        np.save('output/epoch_training_losses.npy', np.array(epoch_train_losses))
+        np.save('output/epoch_training_scores.npy', np.array(epoch_train_scores))
+        np.save('output/epoch_test_loss.npy', np.array(epoch_val_losses))
+        np.save('output/epoch_test_score.npy', np.array(epoch_val_scores))
+        print('best val acc {:.2f}%'.format(100 * best_test_acc))
+
+
+def worker(rank, world_size, args):
+    # set before any other torch work in this process
+    torch.set_num_interop_threads(args.interop_threads)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        for subset in args.subset:
+            split_file = os.path.join(args.root, 'data/splits/{}.json'.format(subset))
+            pose_data_root = os.path.join(args.root, 'data/pose_per_individual_videos')
+            configs = Config(os.path.join(args.config_dir, '{}.ini'.format(subset)))
+
+            if rank == 0:
+                os.makedirs('output', exist_ok=True)
+                logging.basicConfig(filename='output/{}_ddp.log'.format(subset), level=logging.DEBUG,
+                                    filemode='w+', force=True)
+                print('training {} on {} ranks x {} threads'.format(subset, world_size, args.threads))
+
+            run(rank, world_size, split_file, pose_data_root, configs,
+                checkpoint_dir=os.path.join('checkpoints', subset + '_ddp'), resume=args.resume,
+                pose_store=PoseStore(args.pose_store) if args.pose_store else None, threads=args.threads,
+                num_workers=args.num_workers, seed=args.seed)
+            dist.barrier()
+    finally:
+        dist.destroy_process_group()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subset', type=str, nargs='+', default=['asl100'],
+                        help='subsets to train one after the other, e.g. asl100 asl300 asl1000 asl2000')
+    parser.add_argument('--root', type=str, default='/media/anudisk/github/WLASL')
+    parser.add_argument('--config_dir', type=str, default='configs')
+    parser.add_argument('--nprocs', type=int, default=2, help='training processes (ignored under torchrun)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='intra-op threads per rank (default: cpu count / processes)')
+    parser.add_argument('--interop_threads', type=int, default=1, help='inter-op threads per rank')
+    parser.add_argument('--num_workers', type=int, default=0, help='DataLoader workers per rank')
+    parser.add_argument('--pose_store', type=str, default=None,
+                        help='read poses from a store written by gen_features.py instead of the json files')
+    parser.add_argument('--resume', type=str, nargs='?', const='latest', default=None,
+                        help='resume from the latest checkpoint, or from the given checkpoint file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if 'RANK' in os.environ:
+        # started by torchrun, one process per rank
+        world_size = int(os.environ['WORLD_SIZE'])
+        if args.threads is None:
+            args.threads = max((os.cpu_count() or 1) // int(os.environ.get('LOCAL_WORLD_SIZE', world_size)), 1)
+        worker(int(os.environ['RANK']), world_size, args)
+    else:
+        os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+        os.environ.setdefault('MASTER_PORT', '29500')
+        if args.threads is None:
+            args.threads = max((os.cpu_count() or 1) // args.nprocs, 1)
+        mp.spawn(worker, args=(args.nprocs, args), nprocs=args.nprocs)
@@ -1,4 +1,5 @@
 import os
+import time
 
 import numpy as np
 import torch
@@ -6,18 +7,71 @@ import torch.nn.functional as F
 from sklearn.metrics import accuracy_score
 
 
-def train(log_interval, model, train_loader, optimizer, epoch):
+class MetricAccumulator(object):
+    """Per-batch training metrics kept on the device, so that recording them never waits for the GPU.
+
+    Only running() (called every log_interval batches) and summary() (at the end of the epoch) copy to the host.
+    With `num_classes`, a confusion matrix (rows: ground truth) is accumulated as well.
+    """
+
+    def __init__(self, num_classes=None):
+        self.num_classes = num_classes
+        self.losses = []
+        self.correct = []
+        self.batch_sizes = []
+        self.labels = []
+        self.preds = []
+        self.confusion = None
+
+    def update(self, loss, out, y):
+        y_pred = torch.max(out.detach(), 1)[1]
+        self.losses.append(loss.detach())
+        self.correct.append((y_pred == y).sum())
+        self.batch_sizes.append(y.size(0))
+        self.labels.append(y)
+        self.preds.append(y_pred)
+
+        if self.num_classes is not None:
+            counts = torch.bincount(y * self.num_classes + y_pred, minlength=self.num_classes ** 2)
+            counts = counts.view(self.num_classes, self.num_classes)
+            self.confusion = counts if self.confusion is None else self.confusion + counts
+
+    def running(self):
+        """(loss, accuracy) of the last batch; synchronizes with the device."""
+        return self.losses[-1].item(), self.correct[-1].item() / float(self.batch_sizes[-1])
+
+    def summary(self):
+        """Per-batch losses and accuracies, all labels and predictions (and the confusion matrix) as numpy arrays."""
+        if not self.losses:
+            return {'losses': np.zeros(0), 'scores': np.zeros(0), 'labels': np.zeros(0, dtype=np.int64),
+                    'preds': np.zeros(0, dtype=np.int64), 'confusion': None}
+        correct = torch.stack(self.correct).cpu().numpy()
+        return {'losses': torch.stack(self.losses).cpu().numpy(),
+                'scores': correct / np.asarray(self.batch_sizes, dtype=np.float64),
+                'labels': torch.cat(self.labels).cpu().numpy(),
+                'preds': torch.cat(self.preds).cpu().numpy(),
+                'confusion': self.confusion.cpu().numpy() if self.confusion is not None else None}
+
+
+def train(log_interval, model, train_loader, optimizer, epoch, profiler=None, profile_interval=100, device='cuda',
+          augment=None, world_size=1):
     # set model as training mode
-    losses = []
-    scores = []
-    train_labels = []
-    train_preds = []
+    model.train()
+    metrics = MetricAccumulator()
 
     N_count = 0  # counting total trained sample in one epoch
+    fetch_start = time.perf_counter()
     for batch_idx, data in enumerate(train_loader):
+        batch_ready = time.perf_counter()
+        if profiler is not None:
+            profiler.add('data_wait', batch_ready - fetch_start)
+
         X, y, video_ids = data
         # distribute data to device
-        X, y = X.cuda(), y.cuda().view(-1, )
+        X, y = X.to(device, non_blocking=True), y.to(device, non_blocking=True).view(-1, )
+        if augment is not None:
+            # batched, on the device (pose_augment.PoseAugment)
+            X = augment(X)
 
         N_count += X.size(0)
 
@@ -27,18 +81,8 @@ def train(log_interval, model, train_loader, optimizer, epoch):
         loss = compute_loss(out, y)
 
         # loss = F.cross_entropy(output, y)
-        losses.append(loss.item())
-
-        # to compute accuracy
-        y_pred = torch.max(out, 1)[1]  # y_pred != output
-
-        step_score = accuracy_score(y.cpu().data.squeeze().numpy(), y_pred.cpu().data.squeeze().numpy())
-
-        # collect prediction labels
-        train_labels.extend(y.cpu().data.squeeze().tolist())
-        train_preds.extend(y_pred.cpu().data.squeeze().tolist())
-
-        scores.append(step_score)  # computed on CPU
+        # recorded on the device; nothing is copied to the host until the next log line
+        metrics.update(loss, out, y)
 
         loss.backward()
 
@@ -55,14 +99,33 @@ def train(log_interval, model, train_loader, optimizer, epoch):
 
         # show information
         if (batch_idx + 1) % log_interval == 0:
+            step_loss, step_score = metrics.running()
+            # with a DistributedSampler every rank sees 1 / world_size of the dataset
             print('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}, Accu: {:.6f}%'.format(
-                epoch + 1, N_count, len(train_loader.dataset), 100. * (batch_idx + 1) / len(train_loader), loss.item(),
-                100 * step_score))
+                epoch + 1, N_count * world_size, len(train_loader.dataset), 100. * (batch_idx + 1) / len(train_loader),
+                step_loss, 100 * step_score))
+
+        if profiler is not None:
+            fetch_start = time.perf_counter()
+            profiler.add('step', fetch_start - batch_ready)
+            if (batch_idx + 1) % profile_interval == 0:
+                print(profiler.report())
 
-    return losses, scores, train_labels, train_preds
+    summary = metrics.summary()
+    return summary['losses'], summary['scores'], summary['labels'], summary['preds']
 
 
-def validation(model, test_loader, epoch, save_to):
+def multi_view_forward(model, X, num_copies):
+    """Mean output over the `num_copies` clips laid side by side in X (B x 55 x num_copies * stride), computed in
+    one forward pass with the copies folded into the batch dimension."""
+    batch_size, num_nodes, length = X.size()
+    stride = length // num_copies
+    views = X[:, :, :num_copies * stride].reshape(batch_size, num_nodes, num_copies, stride)
+    views = views.permute(0, 2, 1, 3).reshape(batch_size * num_copies, num_nodes, stride)
+    return model(views).view(batch_size, num_copies, -1).mean(dim=1)
+
+
+def validation(model, test_loader, epoch, save_to, num_copies=4):
     # set model as testing mode
     model.eval()
 
@@ -72,25 +135,13 @@ def validation(model, test_loader, epoch, save_to):
     all_video_ids = []
     all_pool_out = []
 
-    num_copies = 4
-
     with torch.no_grad():
         for batch_idx, data in enumerate(test_loader):
             # distribute data to device
             X, y, video_ids = data
             X, y = X.cuda(), y.cuda().view(-1, )
 
-            all_output = []
-
-            stride = X.size()[2] // num_copies
-
-            for i in range(num_copies):
-                X_slice = X[:, :, i * stride: (i+1) * stride]
-                output = model(X_slice)
-                all_output.append(output)
-
-            all_output = torch.stack(all_output, dim=1)
-            output = torch.mean(all_output, dim=1)
+            output = multi_view_forward(model, X, num_copies)
 
             # output = model(X)  # output has dim = (batch, number of classes)
 